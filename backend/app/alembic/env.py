@@ -32,7 +32,7 @@ target_metadata = Base.metadata
 
 
 def get_url():
-    return settings.db_url
+    return settings.sync_db_url
 
 
 def run_migrations_offline():
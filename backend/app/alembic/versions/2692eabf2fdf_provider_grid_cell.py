@@ -0,0 +1,40 @@
+"""provider grid cell
+
+Revision ID: 2692eabf2fdf
+Revises: f500ac6d0f99
+Create Date: 2026-10-18 09:31:07.662310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2692eabf2fdf'
+down_revision: Union[str, None] = 'f500ac6d0f99'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copies of api.geo.GRID_CELL_DEGREES and api.geo.GRID_COLUMNS at the time of this revision
+GRID_CELL_DEGREES = 0.5
+GRID_COLUMNS = 1000
+
+
+def upgrade() -> None:
+    op.add_column("providers", sa.Column("grid_cell", sa.BigInteger(), nullable=True))
+    op.execute(
+        sa.text(
+            "UPDATE providers SET grid_cell = "
+            "floor((latitude + 90) / :cell_degrees)::bigint * :columns + floor((longitude + 180) / :cell_degrees)::bigint "
+            "WHERE grid_cell IS NULL"
+        ).bindparams(cell_degrees=GRID_CELL_DEGREES, columns=GRID_COLUMNS)
+    )
+    op.alter_column("providers", "grid_cell", nullable=False)
+    op.create_index(op.f("ix_providers_grid_cell"), "providers", ["grid_cell"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_providers_grid_cell"), table_name="providers")
+    op.drop_column("providers", "grid_cell")
@@ -0,0 +1,37 @@
+"""message paging by created
+
+Revision ID: 3c7f2b9e41d8
+Revises: ee8dce2906ad
+Create Date: 2026-10-18 19:42:07.318205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7f2b9e41d8'
+down_revision: Union[str, None] = 'ee8dce2906ad'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Built CONCURRENTLY, like ee8dce2906ad, so messages can still be inserted meanwhile. That needs the
+# autocommit block, which commits the new column first.
+def upgrade() -> None:
+    # Existing messages all get the migration time, and so keep their message_id order among themselves
+    op.add_column("messages", sa.Column("created", sa.DateTime(), nullable=False, server_default=sa.func.now()))
+    with op.get_context().autocommit_block():
+        op.create_index("ix_messages_mailbox_id_created_message_id", "messages", ["mailbox_id", "created", "message_id"], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index("ix_messages_mailbox_id_message_id", table_name="messages", postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_messages_mailbox_id_message_id", "messages", ["mailbox_id", "message_id"], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index("ix_messages_mailbox_id_created_message_id", table_name="messages", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("messages", "created")
@@ -0,0 +1,47 @@
+"""access token digests
+
+Revision ID: 58578996b550
+Revises: ab5486c08e13
+Create Date: 2026-10-18 13:02:44.581930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '58578996b550'
+down_revision: Union[str, None] = 'ab5486c08e13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TOKEN_TABLES = ("patient_access_tokens", "provider_access_tokens")
+
+
+# Existing rows hold salted bcrypt hashes, which can't be turned into digests, so the
+# tables are recreated and everyone signs in again.
+def upgrade() -> None:
+    for table_name in TOKEN_TABLES:
+        op.drop_table(table_name)
+        op.create_table(
+            table_name,
+            sa.Column("token_digest", postgresql.BYTEA(), primary_key=True),
+            sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+            sa.Column("expires_at", sa.DateTime(), nullable=False),
+        )
+        op.create_index(op.f(f"ix_{table_name}_user_id"), table_name, ["user_id"], unique=False)
+        op.create_index(op.f(f"ix_{table_name}_expires_at"), table_name, ["expires_at"], unique=False)
+
+
+def downgrade() -> None:
+    for table_name in TOKEN_TABLES:
+        op.drop_table(table_name)
+        op.create_table(
+            table_name,
+            sa.Column("instance_id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+            sa.Column("token_hash", sa.String(), primary_key=True),
+        )
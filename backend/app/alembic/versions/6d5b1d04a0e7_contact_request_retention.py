@@ -0,0 +1,32 @@
+"""contact request retention
+
+Revision ID: 6d5b1d04a0e7
+Revises: 93e5554fb424
+Create Date: 2026-10-18 18:05:37.912664
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d5b1d04a0e7'
+down_revision: Union[str, None] = '93e5554fb424'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Existing rows keep a NULL fingerprint, so they're only ever culled by age
+def upgrade() -> None:
+    op.add_column("contact_requests", sa.Column("sender_fingerprint", postgresql.BYTEA(), nullable=True))
+    op.create_index(op.f("ix_contact_requests_created"), "contact_requests", ["created"], unique=False)
+    op.create_index("ix_contact_requests_mailbox_id_sender_fingerprint", "contact_requests", ["mailbox_id", "sender_fingerprint"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_contact_requests_mailbox_id_sender_fingerprint", table_name="contact_requests")
+    op.drop_index(op.f("ix_contact_requests_created"), table_name="contact_requests")
+    op.drop_column("contact_requests", "sender_fingerprint")
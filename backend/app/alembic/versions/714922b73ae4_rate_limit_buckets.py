@@ -0,0 +1,34 @@
+"""rate limit buckets
+
+Revision ID: 714922b73ae4
+Revises: 6d5b1d04a0e7
+Create Date: 2026-10-18 18:48:20.517309
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '714922b73ae4'
+down_revision: Union[str, None] = '6d5b1d04a0e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rate_limit_buckets",
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("tokens", sa.Float(), nullable=False),
+        sa.Column("allowed", sa.Boolean(), nullable=False),
+        sa.Column("updated", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index(op.f("ix_rate_limit_buckets_updated"), "rate_limit_buckets", ["updated"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_rate_limit_buckets_updated"), table_name="rate_limit_buckets")
+    op.drop_table("rate_limit_buckets")
@@ -0,0 +1,26 @@
+"""message mailbox index
+
+Revision ID: 93e5554fb424
+Revises: d1639d2efde5
+Create Date: 2026-10-18 17:26:50.441932
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '93e5554fb424'
+down_revision: Union[str, None] = 'd1639d2efde5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_messages_mailbox_id_message_id", "messages", ["mailbox_id", "message_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_mailbox_id_message_id", table_name="messages")
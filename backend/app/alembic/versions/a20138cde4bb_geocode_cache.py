@@ -0,0 +1,40 @@
+"""geocode cache
+
+Revision ID: a20138cde4bb
+Revises: 2692eabf2fdf
+Create Date: 2026-10-18 10:04:52.918377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a20138cde4bb'
+down_revision: Union[str, None] = '2692eabf2fdf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "geocode_cache",
+        sa.Column("street_address", sa.String(), primary_key=True),
+        sa.Column("city", sa.String(), primary_key=True),
+        sa.Column("state_abbreviation", sa.String(), primary_key=True),
+        sa.Column("latitude", sa.Float(), nullable=False),
+        sa.Column("longitude", sa.Float(), nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("last_hit", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("hits", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index(op.f("ix_geocode_cache_created"), "geocode_cache", ["created"], unique=False)
+    op.create_index(op.f("ix_geocode_cache_last_hit"), "geocode_cache", ["last_hit"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_geocode_cache_last_hit"), table_name="geocode_cache")
+    op.drop_index(op.f("ix_geocode_cache_created"), table_name="geocode_cache")
+    op.drop_table("geocode_cache")
@@ -0,0 +1,28 @@
+"""provider updated timestamp
+
+Revision ID: ab5486c08e13
+Revises: a20138cde4bb
+Create Date: 2026-10-18 11:26:15.037551
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ab5486c08e13'
+down_revision: Union[str, None] = 'a20138cde4bb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("providers", sa.Column("updated", sa.DateTime(), nullable=False, server_default=sa.func.now()))
+    op.create_index(op.f("ix_providers_updated"), "providers", ["updated"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_providers_updated"), table_name="providers")
+    op.drop_column("providers", "updated")
@@ -0,0 +1,42 @@
+"""mailbox insert notifications
+
+Revision ID: d1639d2efde5
+Revises: ffd13cb11730
+Create Date: 2026-10-18 16:40:12.873105
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd1639d2efde5'
+down_revision: Union[str, None] = 'ffd13cb11730'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, payload) pairs, see api.mailbox_notifications
+NOTIFYING_TABLES = (("contact_requests", "contact"), ("messages", "message"))
+
+
+# Postgres folds identical notifications within a transaction, so a fan-out or batch insert
+# wakes each mailbox's listeners once, on commit.
+def upgrade() -> None:
+    op.execute(sa.text("""
+        CREATE OR REPLACE FUNCTION notify_mailbox_insert() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('mailbox_' || replace(NEW.mailbox_id::text, '-', ''), TG_ARGV[0]);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    for table_name, payload in NOTIFYING_TABLES:
+        op.execute(sa.text(f"CREATE TRIGGER {table_name}_notify_mailbox AFTER INSERT ON {table_name} FOR EACH ROW EXECUTE FUNCTION notify_mailbox_insert('{payload}')"))
+
+
+def downgrade() -> None:
+    for table_name, _ in NOTIFYING_TABLES:
+        op.execute(sa.text(f"DROP TRIGGER IF EXISTS {table_name}_notify_mailbox ON {table_name}"))
+    op.execute(sa.text("DROP FUNCTION IF EXISTS notify_mailbox_insert()"))
@@ -0,0 +1,46 @@
+"""hot lookup indexes
+
+Revision ID: ee8dce2906ad
+Revises: 714922b73ae4
+Create Date: 2026-10-18 19:30:04.226718
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ee8dce2906ad'
+down_revision: Union[str, None] = '714922b73ae4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (name, table, columns, unique, partial index condition)
+INDEXES = (
+    ("ix_providers_email", "providers", ["email"], True, None),
+    ("ix_patients_email", "patients", ["email"], True, None),
+    ("ix_providers_search", "providers", ["provider_type", "state_abbreviation", "grid_cell"], False, None),
+    ("ix_device_sets_provider_id", "device_sets", ["provider_id"], True, "provider_id IS NOT NULL"),
+    ("ix_device_sets_patient_id", "device_sets", ["patient_id"], True, "patient_id IS NOT NULL"),
+    ("ix_devices_device_set_id", "devices", ["device_set_id"], False, None),
+    ("ix_mailboxes_device_id", "mailboxes", ["device_id"], True, None),
+    ("ix_contact_mailboxes_device_id", "contact_mailboxes", ["device_id"], True, None),
+)
+
+
+# CONCURRENTLY can't run inside a transaction, hence the autocommit block, and leaves an INVALID
+# index behind if it fails. The unique ones fail if duplicates already exist (e.g. two accounts
+# with the same email): resolve those, DROP the invalid index and upgrade again.
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table_name, columns, unique, where in INDEXES:
+            op.create_index(name, table_name, columns, unique=unique, postgresql_where=sa.text(where) if where else None,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table_name, _, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table_name, postgresql_concurrently=True, if_exists=True)
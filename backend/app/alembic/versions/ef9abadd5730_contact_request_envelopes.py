@@ -0,0 +1,30 @@
+"""contact request envelopes
+
+Revision ID: ef9abadd5730
+Revises: 58578996b550
+Create Date: 2026-10-18 15:21:09.304417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ef9abadd5730'
+down_revision: Union[str, None] = '58578996b550'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Envelope rows carry the patient id inside patient_message_encrypted
+    op.alter_column("contact_requests", "patient_id_encrypted", existing_type=postgresql.BYTEA(), nullable=True)
+
+
+def downgrade() -> None:
+    # Envelope rows can't be expressed in the legacy format, and clients can't decode them without this column anyway
+    op.execute(sa.text("DELETE FROM contact_requests WHERE patient_id_encrypted IS NULL"))
+    op.alter_column("contact_requests", "patient_id_encrypted", existing_type=postgresql.BYTEA(), nullable=False)
@@ -0,0 +1,126 @@
+"""baseline schema
+
+Revision ID: f500ac6d0f99
+Revises: 
+Create Date: 2026-10-18 09:12:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'f500ac6d0f99'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Databases created before migrations were introduced already have these tables
+# (from metadata.create_all), so only create the ones that are missing.
+def upgrade() -> None:
+    existing_tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "providers" not in existing_tables:
+        op.create_table(
+            "providers",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("provider_type", sa.Enum("THERAPIST", "PSYCHIATRIST", name="providertype"), nullable=False),
+            sa.Column("remote_available", sa.Boolean(), nullable=False),
+            sa.Column("accepting_new_patients", sa.Enum("RED", "YELLOW", "GREEN", name="acceptingnewpatients"), nullable=False),
+            sa.Column("gender_identity", sa.Enum("MALE", "FEMALE", "OTHER", name="providergenderidentity"), nullable=False),
+            sa.Column("given_name", sa.String(50), nullable=False),
+            sa.Column("family_name", sa.String(50), nullable=False),
+            sa.Column("formatted_address", sa.String(), nullable=False),
+            sa.Column("latitude", sa.Float(), nullable=False),
+            sa.Column("longitude", sa.Float(), nullable=False),
+            sa.Column("state_abbreviation", sa.String(), nullable=False),
+            sa.Column("email", sa.String(254), nullable=False),
+            sa.Column("password_hash", sa.String(), nullable=False),
+        )
+
+    if "patients" not in existing_tables:
+        op.create_table(
+            "patients",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("given_name", sa.String(50), nullable=False),
+            sa.Column("family_name", sa.String(50), nullable=False),
+            sa.Column("is_assisted_account", sa.Boolean(), nullable=False),
+            sa.Column("guardian_given_name", sa.String(50), nullable=True),
+            sa.Column("guardian_family_name", sa.String(50), nullable=True),
+            sa.Column("email", sa.String(254), nullable=False),
+            sa.Column("password_hash", sa.String(), nullable=False),
+        )
+
+    if "device_sets" not in existing_tables:
+        op.create_table(
+            "device_sets",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("user_type", sa.Enum("PATIENT", "PROVIDER", name="usertype"), nullable=False),
+            sa.Column("provider_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("providers.id", ondelete="CASCADE"), nullable=True),
+            sa.Column("patient_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("patients.id", ondelete="CASCADE"), nullable=True),
+        )
+
+    if "devices" not in existing_tables:
+        op.create_table(
+            "devices",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("identity_public_key", sa.String(), nullable=False),
+            sa.Column("signed_pre_key", sa.String(), nullable=False),
+            sa.Column("device_set_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("device_sets.id", ondelete="CASCADE"), nullable=True),
+        )
+
+    if "mailboxes" not in existing_tables:
+        op.create_table(
+            "mailboxes",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("device_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("devices.id", ondelete="CASCADE"), nullable=False),
+        )
+
+    if "contact_mailboxes" not in existing_tables:
+        op.create_table(
+            "contact_mailboxes",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("device_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("devices.id", ondelete="CASCADE"), nullable=False),
+        )
+
+    if "messages" not in existing_tables:
+        op.create_table(
+            "messages",
+            sa.Column("message_id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("message_encrypted", postgresql.BYTEA(), nullable=False),
+            sa.Column("sender_id", postgresql.UUID(as_uuid=True), nullable=False),
+            sa.Column("sender_device_id", postgresql.UUID(as_uuid=True), nullable=False),
+            sa.Column("sender_identity_key", sa.String(), nullable=False),
+            sa.Column("sender_ephemeral_key", sa.String(), nullable=True),
+            sa.Column("chain_key", sa.String(), nullable=True),
+            sa.Column("mailbox_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("mailboxes.id", ondelete="CASCADE"), nullable=False),
+        )
+
+    if "contact_requests" not in existing_tables:
+        op.create_table(
+            "contact_requests",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("created", sa.DateTime(), nullable=False),
+            sa.Column("mailbox_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("contact_mailboxes.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("patient_id_encrypted", postgresql.BYTEA(), nullable=False),
+            sa.Column("patient_message_encrypted", postgresql.BYTEA(), nullable=False),
+        )
+
+    for table_name in ("patient_access_tokens", "provider_access_tokens"):
+        if table_name not in existing_tables:
+            op.create_table(
+                table_name,
+                sa.Column("instance_id", postgresql.UUID(as_uuid=True), primary_key=True),
+                sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+                sa.Column("token_hash", sa.String(), primary_key=True),
+            )
+
+
+def downgrade() -> None:
+    for table_name in ("provider_access_tokens", "patient_access_tokens", "contact_requests", "messages", "contact_mailboxes", "mailboxes", "devices", "device_sets", "patients", "providers"):
+        op.drop_table(table_name)
+    for enum_name in ("usertype", "providergenderidentity", "acceptingnewpatients", "providertype"):
+        sa.Enum(name=enum_name).drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,26 @@
+"""contact request paging index
+
+Revision ID: ffd13cb11730
+Revises: ef9abadd5730
+Create Date: 2026-10-18 15:58:31.120544
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ffd13cb11730'
+down_revision: Union[str, None] = 'ef9abadd5730'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_contact_requests_mailbox_id_created_id", "contact_requests", ["mailbox_id", "created", "id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_contact_requests_mailbox_id_created_id", table_name="contact_requests")
@@ -1,12 +1,66 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from api.mailbox_notifications import mailbox_listener
+from api.metrics import MetricsMiddleware
+from api.maps import maps_client
+from api.routes.internal import router as internal_router
 from api.routes.locate import router as locate_router
 from api.routes.message import router as message_router
 from api.routes.patient import router as patient_router
 from api.routes.provider import router as provider_router
+from api.search_engine import (
+    PROVIDER_DELETIONS_CHANNEL,
+    keep_provider_search_engine_synced,
+    provider_search_engine,
+    sync_provider_search_engine,
+)
+from api.zip_centroids import load_zip_centroids
+from config.config import settings
+from database.database import check_schema_revision, dispose_engines, get_async_engine
+from database.retention import keep_culling_contact_requests
+from security.passwords import password_hasher
+from security.tokens import keep_sweeping_expired_tokens
+from security.user_cache import REVOCATIONS_CHANNEL, user_cache
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import multiprocess
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_async_engine()
+    load_zip_centroids()
+    if settings.schema_check != "off" and not await check_schema_revision() and settings.schema_check == "fail":
+        raise RuntimeError("Database schema is out of date, run `alembic upgrade head`")
+    mailbox_listener.on(REVOCATIONS_CHANNEL, user_cache.on_revocation)
+    if settings.provider_search_backend == "memory":
+        mailbox_listener.on(PROVIDER_DELETIONS_CHANNEL, provider_search_engine.on_deletion)
+
+    background_tasks = [asyncio.create_task(keep_sweeping_expired_tokens())]
+    if settings.contact_retention_seconds > 0:
+        background_tasks.append(asyncio.create_task(keep_culling_contact_requests()))
+    if settings.mailbox_notifications:
+        background_tasks.append(asyncio.create_task(mailbox_listener.run()))
+    if settings.provider_search_backend == "memory":
+        await sync_provider_search_engine()
+        background_tasks.append(asyncio.create_task(keep_provider_search_engine_synced()))
 
-app = FastAPI()
+    yield
 
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    password_hasher.shutdown()
+    await maps_client.aclose()
+    await dispose_engines()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid()) # as prometheus_client asks of each exiting worker
+
+app = FastAPI(lifespan=lifespan)
+
+app.include_router(internal_router)
 app.include_router(locate_router)
 app.include_router(message_router)
 app.include_router(patient_router)
@@ -22,4 +76,6 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-)
\ No newline at end of file
+)
+
+app.add_middleware(MetricsMiddleware) # outermost, so CORS preflights are counted too
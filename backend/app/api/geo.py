@@ -0,0 +1,64 @@
+from math import cos, floor, radians
+from typing import List, Tuple
+
+import numpy as np
+
+# Providers are bucketed into fixed lat/lon cells so that a radius search only has
+# to touch the handful of cells overlapping its bounding box.
+GRID_CELL_DEGREES = 0.5
+GRID_COLUMNS = 1000 # must exceed 360 / GRID_CELL_DEGREES so row and column never overlap
+
+# Smallest real-world value, so bounding boxes err on the side of being too large
+MILES_PER_DEGREE_LATITUDE = 68.7
+MILES_PER_DEGREE_LONGITUDE_AT_EQUATOR = 69.17
+
+EARTH_RADIUS_MILES = 3958.7613 # matches haversine.Unit.MILES
+
+# (min_latitude, max_latitude, min_longitude, max_longitude). A box crossing the antimeridian has min_longitude > max_longitude.
+BoundingBox = Tuple[float, float, float, float]
+
+def grid_cell(latitude: float, longitude: float) -> int:
+    """Returns the integer key of the grid cell containing the given coordinates.
+
+    Must stay in sync with the SQL expression used to backfill providers.grid_cell."""
+    row = floor((latitude + 90) / GRID_CELL_DEGREES)
+    column = floor((longitude + 180) / GRID_CELL_DEGREES)
+    return row * GRID_COLUMNS + column
+
+def bounding_box(latitude: float, longitude: float, radius_miles: float) -> BoundingBox:
+    """Returns a box guaranteed to contain every point within radius_miles of the origin"""
+    latitude_delta = radius_miles / MILES_PER_DEGREE_LATITUDE
+    min_latitude = max(latitude - latitude_delta, -90.0)
+    max_latitude = min(latitude + latitude_delta, 90.0)
+
+    # Longitude degrees shrink away from the equator, so size the box for the widest latitude it spans
+    widest_latitude = max(abs(min_latitude), abs(max_latitude))
+    miles_per_degree_longitude = MILES_PER_DEGREE_LONGITUDE_AT_EQUATOR * cos(radians(widest_latitude))
+    if miles_per_degree_longitude <= radius_miles / 180:
+        return (min_latitude, max_latitude, -180.0, 180.0)
+    longitude_delta = radius_miles / miles_per_degree_longitude
+    return (min_latitude, max_latitude, wrap_longitude(longitude - longitude_delta), wrap_longitude(longitude + longitude_delta))
+
+def wrap_longitude(longitude: float) -> float:
+    """The same meridian in [-180, 180)"""
+    return (longitude + 180) % 360 - 180
+
+def grid_cells_in_box(box: BoundingBox) -> List[int]:
+    """Returns the keys of every grid cell overlapping the given bounding box"""
+    min_latitude, max_latitude, min_longitude, max_longitude = box
+    min_cell = grid_cell(min_latitude, min_longitude)
+    max_cell = grid_cell(max_latitude, max_longitude)
+    min_row, min_column = divmod(min_cell, GRID_COLUMNS)
+    max_row, max_column = divmod(max_cell, GRID_COLUMNS)
+    if min_column <= max_column:
+        columns = list(range(min_column, max_column + 1))
+    else: # wraps past 180, the last column also holds longitude 180 itself
+        columns = list(range(min_column, int(360 / GRID_CELL_DEGREES) + 1)) + list(range(0, max_column + 1))
+    return [row * GRID_COLUMNS + column for row in range(min_row, max_row + 1) for column in columns]
+
+def haversine_miles(latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Vectorized great-circle distance in miles from one origin to every point in the given columns"""
+    origin_latitude, origin_longitude = radians(latitude), radians(longitude)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((latitudes - origin_latitude) / 2) ** 2 + cos(origin_latitude) * np.cos(latitudes) * np.sin((longitudes - origin_longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Tuple
+
+from api.maps import GeocodingClient, geocode_address
+from config.config import settings
+from database.database import AsyncDBSession
+from database.models.geocode import GeocodeCacheEntry
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+AddressKey = Tuple[str, str, str] # normalized (street_address, city, state_abbreviation)
+
+def normalize_address(street_address: str, city: str, state_abbreviation: str) -> AddressKey:
+    """Case, punctuation and whitespace insensitive key, so trivially different spellings share an entry"""
+    def normalize(value: str) -> str:
+        return " ".join(value.upper().replace(".", "").replace(",", " ").split())
+    return (normalize(street_address), normalize(city), normalize(state_abbreviation))
+
+@dataclass
+class GeocodeCacheStats:
+    memory_hits: int = 0
+    db_hits: int = 0
+    misses: int = 0
+    db_evictions: int = 0
+
+class GeocodeCache:
+    """Two-tier cache in front of geocode_address.
+
+    The first tier is a per-process LRU with a TTL. The second is the geocode_cache table,
+    shared by every worker, whose rows expire after geocode_cache_db_ttl_days and are trimmed
+    to geocode_cache_db_max_rows (least recently hit first). Only misses on both tiers reach
+    the geocoding client."""
+
+    EVICT_EVERY_N_INSERTS = 100
+
+    def __init__(self,
+                 client: GeocodingClient | None = None, # the Google Maps client, created on first miss
+                 session_factory: Callable[[], AsyncSession] = AsyncDBSession,
+                 memory_entries: int = settings.geocode_cache_memory_entries,
+                 memory_ttl_seconds: float = settings.geocode_cache_memory_ttl_seconds,
+                 db_ttl: timedelta = timedelta(days=settings.geocode_cache_db_ttl_days),
+                 db_max_rows: int = settings.geocode_cache_db_max_rows):
+        self.client = client
+        self.session_factory = session_factory
+        self.memory_entries = memory_entries
+        self.memory_ttl_seconds = memory_ttl_seconds
+        self.db_ttl = db_ttl
+        self.db_max_rows = db_max_rows
+        self.stats = GeocodeCacheStats()
+
+        self._memory: OrderedDict[AddressKey, Tuple[Tuple[float, float], float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts_since_eviction = 0
+
+    async def geocode(self, street_address: str, city: str, state_abbreviation: str) -> Tuple[float, float] | None:
+        key = normalize_address(street_address, city, state_abbreviation)
+
+        geocode = self._memory_get(key) # counts the memory hit
+        if geocode is not None:
+            return geocode
+
+        session: AsyncSession
+        async with self.session_factory() as session:
+            geocode = await self._db_get(session, key)
+        if geocode is not None:
+            self._count("db_hits")
+            self._memory_put(key, geocode)
+            return geocode
+
+        # Don't hold a pooled connection across the upstream round trip. MapsUnavailableException propagates.
+        self._count("misses")
+        geocode = await geocode_address(street_address, city, state_abbreviation, client=self.client)
+        if geocode is None:
+            return None # not cached, the address may simply have been mistyped
+
+        async with self.session_factory() as session:
+            await self._db_put(session, key, geocode)
+        self._memory_put(key, geocode)
+        return geocode
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    async def evict(self, session: AsyncSession) -> int:
+        """Deletes expired rows, then the least recently hit rows beyond db_max_rows. Returns the number deleted."""
+        evicted = (await session.execute(delete(GeocodeCacheEntry).where(GeocodeCacheEntry.created < func.now() - self.db_ttl))).rowcount
+
+        overflow = await session.scalar(select(func.count()).select_from(GeocodeCacheEntry)) - self.db_max_rows
+        if overflow > 0:
+            oldest = select(GeocodeCacheEntry.street_address, GeocodeCacheEntry.city, GeocodeCacheEntry.state_abbreviation).order_by(GeocodeCacheEntry.last_hit).limit(overflow)
+            evicted += (await session.execute(delete(GeocodeCacheEntry).where(
+                                            tuple_(GeocodeCacheEntry.street_address, GeocodeCacheEntry.city, GeocodeCacheEntry.state_abbreviation).in_(oldest)
+                                        ))).rowcount
+        await session.commit()
+        self._count("db_evictions", evicted)
+        return evicted
+
+    def _memory_get(self, key: AddressKey) -> Tuple[float, float] | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            geocode, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return geocode
+
+    def _count(self, counter: str, amount: int = 1):
+        # Under the memory lock, as callers on other threads share the stats
+        with self._lock:
+            setattr(self.stats, counter, getattr(self.stats, counter) + amount)
+
+    def _memory_put(self, key: AddressKey, geocode: Tuple[float, float]):
+        with self._lock:
+            self._memory[key] = (geocode, time.monotonic() + self.memory_ttl_seconds)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    async def _db_get(self, session: AsyncSession, key: AddressKey) -> Tuple[float, float] | None:
+        # Lookup and hit counter in one round trip
+        row = (await session.execute(update(GeocodeCacheEntry)
+                                .where(GeocodeCacheEntry.street_address == key[0],
+                                       GeocodeCacheEntry.city == key[1],
+                                       GeocodeCacheEntry.state_abbreviation == key[2],
+                                       GeocodeCacheEntry.created >= func.now() - self.db_ttl)
+                                .values(hits=GeocodeCacheEntry.hits + 1, last_hit=func.now())
+                                .returning(GeocodeCacheEntry.latitude, GeocodeCacheEntry.longitude)
+                              )).one_or_none()
+        await session.commit()
+        return (row[0], row[1]) if row else None
+
+    async def _db_put(self, session: AsyncSession, key: AddressKey, geocode: Tuple[float, float]):
+        # An expired row for the same key may still be present, so overwrite it
+        await session.execute(insert(GeocodeCacheEntry)
+                            .values(street_address=key[0], city=key[1], state_abbreviation=key[2], latitude=geocode[0], longitude=geocode[1], hits=0)
+                            .on_conflict_do_update(index_elements=["street_address", "city", "state_abbreviation"],
+                                                   set_={"latitude": geocode[0], "longitude": geocode[1], "created": func.now(), "last_hit": func.now(), "hits": 0})
+                        )
+        await session.commit()
+
+        with self._lock:
+            self._inserts_since_eviction += 1
+            due = self._inserts_since_eviction >= self.EVICT_EVERY_N_INSERTS
+            if due:
+                self._inserts_since_eviction = 0
+        if due:
+            await self.evict(session)
+
+geocode_cache = GeocodeCache()
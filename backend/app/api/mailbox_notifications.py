@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterable, List, Set
+from uuid import UUID
+
+from config.config import settings
+
+if TYPE_CHECKING:
+    import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Sent to subscribers when notifications may have been missed (on subscribing, and after the
+# listener reconnects), so they fetch their mailboxes once instead of waiting for the next insert
+RESYNC = "resync"
+
+# Sent to channel handlers (see MailboxListener.on) when the connection drops, until the next RESYNC
+DISCONNECTED = "disconnected"
+
+def mailbox_channel(mailbox_id: UUID) -> str:
+    """Matches the channel the contact_requests and messages insert triggers notify on"""
+    return f"mailbox_{mailbox_id.hex}"
+
+class MailboxSubscription:
+    """Mailbox kinds ("contact", "message" or RESYNC) notified since the last wait(). Repeats are coalesced, so a burst of inserts is one wakeup."""
+
+    def __init__(self, channels: List[str]):
+        self.channels = channels
+        self._pending: Set[str] = {RESYNC}
+        self._event = asyncio.Event()
+        self._event.set()
+
+    def notify(self, kind: str):
+        self._pending.add(kind)
+        self._event.set()
+
+    async def wait(self) -> Set[str]:
+        await self._event.wait()
+        self._event.clear()
+        pending, self._pending = self._pending, set()
+        return pending
+
+@dataclass
+class MailboxListenerStats:
+    notifications: int = 0
+    reconnects: int = 0
+
+class MailboxListener:
+    """A single LISTEN connection per worker, shared by every subscribed socket.
+
+    Channels are listened to while at least one subscription needs them. The connection is
+    opened by run(), which reconnects after it drops and tells every subscriber to resync.
+    It must reach Postgres directly: LISTEN doesn't survive PgBouncer's transaction pooling.
+
+    App-wide channels, like provider deletions, are handled through on() rather than subscriptions."""
+
+    def __init__(self, dsn: str | None = None, reconnect_seconds: float = 1.0):
+        self.dsn = dsn
+        self.reconnect_seconds = reconnect_seconds
+        self.stats = MailboxListenerStats()
+
+        self._connection: "asyncpg.Connection | None" = None
+        self._subscriptions: Dict[str, Set[MailboxSubscription]] = {}
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+        self._lock = asyncio.Lock() # serializes LISTEN/UNLISTEN against swapping in a new connection
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None
+
+    @property
+    def subscriptions(self) -> int:
+        return len({subscription for subscriptions in self._subscriptions.values() for subscription in subscriptions})
+
+    @property
+    def channels(self) -> int:
+        return len(self._subscriptions)
+
+    def on(self, channel: str, handler: Callable[[str], None]):
+        """Passes every payload notified on channel to handler. Call it before run(). The handler also
+        gets RESYNC each time listening starts, and DISCONNECTED when it stops."""
+        self._handlers[channel] = handler
+
+    @asynccontextmanager
+    async def subscribe(self, mailbox_ids: Iterable[UUID]) -> AsyncIterator[MailboxSubscription]:
+        subscription = MailboxSubscription([mailbox_channel(mailbox_id) for mailbox_id in mailbox_ids])
+        async with self._lock:
+            for channel in subscription.channels:
+                if channel not in self._subscriptions:
+                    self._subscriptions[channel] = set()
+                    await self._listen(channel, True)
+                self._subscriptions[channel].add(subscription)
+        try:
+            yield subscription
+        finally:
+            async with self._lock:
+                for channel in subscription.channels:
+                    subscribers = self._subscriptions.get(channel)
+                    if subscribers is None:
+                        continue
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+                        await self._listen(channel, False)
+
+    async def run(self):
+        """Holds the LISTEN connection for the lifetime of the app"""
+        import asyncpg # deferred, like the engine's driver, so importing the app stays cheap
+
+        while True:
+            lost = asyncio.Event()
+            connection = None
+            try:
+                # Connecting can take a while, so subscribers keep going meanwhile. They are
+                # only locked out while the channels subscribed so far are listened to.
+                connection = await asyncpg.connect(self.dsn or settings.listen_db_url)
+                connection.add_termination_listener(lambda _: lost.set())
+                async with self._lock:
+                    for channel in (*self._handlers, *self._subscriptions):
+                        await connection.add_listener(channel, self._on_notification)
+                    self._connection = connection
+                if self.stats.reconnects:
+                    self._notify_all(RESYNC) # anything sent while disconnected was missed
+                self._call_handlers(RESYNC)
+                await lost.wait()
+            except asyncio.CancelledError:
+                if connection is not None:
+                    await connection.close()
+                raise
+            except Exception:
+                logger.exception("Mailbox listener connection failed")
+                if connection is not None and self._connection is not connection:
+                    connection.terminate() # failed before it was swapped in
+            self._connection = None
+            self._call_handlers(DISCONNECTED)
+            self.stats.reconnects += 1
+            await asyncio.sleep(self.reconnect_seconds)
+
+    async def _listen(self, channel: str, listen: bool):
+        # While disconnected run() listens to every subscribed channel once it's back
+        if self._connection is None:
+            return
+        import asyncpg
+        try:
+            if listen:
+                await self._connection.add_listener(channel, self._on_notification)
+            else:
+                await self._connection.remove_listener(channel, self._on_notification)
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError):
+            logger.warning("Mailbox listener couldn't update %s, waiting for reconnect", channel)
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        self.stats.notifications += 1
+        if channel in self._handlers:
+            self._call_handlers(payload, channel)
+            return
+        for subscription in self._subscriptions.get(channel, ()):
+            subscription.notify(payload)
+
+    def _notify_all(self, kind: str):
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.notify(kind)
+
+    def _call_handlers(self, payload: str, channel: str | None = None):
+        for handler_channel, handler in self._handlers.items():
+            if channel is not None and handler_channel != channel:
+                continue
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception("Handler for %s failed on %r", handler_channel, payload)
+
+mailbox_listener = MailboxListener()
@@ -1,9 +1,16 @@
-from typing import Tuple
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Protocol, Tuple
 
+import httpx
 from config.config import settings
-from googlemaps import Client
+from monitoring.metrics import external_call_seconds
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
 
 class Geocode(BaseModel):
     latitude: float
@@ -21,14 +28,220 @@ class AddressNotValidException(Exception):
     """Returned when the google API does not confirm that the provided address is valid"""
     pass
 
-gmaps: Client = Client(key=settings.gmaps_key)
+class MapsUnavailableException(Exception):
+    """Raised when Google Maps can't be reached in time, keeps failing, or the circuit is open"""
+    pass
+
+class _RetryableError(Exception):
+    pass
+
+# Same as the googlemaps package retried on, plus rate limiting
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_API_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+# Bad or restricted key, retrying won't help
+UNAVAILABLE_STATUSES = {401, 403}
+UNAVAILABLE_API_STATUSES = {"REQUEST_DENIED"}
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failed calls, so callers fail fast instead of each waiting out the
+    deadline. After reset_seconds a single trial call is let through: success closes the circuit, failure reopens it."""
+
+    def __init__(self, failures: int = settings.maps_breaker_failures, reset_seconds: float = settings.maps_breaker_reset_seconds):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._consecutive_failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def release(self):
+        """Ends a trial call without a verdict"""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns whether this failure opened the circuit"""
+        self._consecutive_failures += 1
+        was_open = self._opened_at is not None
+        if self._trial_in_flight or self._consecutive_failures >= self.failures:
+            self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+        return not was_open and self._opened_at is not None
+
+@dataclass
+class MapsClientStats:
+    calls: int = 0
+    coalesced: int = 0 # calls that shared an identical call already in flight
+    upstream_attempts: int = 0
+    retries: int = 0
+    failures: int = 0 # calls that raised MapsUnavailableException after any retries
+    breaker_rejections: int = 0
+    breaker_opened: int = 0
+
+class MapsClient:
+    """Async Google Maps client for the geocoding and address validation APIs.
+
+    One pooled httpx client per worker, created on first use. Each call gets attempt_timeout_seconds per
+    attempt and deadline_seconds overall, retrying timeouts, connection errors, 429s and 5xxs with jittered
+    exponential backoff. Concurrent identical calls share one upstream request. Pass a transport (e.g.
+    httpx.MockTransport) or point the URLs elsewhere to run against a fake upstream."""
 
-def validate_address(street_address, city, state_abbreviation, zip_code, unit) -> ValidationData:
-    response = gmaps.addressvalidation(([street_address, unit] if unit else [street_address]) + [f"{city}, {state_abbreviation}, {zip_code}"], regionCode='US', enableUspsCass=True) # type: ignore
+    def __init__(self,
+                 key: str | None = None, # settings.gmaps_key when None
+                 transport: httpx.AsyncBaseTransport | None = None,
+                 geocode_url: str = settings.maps_geocode_url,
+                 address_validation_url: str = settings.maps_address_validation_url,
+                 max_connections: int = settings.maps_max_connections,
+                 attempt_timeout_seconds: float = settings.maps_attempt_timeout_seconds,
+                 deadline_seconds: float = settings.maps_deadline_seconds,
+                 max_retries: int = settings.maps_max_retries,
+                 retry_backoff_seconds: float = settings.maps_retry_backoff_seconds,
+                 breaker: CircuitBreaker | None = None):
+        self.key = key
+        self.transport = transport
+        self.geocode_url = geocode_url
+        self.address_validation_url = address_validation_url
+        self.max_connections = max_connections
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.deadline_seconds = deadline_seconds
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = MapsClientStats()
+
+        self._client: httpx.AsyncClient | None = None
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+    async def geocode(self, address: str) -> List[Any]:
+        """Geocoding API results for the address, empty when there are none"""
+        body = await self._coalesced(("geocode", address), lambda: self._request("geocode", "GET", self.geocode_url, params={"address": address}))
+        return body.get("results", [])
+
+    async def addressvalidation(self, address_lines: List[str], region_code: str = "US", enable_usps_cass: bool = True) -> Dict[str, Any]:
+        """Address Validation API response body. An address Google can't parse comes back as an error body rather than an exception."""
+        payload = {"address": {"addressLines": address_lines, "regionCode": region_code}, "enableUspsCass": enable_usps_cass}
+        return await self._coalesced(("addressvalidation", tuple(address_lines), region_code, enable_usps_cass), lambda: self._request("addressvalidation", "POST", self.address_validation_url, json=payload))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(transport=self.transport, timeout=self.attempt_timeout_seconds, limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections))
+        return self._client
+
+    async def _coalesced(self, key: Hashable, call: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        self.stats.calls += 1
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats.coalesced += 1
+        else:
+            task = asyncio.create_task(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        # Shielded, so one caller giving up doesn't cancel the call for everyone else sharing it
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception() # retrieved, even if every caller was cancelled
+
+    async def _request(self, operation: str, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        if not self.breaker.allow():
+            self.stats.breaker_rejections += 1
+            external_call_seconds.labels("google_maps", operation, "circuit_open").observe(0)
+            raise MapsUnavailableException("circuit open")
+        start = time.perf_counter()
+        try:
+            body = await self._with_retries(method, url, **kwargs)
+        except MapsUnavailableException as error:
+            external_call_seconds.labels("google_maps", operation, "error").observe(time.perf_counter() - start)
+            self.stats.failures += 1
+            if self.breaker.record_failure():
+                self.stats.breaker_opened += 1
+                logger.warning("Google Maps circuit opened after %d consecutive failures, last: %s", self.breaker.failures, error)
+            raise
+        except BaseException:
+            self.breaker.release() # cancelled, which says nothing about the upstream
+            raise
+        external_call_seconds.labels("google_maps", operation, "ok").observe(time.perf_counter() - start)
+        self.breaker.record_success()
+        return body
+
+    async def _with_retries(self, method: str, url: str, params: Dict[str, Any] | None = None, **kwargs) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline_seconds
+        params = {**(params or {}), "key": self.key if self.key is not None else settings.gmaps_key}
+        failure = "deadline exceeded"
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if attempt:
+                self.stats.retries += 1
+            self.stats.upstream_attempts += 1
+            try:
+                return await asyncio.wait_for(self._attempt(method, url, params=params, **kwargs), timeout=min(self.attempt_timeout_seconds, remaining))
+            except (_RetryableError, httpx.TransportError, asyncio.TimeoutError, ValueError) as error: # ValueError: a body that isn't JSON
+                failure = str(error) or type(error).__name__
+            # Full jitter, so a burst of failed calls doesn't retry in lockstep
+            backoff = random.uniform(0, self.retry_backoff_seconds * 2 ** attempt)
+            if attempt < self.max_retries:
+                if loop.time() + backoff >= deadline:
+                    break # retrying without the backoff would defeat it
+                await asyncio.sleep(backoff)
+        raise MapsUnavailableException(failure)
+
+    async def _attempt(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        response = await self._http().request(method, url, **kwargs)
+        if response.status_code in RETRYABLE_STATUSES:
+            raise _RetryableError(f"HTTP {response.status_code}")
+        if response.status_code in UNAVAILABLE_STATUSES:
+            raise MapsUnavailableException(f"HTTP {response.status_code}")
+        body = response.json()
+        if not isinstance(body, dict):
+            raise ValueError("body is not a JSON object")
+        api_status = body.get("status") if isinstance(body.get("status"), str) else None # the geocoding API reports errors in the body
+        if api_status in RETRYABLE_API_STATUSES:
+            raise _RetryableError(api_status)
+        if api_status in UNAVAILABLE_API_STATUSES:
+            raise MapsUnavailableException(f"{api_status}: {body.get('error_message', '')}")
+        return body
+
+maps_client = MapsClient()
+
+class GeocodingClient(Protocol):
+    """Anything exposing MapsClient.geocode, so local stubs can stand in for Google"""
+    async def geocode(self, address: str) -> List[Any]: ...
+
+async def validate_address(street_address, city, state_abbreviation, zip_code, unit) -> ValidationData:
+    response = await maps_client.addressvalidation(([street_address, unit] if unit else [street_address]) + [f"{city}, {state_abbreviation}, {zip_code}"], region_code='US', enable_usps_cass=True)
     try:
         if response["result"]["verdict"]["addressComplete"] and response["result"]["verdict"]["validationGranularity"] in ["PREMISE", "SUB_PREMISE"]:
             return ValidationData(
-                                formatted_address=response["result"]["address"]["formattedAddress"], 
+                                formatted_address=response["result"]["address"]["formattedAddress"],
                                 state_abbreviation=response["result"]["uspsData"]["standardizedAddress"]["state"],
                                 geocode=Geocode(
                                     latitude=response["result"]["geocode"]["location"]["latitude"],
@@ -40,11 +253,11 @@ def validate_address(street_address, city, state_abbreviation, zip_code, unit) -
     raise AddressNotValidException
 
 
-def geocode_address(street_address, city, state_abbreviation) -> Tuple[float, float] | None:
-    results = gmaps.geocode(f"{street_address}, f{city}, f{state_abbreviation}") # type: ignore
+async def geocode_address(street_address, city, state_abbreviation, client: GeocodingClient | None = None) -> Tuple[float, float] | None:
+    results = await (client or maps_client).geocode(f"{street_address}, {city}, {state_abbreviation}")
     if not len(results):
         return None
     try:
-        return (results[0]["geometry"]["location"]["lat"], results[0]["geometry"]["location"]["long"])
+        return (results[0]["geometry"]["location"]["lat"], results[0]["geometry"]["location"]["lng"])
     except KeyError:
-        return None
\ No newline at end of file
+        return None
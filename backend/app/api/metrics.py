@@ -0,0 +1,92 @@
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from monitoring.metrics import (
+    RequestMetrics,
+    current_request,
+    db_queries_per_request,
+    db_seconds_per_request,
+    request_seconds,
+    requests_total,
+)
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+UNMATCHED_ROUTE = "unmatched" # 404s share one label, so scanners can't blow up the label count
+
+class MetricsMiddleware:
+    """Records latency, status and per-request SQL counts under the route's path template (e.g. /message/{user_kind}/send)
+    rather than the raw path. Plain ASGI rather than BaseHTTPMiddleware, which would run the app in another task and lose
+    the request's context."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: Dict[Callable, str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send) # websockets are long-lived, their duration isn't latency
+
+        status_code = 500
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        request = RequestMetrics()
+        token = current_request.set(request)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            route = self._route_path(scope)
+            request_seconds.labels(scope["method"], route).observe(elapsed)
+            requests_total.labels(scope["method"], route, str(status_code)).inc()
+            db_queries_per_request.labels(route).observe(request.queries)
+            db_seconds_per_request.labels(route).observe(request.db_seconds)
+
+    def _route_path(self, scope: Scope) -> str:
+        # The router leaves the matched endpoint in the scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if endpoint not in self._route_paths:
+            self._route_paths.update({route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")})
+        return self._route_paths.get(endpoint, UNMATCHED_ROUTE)
+
+def _numeric_leaves(prefix: str, values: Dict[str, Any]) -> Iterator[Tuple[str, str, float]]:
+    for name, value in values.items():
+        if isinstance(value, dict):
+            yield from _numeric_leaves(f"{prefix}.{name}" if prefix else name, value)
+        elif isinstance(value, (int, float)): # bools included, as 0 and 1
+            yield prefix, name, float(value)
+
+class InternalStatsCollector(Collector):
+    """Exposes the counters behind /internal/stats as helpalign_internal_stat{section, stat}, labelled with the worker's pid"""
+
+    def __init__(self, snapshot: Callable[[], Dict[str, Any]]):
+        self.snapshot = snapshot
+
+    def collect(self):
+        family = GaugeMetricFamily("helpalign_internal_stat", "Counters and gauges from /internal/stats", labels=["pid", "section", "stat"])
+        stats = self.snapshot()
+        pid = str(stats.pop("pid"))
+        for section, name, value in _numeric_leaves("", stats):
+            family.add_metric([pid, section, name], value)
+        yield family
+
+def render_metrics(stats_collector: Collector) -> Tuple[bytes, str]:
+    """The Prometheus text format body and content type. In multiprocess mode samples are merged across workers, except the
+    internal stats, which only cover the worker answering the scrape."""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(stats_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,45 @@
+import os
+from dataclasses import asdict
+
+from api.geocode_cache import geocode_cache
+from api.mailbox_notifications import mailbox_listener
+from api.maps import maps_client
+from api.metrics import InternalStatsCollector, render_metrics
+from api.search_engine import provider_search_engine
+from api.zip_centroids import zip_centroids
+from database.database import active_pools
+from database.pool import describe_pool, pool_stats
+from database.retention import retention_stats
+from fastapi import APIRouter, Depends, Response
+from prometheus_client import REGISTRY
+from security.access import require_internal_key
+from security.user_cache import user_cache
+
+router = APIRouter(dependencies=[Depends(require_internal_key)])
+
+def stats_snapshot() -> dict:
+    """Per-worker counters, tagged with the pid so samples from several workers can be told apart"""
+    return {
+        "pid": os.getpid(),
+        "pools": {name: describe_pool(pool, pool_stats[name]) for name, pool in active_pools().items()},
+        "auth_cache": asdict(user_cache.stats),
+        "geocode_cache": asdict(geocode_cache.stats),
+        "maps_client": {"breaker": maps_client.breaker.state, **asdict(maps_client.stats)},
+        "provider_search_engine": {"providers": len(provider_search_engine)},
+        "zip_centroids": {"zip_codes": len(zip_centroids), **asdict(zip_centroids.stats)},
+        "contact_retention": asdict(retention_stats),
+        "mailbox_listener": {"connected": mailbox_listener.connected, "subscriptions": mailbox_listener.subscriptions, "channels": mailbox_listener.channels, **asdict(mailbox_listener.stats)},
+    }
+
+stats_collector = InternalStatsCollector(stats_snapshot)
+REGISTRY.register(stats_collector)
+
+@router.get("/internal/stats", include_in_schema=False)
+async def internal_stats():
+    return stats_snapshot()
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text format. Scrape with the internal key as a bearer token."""
+    body, content_type = render_metrics(stats_collector)
+    return Response(content=body, headers={"Content-Type": content_type}) # already has its charset
\ No newline at end of file
@@ -1,20 +1,29 @@
+import struct
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from enum import Enum
-from typing import List
+from typing import List, Set, Tuple
 from uuid import UUID
 
-from api.maps import Geocode, geocode_address
-from database.database import DBSession
+import numpy as np
+from api.geo import bounding_box, grid_cells_in_box, haversine_miles
+from api.geocode_cache import geocode_cache
+from api.maps import Geocode, MapsUnavailableException
+from api.search_engine import provider_search_engine
+from api.zip_centroids import zip_centroids
+from config.config import settings
+from database.database import AsyncDBSession
 from database.models.provider import (
     AcceptingNewPatients,
     Provider,
     ProviderGenderIdentity,
     ProviderType,
 )
-from fastapi import APIRouter
-from haversine import Unit, haversine
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import ORJSONResponse
+from monitoring.metrics import time_operation
 from pydantic import BaseModel
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 
@@ -35,10 +44,14 @@ class LocateFilters(BaseModel):
 
 class LocateInfo(BaseModel):
     filters: LocateFilters
-    street_address: str
-    city: str
+    zip_code: str | None = None # searched from the ZIP's centroid, no geocoding needed
+    street_address: str | None = None # with city, geocoded through Google Maps when there's no usable zip_code or precise is set
+    city: str | None = None
+    precise: bool = False
     state_abbreviation: USStatesEnum
     radius: int
+    limit: int = 20
+    cursor: str | None = None # next_cursor from the previous page, if any
 
 class Name(BaseModel):
     given: str
@@ -53,53 +66,152 @@ class LocateRelevantProviderInfo(BaseModel):
     provider_name: Name
     provider_gender_identity: str
     provider_location: FormattedLocation
+    distance: float # miles from the searched address
+
+class LocateResults(BaseModel):
+    providers: List[LocateRelevantProviderInfo]
+    next_cursor: str | None # pass back as LocateInfo.cursor to fetch the next page, None on the last page
 
 class InvalidRowOutputException(Exception):
     """Raised when a scalar output of a custom row doesn't return the expected number or type of values"""
     pass
 
-def locater_row_to_object(row) -> LocateRelevantProviderInfo:
+class InvalidCursorException(Exception):
+    """Raised when a pagination cursor can't be decoded"""
+    pass
+
+# A cursor is the (distance, provider id) of the last result on a page; results are
+# ordered by that pair, so the next page is everything strictly after it.
+_CURSOR_FORMAT = struct.Struct("!d16s")
+
+def encode_cursor(distance: float, provider_id: UUID) -> str:
+    return urlsafe_b64encode(_CURSOR_FORMAT.pack(distance, provider_id.bytes)).decode()
+
+def decode_cursor(cursor: str) -> Tuple[float, UUID]:
+    try:
+        distance, id_bytes = _CURSOR_FORMAT.unpack(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, struct.error):
+        raise InvalidCursorException
+    return distance, UUID(bytes=id_bytes)
+
+def locater_row_to_dict(row, distance: float) -> dict:
+    """The JSON shape of LocateRelevantProviderInfo, built straight from a locate row so no model is
+    constructed and then validated again against the response_model"""
     if len(row) != 7:
         raise InvalidRowOutputException
     try:
-        return LocateRelevantProviderInfo(provider_id=row[0], 
-                                          provider_name=Name(
-                                                             given=row[1], 
-                                                             family=row[2]
-                                                            ), 
-                                          provider_gender_identity=row[3], 
-                                          provider_location=FormattedLocation(
-                                                                              formatted_address=row[4], 
-                                                                              geocode=Geocode(
-                                                                                              latitude=row[5], 
-                                                                                              longitude=row[6]
-                                                                                            )
-                                                                            )
-                                        )
-    except ValueError:
+        return {"provider_id": str(row[0]), # asyncpg's UUID type isn't one orjson knows
+                "provider_name": {"given": row[1], "family": row[2]},
+                "provider_gender_identity": row[3].name,
+                "provider_location": {"formatted_address": row[4], "geocode": {"latitude": row[5], "longitude": row[6]}},
+                "distance": distance}
+    except AttributeError:
         raise InvalidRowOutputException
 
-@router.post("/locate/nearby")
-def locate_nearby_providers(info: LocateInfo) -> List[LocateRelevantProviderInfo]:
-    """Returns a list of provider info for providers within radius miles of the user's location, who fit the provided filters"""
-    info.radius = min(info.radius, 100) # cap out at 100 miles
-    if info.filters.remote_only:
-        info.filters.include_remote = True
-    valid_remote_status = set([info.filters.remote_only, info.filters.include_remote]) # true for both if remote_only, so only true. true false if remote_only is false but include_remote is true. false if both are false.
+@time_operation("locate_rank")
+def rank_by_distance(origin: Tuple[float, float], radius: float, ids: np.ndarray, latitudes: np.ndarray, longitudes: np.ndarray, limit: int, after: Tuple[float, UUID] | None = None) -> Tuple[List[int], np.ndarray, bool]:
+    """Returns the indices of the nearest `limit` points within radius (ordered by distance, then id),
+    the distances of every point, and whether more points remain after the returned ones.
+
+    ids is an S16 array of raw provider id bytes."""
+    distances = haversine_miles(origin[0], origin[1], latitudes, longitudes)
+    eligible = distances < radius
+    if after is not None:
+        after_distance, after_id = after
+        eligible &= (distances > after_distance) | ((distances == after_distance) & (ids > np.bytes_(after_id.bytes)))
+    candidates = np.flatnonzero(eligible)
+
+    if len(candidates) > limit:
+        # Keep everything up to the limit-th smallest distance, including ties across the boundary
+        threshold = np.partition(distances[candidates], limit - 1)[limit - 1]
+        candidates = candidates[distances[candidates] <= threshold]
+    ranked = sorted(candidates.tolist(), key=lambda i: (distances[i], ids[i]))
+    return ranked[:limit], distances, eligible.sum() > limit
+
+async def sql_locate_page(info: LocateInfo, geoloc: Tuple[float, float], valid_remote_status: Set[bool], after: Tuple[float, UUID] | None) -> Tuple[List, List[float], bool]:
+    # Coarse prefilter on the indexed grid cell and the bounding box, exact distance check after
+    min_latitude, max_latitude, min_longitude, max_longitude = box = bounding_box(geoloc[0], geoloc[1], info.radius)
 
     results = None
-    session: Session
-    with DBSession() as session:
-        results = session.scalars(select(Provider.id, Provider.given_name, Provider.family_name, Provider.gender_identity, Provider.formatted_address, Provider.latitude, Provider.longitude).where(
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        results = (await session.execute(select(Provider.id, Provider.given_name, Provider.family_name, Provider.gender_identity, Provider.formatted_address, Provider.latitude, Provider.longitude).where(
                                                         Provider.state_abbreviation == info.state_abbreviation.name,
+                                                        Provider.grid_cell.in_(grid_cells_in_box(box)),
+                                                        Provider.latitude.between(min_latitude, max_latitude),
+                                                        Provider.longitude.between(min_longitude, max_longitude) if min_longitude <= max_longitude else or_(Provider.longitude >= min_longitude, Provider.longitude <= max_longitude),
                                                         Provider.accepting_new_patients.in_(info.filters.accepting_new_patients_allow),
                                                         Provider.gender_identity.in_(info.filters.provider_gender_identity_allow),
                                                         Provider.provider_type == info.filters.provider_type,
                                                         Provider.remote_available.in_(valid_remote_status),
                                                         )
-                                                    ).all()
-        
-        geoloc = geocode_address(street_address=info.street_address, city=info.city, state_abbreviation=info.state_abbreviation.name)
-        results_formatted = [locater_row_to_object(row) for row in results]
-        results_distance_restricted = [obj for obj in results_formatted if haversine(geoloc, obj.provider_location.geocode.as_tuple(), unit=Unit.MILES) < info.radius]
-        return results_distance_restricted
\ No newline at end of file
+                                                    )).all()
+
+    ids = np.array([row[0].bytes for row in results], dtype="S16")
+    latitudes = np.fromiter((row[5] for row in results), dtype=np.float64, count=len(results))
+    longitudes = np.fromiter((row[6] for row in results), dtype=np.float64, count=len(results))
+    page, distances, has_more = rank_by_distance(geoloc, info.radius, ids, latitudes, longitudes, info.limit, after)
+    return [results[i] for i in page], [float(distances[i]) for i in page], has_more
+
+async def search_origin(info: LocateInfo) -> Tuple[float, float]:
+    """Where to search from: the ZIP code's centroid when possible, otherwise the geocoded street address"""
+    has_address = bool(info.street_address and info.city)
+    if info.zip_code and not (info.precise and has_address):
+        centroid = zip_centroids.lookup(info.zip_code)
+        if centroid is not None:
+            # Providers are filtered by state, so a ZIP from another state would search the wrong place
+            if centroid.state_abbreviation != info.state_abbreviation.name:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: ZIP_CODE")
+            return (centroid.latitude, centroid.longitude)
+        if not has_address:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: ZIP_CODE")
+    if not has_address:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: ADDRESS")
+
+    try:
+        geoloc = await geocode_cache.geocode(street_address=info.street_address, city=info.city, state_abbreviation=info.state_abbreviation.name)
+    except MapsUnavailableException:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="GEOCODING UNAVAILABLE", headers={"Retry-After": "30"})
+    if geoloc is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: ADDRESS")
+    return geoloc
+
+@router.post("/locate/nearby", response_model=LocateResults)
+async def locate_nearby_providers(info: LocateInfo) -> ORJSONResponse:
+    """Returns a page of provider info for providers within radius miles of the user's location, who fit the provided filters, nearest first"""
+    info.radius = min(info.radius, 100) # cap out at 100 miles
+    info.limit = max(1, min(info.limit, 100))
+    if info.filters.remote_only:
+        info.filters.include_remote = True
+    valid_remote_status = set([info.filters.remote_only, info.filters.include_remote]) # true for both if remote_only, so only true. true false if remote_only is false but include_remote is true. false if both are false.
+
+    after: Tuple[float, UUID] | None = None
+    if info.cursor:
+        try:
+            after = decode_cursor(info.cursor)
+        except InvalidCursorException:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: CURSOR")
+
+    with time_operation("locate_origin"):
+        geoloc = await search_origin(info)
+
+    if settings.provider_search_backend == "memory":
+        with time_operation("locate_search_memory"):
+            candidates = provider_search_engine.search(geoloc[0], geoloc[1], info.radius,
+                                                       state_abbreviation=info.state_abbreviation.name,
+                                                       provider_type=info.filters.provider_type,
+                                                       gender_identities=info.filters.provider_gender_identity_allow,
+                                                       accepting_new_patients=info.filters.accepting_new_patients_allow,
+                                                       remote_statuses=valid_remote_status)
+        page, distances, has_more = rank_by_distance(geoloc, info.radius, candidates.ids, candidates.latitudes, candidates.longitudes, info.limit, after)
+        # A provider removed between the search and here comes back as None and is dropped
+        page_rows = [(row, float(distances[i])) for row, i in zip(provider_search_engine.rows(candidates.ids[page]), page) if row is not None]
+        rows, page_distances = [row for row, _ in page_rows], [distance for _, distance in page_rows]
+    else:
+        rows, page_distances, has_more = await sql_locate_page(info, geoloc, valid_remote_status, after)
+
+    # Only the rows on the returned page are serialized. response_model still documents the shape.
+    with time_operation("locate_serialize"):
+        providers = [locater_row_to_dict(row, distance) for row, distance in zip(rows, page_distances)]
+        next_cursor = encode_cursor(page_distances[-1], rows[-1][0]) if has_more and providers else None
+        return ORJSONResponse({"providers": providers, "next_cursor": next_cursor})
\ No newline at end of file
@@ -1,51 +1,374 @@
-from datetime import datetime
-from typing import Annotated, List
+import asyncio
+import struct
+import time
+from base64 import b64decode, urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from typing import Annotated, Any, List, Sequence, Tuple
 from uuid import UUID
 
-from database.database import DBSession
-from database.models.messaging import ContactMailbox, ContactRequest, Device, DeviceSet
-from database.models.patient import Patient
-from database.models.provider import Provider
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
-from security.access import get_current_active_patient, get_current_active_provider
-from security.messaging import encrypt_contact
-from sqlalchemy import select
-from sqlalchemy.orm import Session, lazyload
+from api.mailbox_notifications import mailbox_listener
+from database.database import AsyncDBSession
+from database.models.base import UUIDC
+from database.models.messaging import (
+    ContactMailbox,
+    ContactRequest,
+    Device,
+    DeviceSet,
+    Mailbox,
+    Message,
+)
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from jose import jwt
+from pydantic import BaseModel, BeforeValidator, PlainSerializer
+from security.access import (
+    get_current_active_patient,
+    get_current_active_provider,
+    get_current_patient,
+    get_current_provider,
+)
+from security.messaging import contact_fingerprint, encrypt_contact_batch
+from security.rate_limit import limit_by_patient, limit_by_provider
+from security.user_cache import PatientSnapshot, ProviderSnapshot, UserKind
+from sqlalchemy import any_, delete, insert, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 
+def _decode_ciphertext(value: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            return b64decode(value.encode() + b"=" * (-len(value) % 4), altchars=b"-_", validate=True)
+        except ValueError:
+            raise ValueError("not URL-safe base64")
+    return value
+
+def encode_ciphertext(value: bytes | None) -> str | None:
+    return None if value is None else urlsafe_b64encode(value).decode("ascii")
+
+# Ciphertext crosses the API as URL-safe base64 both ways, raw bytes aren't valid JSON strings.
+# Page routes encode rows with encode_ciphertext directly, so both paths produce the same text.
+Ciphertext = Annotated[bytes, BeforeValidator(_decode_ciphertext), PlainSerializer(encode_ciphertext, return_type=str, when_used="json")]
+
 class PatientRequestInfo(BaseModel):
     provider_id: UUID
     message: str
 
+async def insert_contact_requests(session: AsyncSession, key_mailbox_pairs: Sequence[Tuple[str, UUID]], patient_id: UUID, message: str):
+    """Encrypts the request for every (device public key, contact mailbox id) pair and inserts all of them in one executemany.
+    Nothing already waiting in the mailboxes is loaded, so the cost doesn't grow with a provider's backlog."""
+    # One threadpool hop for every device
+    envelopes = await run_in_threadpool(encrypt_contact_batch, patient_id, message, [key for key, _ in key_mailbox_pairs])
+    await session.execute(insert(ContactRequest), [{"mailbox_id": mailbox_id, "patient_message_encrypted": envelope, "sender_fingerprint": contact_fingerprint(mailbox_id, patient_id)}
+                                                   for (_, mailbox_id), envelope in zip(key_mailbox_pairs, envelopes)])
 
-@router.post("/message/request")
-def patient_request(info: PatientRequestInfo, patient: Annotated[Patient, Depends(get_current_active_patient)]):
-    session: Session
-    with DBSession() as session:
-        provider_key_mailbox_pairs = session.scalars(select(Device.identity_public_key, ContactMailbox).join(Device, Device.id == ContactMailbox.device_id).join(DeviceSet, DeviceSet.id == Device.device_set_id).where(DeviceSet.provider_id == info.provider_id).options(lazyload(ContactMailbox.messages))).all()
+@router.post("/message/request", dependencies=[limit_by_patient("contact_request")])
+async def patient_request(info: PatientRequestInfo, patient: Annotated[PatientSnapshot, Depends(get_current_active_patient)]):
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        provider_key_mailbox_pairs = (await session.execute(select(Device.identity_public_key, ContactMailbox.id).join(Device, Device.id == ContactMailbox.device_id).join(DeviceSet, DeviceSet.id == Device.device_set_id).where(DeviceSet.provider_id == info.provider_id))).all()
         if not provider_key_mailbox_pairs:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="PROVIDER MAILBOXES NOT FOUND")
-        
-        for key, mailbox in provider_key_mailbox_pairs:
-            mailbox.messages.append(ContactRequest(patient_id_encrypted=encrypt_contact(str(patient.id), key), patient_message_encrypted=encrypt_contact(info.message, key)))
 
-        session.commit()
+        await insert_contact_requests(session, provider_key_mailbox_pairs, patient.id, info.message)
+        await session.commit()
 
 class ContactMessage(BaseModel):
+    id: UUID
     created: datetime
-    patient_id_encrypted: bytes
-    patient_message_encrypted: bytes
-
-@router.post("/message/contact/pending")
-def provider_get_pending_contacts(device_id: UUID, provider: Annotated[Provider, Depends(get_current_active_provider)]) -> List[ContactMessage]:
-    session: Session
-    retrieved_messages: List[ContactMessage] = []
-    with DBSession() as session:
-        mailbox = session.scalar(select(ContactMailbox).where(ContactMailbox.device_id == device_id).options(lazyload(ContactMailbox.messages)))
-        if mailbox:
-            retrieved_messages = [ContactMessage(created=m.created, patient_id_encrypted=m.patient_id_encrypted, patient_message_encrypted=m.patient_message_encrypted) for m in mailbox.messages]
-            mailbox.messages = []
-            session.commit()
-    return retrieved_messages
\ No newline at end of file
+    patient_id_encrypted: Ciphertext | None # only set on requests stored before the envelope format, see security.messaging
+    patient_message_encrypted: Ciphertext
+
+class ContactPage(BaseModel):
+    requests: List[ContactMessage]
+    next_cursor: str | None # pass back as cursor to fetch the next page, None on the last page
+
+class ContactAckInfo(BaseModel):
+    device_id: UUID
+    ids: List[UUID] # ContactMessage.id of every request the device has safely stored
+
+class ContactAckResult(BaseModel):
+    acknowledged: List[UUID] # ids that were deleted, anything already acknowledged is left out
+
+class InvalidCursorException(Exception):
+    """Raised when a pagination cursor can't be decoded"""
+    pass
+
+MAX_CONTACT_PAGE = 200
+MAX_CONTACT_ACK = 1000
+
+# A cursor is the (created, id) of the last request or message on a page, created as microseconds since
+# the epoch; pages are ordered by that pair, so the next one is everything strictly after it.
+_CURSOR_FORMAT = struct.Struct("!q16s")
+_EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(created: datetime, request_id: UUID) -> str:
+    return urlsafe_b64encode(_CURSOR_FORMAT.pack((created - _EPOCH) // timedelta(microseconds=1), request_id.bytes)).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        microseconds, id_bytes = _CURSOR_FORMAT.unpack(urlsafe_b64decode(cursor.encode()))
+        return _EPOCH + timedelta(microseconds=microseconds), UUID(bytes=id_bytes)
+    except (ValueError, OverflowError, struct.error):
+        raise InvalidCursorException
+
+def contact_row_to_dict(row) -> dict:
+    """The JSON shape of ContactMessage, built straight from a row. Page routes return these with ORJSONResponse,
+    skipping model construction and FastAPI's second validation of the response; response_model still documents them."""
+    # Ids are str()'d, as orjson can't serialize the UUID type asyncpg returns
+    return {"id": str(row[0]), "created": row[1], "patient_id_encrypted": encode_ciphertext(row[2]), "patient_message_encrypted": encode_ciphertext(row[3])}
+
+async def provider_contact_mailbox_id(session: AsyncSession, device_id: UUID, provider_id: UUID) -> UUID:
+    """The contact mailbox of the device, which must belong to the provider"""
+    mailbox_id = await session.scalar(select(ContactMailbox.id).join(Device, Device.id == ContactMailbox.device_id).join(DeviceSet, DeviceSet.id == Device.device_set_id).where(Device.id == device_id, DeviceSet.provider_id == provider_id))
+    if mailbox_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="DEVICE NOT FOUND")
+    return mailbox_id
+
+@router.post("/message/contact/pending", response_model=ContactPage)
+async def provider_get_pending_contacts(device_id: UUID, provider: Annotated[ProviderSnapshot, Depends(get_current_active_provider)], limit: int = 50, cursor: str | None = None) -> ORJSONResponse:
+    """Returns a page of the device's pending contact requests, oldest first. Nothing is removed until the ids are passed to /message/contact/ack,
+    so a response lost on the way is simply fetched again."""
+    limit = max(1, min(limit, MAX_CONTACT_PAGE))
+    after: Tuple[datetime, UUID] | None = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except InvalidCursorException:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: CURSOR")
+
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        mailbox_id = await provider_contact_mailbox_id(session, device_id, provider.id)
+        query = select(ContactRequest.id, ContactRequest.created, ContactRequest.patient_id_encrypted, ContactRequest.patient_message_encrypted).where(ContactRequest.mailbox_id == mailbox_id)
+        if after is not None:
+            query = query.where(tuple_(ContactRequest.created, ContactRequest.id) > tuple_(literal(after[0]), literal(after[1], UUIDC)))
+        # One extra row tells us whether there's another page
+        rows = (await session.execute(query.order_by(ContactRequest.created, ContactRequest.id).limit(limit + 1))).all()
+
+    requests = [contact_row_to_dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    return ORJSONResponse({"requests": requests, "next_cursor": next_cursor})
+
+@router.post("/message/contact/ack")
+async def provider_ack_contacts(info: ContactAckInfo, provider: Annotated[ProviderSnapshot, Depends(get_current_active_provider)]) -> ContactAckResult:
+    """Deletes contact requests the device has received, in one statement. Acknowledging an id twice is harmless."""
+    if len(info.ids) > MAX_CONTACT_ACK:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: IDS")
+
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        mailbox_id = await provider_contact_mailbox_id(session, info.device_id, provider.id)
+        # The mailbox condition keeps a device from deleting requests addressed to any other device
+        acknowledged = (await session.scalars(delete(ContactRequest).where(ContactRequest.id == any_(literal(info.ids, ARRAY(UUIDC))), ContactRequest.mailbox_id == mailbox_id).returning(ContactRequest.id))).all()
+        await session.commit()
+    return ContactAckResult(acknowledged=list(acknowledged))
+
+class DeviceCiphertext(BaseModel):
+    device_id: UUID # recipient device
+    message_encrypted: Ciphertext
+    sender_ephemeral_key: str | None = None
+    chain_key: str | None = None
+
+class SendMessageInfo(BaseModel):
+    sender_device_id: UUID
+    recipient_kind: UserKind
+    recipient_id: UUID
+    messages: List[DeviceCiphertext] # exactly one per device in the recipient's DeviceSet
+
+class SendMessageResult(BaseModel):
+    message_ids: List[UUID] # in the order of SendMessageInfo.messages
+
+class MailboxMessage(BaseModel):
+    message_id: UUID
+    message_encrypted: Ciphertext
+    sender_id: UUID
+    sender_device_id: UUID
+    sender_identity_key: str
+    sender_ephemeral_key: str | None
+    chain_key: str | None
+
+class MailboxPage(BaseModel):
+    messages: List[MailboxMessage]
+    next_cursor: str | None # pass back as cursor to fetch the next page, None on the last page
+
+class MailboxAckInfo(BaseModel):
+    device_id: UUID
+    message_ids: List[UUID]
+
+class MailboxAckResult(BaseModel):
+    acknowledged: List[UUID] # ids that were deleted, anything already acknowledged is left out
+
+MAX_MESSAGE_PAGE = 200
+MAX_MESSAGE_ACK = 1000
+MAX_RECIPIENT_DEVICES = 64
+
+def mailbox_row_to_dict(row) -> dict:
+    """The JSON shape of MailboxMessage, see contact_row_to_dict"""
+    return {"message_id": str(row[0]), "message_encrypted": encode_ciphertext(row[1]), "sender_id": str(row[2]), "sender_device_id": str(row[3]),
+            "sender_identity_key": row[4], "sender_ephemeral_key": row[5], "chain_key": row[6]}
+
+def device_owner(user_kind: UserKind):
+    return DeviceSet.provider_id if user_kind == "provider" else DeviceSet.patient_id
+
+async def user_mailbox_id(session: AsyncSession, device_id: UUID, user_kind: UserKind, user_id: UUID) -> UUID:
+    """The message mailbox of the device, which must belong to the user"""
+    mailbox_id = await session.scalar(select(Mailbox.id).join(Device, Device.id == Mailbox.device_id).join(DeviceSet, DeviceSet.id == Device.device_set_id).where(Device.id == device_id, device_owner(user_kind) == user_id))
+    if mailbox_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="DEVICE NOT FOUND")
+    return mailbox_id
+
+async def send_messages(info: SendMessageInfo, sender_kind: UserKind, sender_id: UUID) -> SendMessageResult:
+    """Stores one ciphertext per recipient device in a single executemany. The device list must match the recipient's
+    current DeviceSet exactly, otherwise nothing is stored and the 409 lists the devices to encrypt for instead."""
+    if len(info.messages) > MAX_RECIPIENT_DEVICES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: MESSAGES")
+
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        sender_identity_key = await session.scalar(select(Device.identity_public_key).join(DeviceSet, DeviceSet.id == Device.device_set_id).where(Device.id == info.sender_device_id, device_owner(sender_kind) == sender_id))
+        if sender_identity_key is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="DEVICE NOT FOUND")
+
+        recipient_mailboxes = dict((await session.execute(select(Device.id, Mailbox.id).join(Mailbox, Mailbox.device_id == Device.id).join(DeviceSet, DeviceSet.id == Device.device_set_id).where(device_owner(info.recipient_kind) == info.recipient_id))).all())
+        if not recipient_mailboxes:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="RECIPIENT MAILBOXES NOT FOUND")
+        if sorted(message.device_id for message in info.messages) != sorted(recipient_mailboxes):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail={"error": "RECIPIENT DEVICES CHANGED", "device_ids": [str(device_id) for device_id in recipient_mailboxes]})
+
+        message_ids = (await session.scalars(insert(Message).returning(Message.message_id, sort_by_parameter_order=True), [{
+                            "mailbox_id": recipient_mailboxes[message.device_id],
+                            "message_encrypted": message.message_encrypted,
+                            "sender_id": sender_id,
+                            "sender_device_id": info.sender_device_id,
+                            "sender_identity_key": sender_identity_key,
+                            "sender_ephemeral_key": message.sender_ephemeral_key,
+                            "chain_key": message.chain_key,
+                        } for message in info.messages])).all()
+        await session.commit()
+    return SendMessageResult(message_ids=list(message_ids))
+
+async def mailbox_page(device_id: UUID, user_kind: UserKind, user_id: UUID, limit: int, cursor: str | None) -> ORJSONResponse:
+    """A page of the device's mailbox, oldest first. Messages stay until acknowledged, so a lost response is simply fetched again."""
+    limit = max(1, min(limit, MAX_MESSAGE_PAGE))
+    after: Tuple[datetime, UUID] | None = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except InvalidCursorException:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: CURSOR")
+
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        mailbox_id = await user_mailbox_id(session, device_id, user_kind, user_id)
+        query = select(Message.message_id, Message.message_encrypted, Message.sender_id, Message.sender_device_id, Message.sender_identity_key, Message.sender_ephemeral_key, Message.chain_key, Message.created).where(Message.mailbox_id == mailbox_id)
+        if after is not None:
+            query = query.where(tuple_(Message.created, Message.message_id) > tuple_(literal(after[0]), literal(after[1], UUIDC)))
+        # One extra row tells us whether there's another page
+        rows = (await session.execute(query.order_by(Message.created, Message.message_id).limit(limit + 1))).all()
+
+    messages = [mailbox_row_to_dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][7], rows[limit - 1][0]) if len(rows) > limit else None
+    return ORJSONResponse({"messages": messages, "next_cursor": next_cursor})
+
+async def ack_mailbox(info: MailboxAckInfo, user_kind: UserKind, user_id: UUID) -> MailboxAckResult:
+    if len(info.message_ids) > MAX_MESSAGE_ACK:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: MESSAGE_IDS")
+
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        mailbox_id = await user_mailbox_id(session, info.device_id, user_kind, user_id)
+        acknowledged = (await session.scalars(delete(Message).where(Message.message_id == any_(literal(info.message_ids, ARRAY(UUIDC))), Message.mailbox_id == mailbox_id).returning(Message.message_id))).all()
+        await session.commit()
+    return MailboxAckResult(acknowledged=list(acknowledged))
+
+@router.post("/message/provider/send", dependencies=[limit_by_provider("message_send")])
+async def provider_send_message(info: SendMessageInfo, provider: Annotated[ProviderSnapshot, Depends(get_current_active_provider)]) -> SendMessageResult:
+    return await send_messages(info, "provider", provider.id)
+
+@router.post("/message/patient/send", dependencies=[limit_by_patient("message_send")])
+async def patient_send_message(info: SendMessageInfo, patient: Annotated[PatientSnapshot, Depends(get_current_active_patient)]) -> SendMessageResult:
+    return await send_messages(info, "patient", patient.id)
+
+@router.post("/message/provider/inbox", response_model=MailboxPage)
+async def provider_get_messages(device_id: UUID, provider: Annotated[ProviderSnapshot, Depends(get_current_active_provider)], limit: int = 50, cursor: str | None = None) -> ORJSONResponse:
+    return await mailbox_page(device_id, "provider", provider.id, limit, cursor)
+
+@router.post("/message/patient/inbox", response_model=MailboxPage)
+async def patient_get_messages(device_id: UUID, patient: Annotated[PatientSnapshot, Depends(get_current_active_patient)], limit: int = 50, cursor: str | None = None) -> ORJSONResponse:
+    return await mailbox_page(device_id, "patient", patient.id, limit, cursor)
+
+@router.post("/message/provider/ack")
+async def provider_ack_messages(info: MailboxAckInfo, provider: Annotated[ProviderSnapshot, Depends(get_current_active_provider)]) -> MailboxAckResult:
+    return await ack_mailbox(info, "provider", provider.id)
+
+@router.post("/message/patient/ack")
+async def patient_ack_messages(info: MailboxAckInfo, patient: Annotated[PatientSnapshot, Depends(get_current_active_patient)]) -> MailboxAckResult:
+    return await ack_mailbox(info, "patient", patient.id)
+
+SUBSCRIBE_AUTH_TIMEOUT = 10 # seconds for the client to send its access token
+SUBSCRIBE_RECHECK_SECONDS = 30 # how often an open socket's token is checked again, a revoked one is closed by the next check
+
+@router.websocket("/message/subscribe/{user_kind}")
+async def subscribe_mailboxes(websocket: WebSocket, user_kind: UserKind, device_id: UUID):
+    """Pushes {"mailbox": "contact" | "message" | "resync"} whenever something lands in the device's mailboxes, in place of polling.
+    The first frame from the client must be its access token, which keeps it out of URLs and access logs. "resync" is sent on
+    connect and whenever notifications may have been missed; the client then fetches both mailboxes once. The socket is closed
+    with 1008 when the token expires or is revoked, and the client reconnects with a new one."""
+    authenticate = get_current_provider if user_kind == "provider" else get_current_patient
+    await websocket.accept()
+    try:
+        token = await asyncio.wait_for(websocket.receive_text(), SUBSCRIBE_AUTH_TIMEOUT)
+        user = await authenticate(token)
+    except (asyncio.TimeoutError, HTTPException, WebSocketDisconnect):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    expires_at = jwt.get_unverified_claims(token)["exp"] # already verified by authenticate
+
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        mailboxes = (await session.execute(select(Mailbox.id, ContactMailbox.id).select_from(Device).join(DeviceSet, DeviceSet.id == Device.device_set_id).outerjoin(Mailbox, Mailbox.device_id == Device.id).outerjoin(ContactMailbox, ContactMailbox.device_id == Device.id).where(Device.id == device_id, device_owner(user_kind) == user.id))).first()
+    if mailboxes is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="DEVICE NOT FOUND")
+        return
+
+    async with mailbox_listener.subscribe(mailbox_id for mailbox_id in mailboxes if mailbox_id is not None) as subscription:
+        # Anything the client sends from here on is ignored, but reading is how a disconnect shows up
+        disconnected = asyncio.create_task(_wait_for_disconnect(websocket))
+        recheck_at = time.monotonic() + SUBSCRIBE_RECHECK_SECONDS
+        try:
+            while True:
+                if time.time() >= expires_at:
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="TOKEN EXPIRED")
+                    return
+                if time.monotonic() >= recheck_at:
+                    try:
+                        await authenticate(token) # goes through the user cache, which drops revoked tokens
+                    except HTTPException:
+                        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="TOKEN REVOKED")
+                        return
+                    recheck_at = time.monotonic() + SUBSCRIBE_RECHECK_SECONDS
+                notified = asyncio.create_task(subscription.wait())
+                timeout = max(0, min(expires_at - time.time(), recheck_at - time.monotonic()))
+                await asyncio.wait((disconnected, notified), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    notified.cancel()
+                    return
+                if not notified.done():
+                    notified.cancel() # time to check the token, nothing pending is lost
+                    continue
+                for kind in sorted(notified.result()):
+                    await websocket.send_json({"mailbox": kind})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            disconnected.cancel()
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
@@ -1,8 +1,8 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from typing import Annotated
 from uuid import UUID
 
-from database.database import DBSession
+from database.database import AsyncDBSession
 from database.models.messaging import Device, DeviceSet, Mailbox, UserType
 from database.models.patient import Patient
 from database.models.token import PatientDBToken
@@ -12,43 +12,55 @@ from pydantic import BaseModel, EmailStr, SecretStr
 from security.access import (
     create_access_token,
     get_current_active_patient,
-    get_hash,
-    verify_password,
+    notify_token_revoked,
+    notify_user_changed,
+    revoke_token_in_cache,
 )
-from sqlalchemy import delete, select
-from sqlalchemy.orm import Session
+from security.passwords import password_hasher
+from security.rate_limit import limit_by_ip
+from security.tokens import token_digest
+from security.user_cache import PatientSnapshot, user_cache
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 
-@router.post("/patient/token")
-def patient_login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
+@router.post("/patient/token", dependencies=[limit_by_ip("login")])
+async def patient_login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     user: Patient | None
-    session: Session
-    with DBSession() as session:
-        user = session.scalars(select(Patient).where(Patient.email == form_data.username)).one_or_none()
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        user = (await session.scalars(select(Patient).where(Patient.email == form_data.username))).one_or_none()
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
-    if not verify_password(form_data.password, user.password_hash):
+    password_valid, new_password_hash = await password_hasher.verify(form_data.password, user.password_hash)
+    if not password_valid:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
 
     access_token_expires = timedelta(minutes=30)
+    expires_at = datetime.utcnow() + access_token_expires
     access_token = create_access_token(
         data={"sub": str(user.id)}, expires_delta=access_token_expires
     )
 
-    session: Session
-    with DBSession() as session:
-        session.add(PatientDBToken(user_id=user.id, token_hash=get_hash(access_token)))
-        session.commit()
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        session.add(PatientDBToken(token_digest=token_digest(access_token), user_id=user.id, expires_at=expires_at))
+        if new_password_hash:
+            # Stored hash predates the current work factor
+            await session.execute(update(Patient).where(Patient.id == user.id).values(password_hash=new_password_hash))
+        await session.commit()
 
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/patient/logout")
-def patient_logout(token: str, patient: Annotated[Patient, Depends(get_current_active_patient)]):
-    session: Session
-    with DBSession() as session:
-        session.execute(delete(PatientDBToken).where(PatientDBToken.token == token).where(PatientDBToken.user_id == patient.id))
-        session.commit()
+async def patient_logout(token: str, patient: Annotated[PatientSnapshot, Depends(get_current_active_patient)]):
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        await session.execute(delete(PatientDBToken).where(PatientDBToken.token_digest == token_digest(token)).where(PatientDBToken.user_id == patient.id))
+        await notify_token_revoked(session, "patient", token)
+        await session.commit()
+    revoke_token_in_cache("patient", token)
 
 class Name(BaseModel):
     given: str
@@ -67,20 +79,20 @@ class NewPatientInfo(BaseModel):
     public_key: str
     signed_pre_key: str
 
-@router.post("/patient/new")
-def create_patient(info: NewPatientInfo):
-    session: Session
-    with DBSession() as session:
-        if session.scalars(select(Patient).where(Patient.email == info.email)).one_or_none():
+@router.post("/patient/new", dependencies=[limit_by_ip("signup")])
+async def create_patient(info: NewPatientInfo):
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        if (await session.scalars(select(Patient).where(Patient.email == info.email))).one_or_none():
             raise HTTPException(status_code=409, detail="Provider already registered with this email")
 
     if info.assistance.is_assisted_account and not info.assistance.guardian_name:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ASSISTED ACCOUNTS REQUIRE GUARDIAN NAME")
 
-    password_hash = get_hash(info.password.get_secret_value())
+    password_hash = await password_hasher.hash(info.password.get_secret_value())
 
-    session: Session
-    with DBSession() as session:
+    session: AsyncSession
+    async with AsyncDBSession() as session:
         session.add(Patient(
                             device_set=DeviceSet(
                                                 user_type=UserType.PATIENT, 
@@ -102,18 +114,21 @@ def create_patient(info: NewPatientInfo):
                         )
                     )
         
-        session.commit()
+        await session.commit()
 
     return {"success": True}
 
-@router.post("/patient/delete")
-def delete_patient(patient_id: UUID, passkey: str):
+@router.post("/patient/delete", dependencies=[limit_by_ip("account_deletion")])
+async def delete_patient(patient_id: UUID, passkey: str):
     if passkey != "thiswillbeproperlysecuredeventually":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
     
-    session: Session
-    with DBSession() as session:
-        session.execute(delete(Patient).where(Patient.id==patient_id))
-        session.commit()
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        await session.execute(delete(Patient).where(Patient.id==patient_id))
+        await session.execute(delete(PatientDBToken).where(PatientDBToken.user_id == patient_id)) # no foreign key to cascade from
+        await notify_user_changed(session, "patient", patient_id)
+        await session.commit()
+    user_cache.invalidate_user("patient", patient_id)
 
     return {"succeeded": True}
\ No newline at end of file
@@ -1,9 +1,18 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from typing import Annotated
 from uuid import UUID, uuid4
 
-from api.maps import AddressNotValidException, Geocode, ValidationData, validate_address
-from database.database import DBSession
+from api.geo import grid_cell
+from api.maps import (
+    AddressNotValidException,
+    Geocode,
+    MapsUnavailableException,
+    ValidationData,
+    validate_address,
+)
+from api.search_engine import PROVIDER_DELETIONS_CHANNEL, provider_search_engine
+from config.config import settings
+from database.database import AsyncDBSession
 from database.models.messaging import (
     ContactMailbox,
     Device,
@@ -25,11 +34,16 @@ from security.access import (
     Token,
     create_access_token,
     get_current_active_provider,
-    get_hash,
-    verify_password,
+    notify_token_revoked,
+    notify_user_changed,
+    revoke_token_in_cache,
 )
+from security.passwords import password_hasher
+from security.rate_limit import limit_by_ip
+from security.tokens import token_digest
+from security.user_cache import ProviderSnapshot, user_cache
 from sqlalchemy import delete, func, select, update
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 class ProviderLocation(BaseModel):
@@ -64,56 +78,65 @@ class NewProviderInfo(BaseModel):
 
 router = APIRouter()
 
-@router.post("/provider/token", response_model=Token)
-def provider_login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
+@router.post("/provider/token", response_model=Token, dependencies=[limit_by_ip("login")])
+async def provider_login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     user: Provider | None = None
-    session: Session
-    with DBSession() as session:
-        user = session.scalars(select(Provider).where(Provider.email == form_data.username)).one_or_none()
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        user = (await session.scalars(select(Provider).where(Provider.email == form_data.username))).one_or_none()
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
-    if not verify_password(form_data.password, user.password_hash):
+    password_valid, new_password_hash = await password_hasher.verify(form_data.password, user.password_hash)
+    if not password_valid:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
 
     access_token_expires = timedelta(minutes=30)
+    expires_at = datetime.utcnow() + access_token_expires
     access_token = create_access_token(
         data={"sub": str(user.id)}, expires_delta=access_token_expires
     )
 
-    session: Session
-    with DBSession() as session:
-        session.add(ProviderDBToken(user_id=user.id, token_hash=get_hash(access_token)))
-        session.commit()
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        session.add(ProviderDBToken(token_digest=token_digest(access_token), user_id=user.id, expires_at=expires_at))
+        if new_password_hash:
+            # Stored hash predates the current work factor
+            await session.execute(update(Provider).where(Provider.id == user.id).values(password_hash=new_password_hash))
+        await session.commit()
 
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/provider/logout")
-def patient_logout(token: str, patient: Annotated[Provider, Depends(get_current_active_provider)]):
-    session: Session
-    with DBSession() as session:
-        session.execute(delete(ProviderDBToken).where(ProviderDBToken.token_hash == get_hash(token)).where(ProviderDBToken.user_id == patient.id))
-        session.commit()
-
-
-@router.post("/provider/new")
-def create_provider(info: NewProviderInfo):
-    session: Session
-    with DBSession() as session:
-        if session.scalars(select(Provider).where(Provider.email == info.email)).one_or_none():
+async def provider_logout(token: str, provider: Annotated[ProviderSnapshot, Depends(get_current_active_provider)]):
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        await session.execute(delete(ProviderDBToken).where(ProviderDBToken.token_digest == token_digest(token)).where(ProviderDBToken.user_id == provider.id))
+        await notify_token_revoked(session, "provider", token)
+        await session.commit()
+    revoke_token_in_cache("provider", token)
+
+
+@router.post("/provider/new", dependencies=[limit_by_ip("signup")])
+async def create_provider(info: NewProviderInfo):
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        if (await session.scalars(select(Provider).where(Provider.email == info.email))).one_or_none():
             raise HTTPException(status_code=409, detail="Provider already registered with this email")
 
     # Validate and format address
     location_data: ValidationData
     try:
-        location_data = validate_address(info.location_data.street_address, info.location_data.city, info.location_data.state_abbreviation, info.location_data.zip_code, info.location_data.unit)
+        location_data = await validate_address(info.location_data.street_address, info.location_data.city, info.location_data.state_abbreviation, info.location_data.zip_code, info.location_data.unit)
     except AddressNotValidException:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="BAD FIELD: ADDRESS")
+    except MapsUnavailableException:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="ADDRESS VALIDATION UNAVAILABLE", headers={"Retry-After": "30"})
 
-    password_hash = get_hash(info.password.get_secret_value())
+    password_hash = await password_hasher.hash(info.password.get_secret_value())
 
-    session: Session
-    with DBSession() as session:
-        session.add(Provider(
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        provider = Provider(
                             device_set=DeviceSet(
                                                 user_type=UserType.PROVIDER, 
                                                 devices=[
@@ -132,38 +155,51 @@ def create_provider(info: NewProviderInfo):
                             latitude=location_data.geocode.latitude,
                             longitude=location_data.geocode.longitude, 
                             state_abbreviation=location_data.state_abbreviation,
+                            grid_cell=grid_cell(location_data.geocode.latitude, location_data.geocode.longitude),
                             remote_available=info.filter_data.remote_available, 
                             gender_identity=info.filter_data.gender_identity, 
                             accepting_new_patients=info.filter_data.accepting_new_patients,
                             provider_type=info.filter_data.provider_type,
                             password_hash=password_hash,
                         )
-                    )
-        
-        session.commit()
+        session.add(provider)
+        await session.commit()
+
+        if settings.provider_search_backend == "memory":
+            provider_search_engine.upsert_provider(provider)
 
     return {"success": True}
 
 @router.post("/provider/changeemail")
-def change_email(new_email: EmailStr, user: Annotated[Provider, Depends(get_current_active_provider)]):
-    session: Session
-    with DBSession() as session:
-        if session.scalars(select(Provider).where(Provider.email == new_email)).one_or_none():
+async def change_email(new_email: EmailStr, user: Annotated[ProviderSnapshot, Depends(get_current_active_provider)]):
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        if (await session.scalars(select(Provider).where(Provider.email == new_email))).one_or_none():
             raise HTTPException(status_code=409, detail="Provider already registered with this email")
         
-        session.execute(update(Provider), [{"id": user.id, "email": new_email}])
-        session.commit()
+        await session.execute(update(Provider), [{"id": user.id, "email": new_email}])
+        await notify_user_changed(session, "provider", user.id)
+        await session.commit()
+    user_cache.invalidate_user("provider", user.id)
     
     return {"success": True}
 
-@router.post("/provider/delete")
-def delete_provider(provider_id: UUID, passkey: str):
+@router.post("/provider/delete", dependencies=[limit_by_ip("account_deletion")])
+async def delete_provider(provider_id: UUID, passkey: str):
     if passkey != "thiswillbeproperlysecuredeventually":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
     
-    session: Session
-    with DBSession() as session:
-        session.execute(delete(Provider).where(Provider.id==provider_id))
-        session.commit()
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        await session.execute(delete(Provider).where(Provider.id==provider_id))
+        await session.execute(delete(ProviderDBToken).where(ProviderDBToken.user_id == provider_id)) # no foreign key to cascade from
+        await notify_user_changed(session, "provider", provider_id)
+        if settings.provider_search_backend == "memory":
+            await session.execute(select(func.pg_notify(PROVIDER_DELETIONS_CHANNEL, provider_id.hex))) # sent on commit
+        await session.commit()
+    user_cache.invalidate_user("provider", provider_id)
+
+    if settings.provider_search_backend == "memory":
+        provider_search_engine.remove([provider_id])
 
     return {"succeeded": True}
\ No newline at end of file
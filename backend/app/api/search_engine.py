@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from math import pi, sin
+from typing import TYPE_CHECKING, Dict, Iterable, List, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+from api.geo import EARTH_RADIUS_MILES
+from api.mailbox_notifications import DISCONNECTED, RESYNC
+from config.config import settings
+from database.database import AsyncDBSession
+from database.models.provider import (
+    AcceptingNewPatients,
+    Provider,
+    ProviderGenderIdentity,
+    ProviderType,
+)
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+if TYPE_CHECKING:
+    from scipy.spatial import cKDTree
+
+logger = logging.getLogger(__name__)
+
+# Same shape as the SQL locate query, so api.routes.locate can format either
+LocateRow = Tuple[UUID, str, str, ProviderGenderIdentity, str, float, float]
+
+_COLUMN_DTYPES = {
+    "ids": "S16",
+    "provider_type": np.int8,
+    "accepting_new_patients": np.int8,
+    "gender_identity": np.int8,
+    "remote_available": np.bool_,
+    "state_abbreviation": "S2",
+    "latitude": np.float64,
+    "longitude": np.float64,
+}
+
+PROVIDER_SEARCH_COLUMNS = (Provider.id, Provider.given_name, Provider.family_name, Provider.gender_identity, Provider.formatted_address,
+                           Provider.latitude, Provider.longitude, Provider.provider_type, Provider.accepting_new_patients, Provider.remote_available, Provider.state_abbreviation)
+
+# Notified with a provider id's hex when it's deleted, so every worker's engine drops it
+PROVIDER_DELETIONS_CHANNEL = "provider_deletions"
+
+@dataclass
+class SearchCandidates:
+    ids: np.ndarray # S16 provider ids
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+
+@dataclass(frozen=True)
+class _Snapshot:
+    """The engine's contents at one point, never changed once published. Later snapshots may share
+    its column arrays and name lists, but only ever append to them past this one's size."""
+    size: int
+    columns: Dict[str, np.ndarray] # indexed by slot, may have spare capacity past size
+    points: np.ndarray
+    given_names: List[str]
+    family_names: List[str]
+    formatted_addresses: List[str]
+    alive: np.ndarray # exactly size long, replaced or removed slots are False
+    dead: int
+    slots: Dict[bytes, int]
+    tree: "cKDTree | None" = None
+    tree_size: int = 0
+
+def _empty_snapshot() -> _Snapshot:
+    return _Snapshot(size=0, columns={name: np.zeros(0, dtype=dtype) for name, dtype in _COLUMN_DTYPES.items()}, points=np.zeros((0, 3), dtype=np.float64),
+                     given_names=[], family_names=[], formatted_addresses=[], alive=np.zeros(0, dtype=np.bool_), dead=0, slots={})
+
+def _id_key(provider_id) -> bytes:
+    """numpy drops trailing NUL bytes when reading S16 values back out, so pad them again"""
+    return bytes(provider_id).ljust(16, b"\x00")
+
+def _unit_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Points on the unit sphere, so euclidean (chord) distance is monotonic in great-circle distance"""
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    return np.column_stack((np.cos(latitudes) * np.cos(longitudes), np.cos(latitudes) * np.sin(longitudes), np.sin(latitudes)))
+
+def _chord_length(radius_miles: float) -> float:
+    return 2 * sin(min(radius_miles / EARTH_RADIUS_MILES, pi) / 2)
+
+def _resized(column: np.ndarray, size: int, capacity: int) -> np.ndarray:
+    resized = np.zeros((capacity, *column.shape[1:]), dtype=column.dtype)
+    resized[:size] = column[:size]
+    return resized
+
+class ProviderSearchEngine:
+    """Per-worker, in-memory copy of the Provider search fields.
+
+    Fields are stored column-wise in numpy arrays, indexed by slot. A KD-tree covers slots
+    [0, tree_size); providers added or updated since the last rebuild are appended after it
+    and scanned directly, and replaced or removed slots are tombstoned through `alive`.
+
+    Searches read whichever snapshot is current without locking. Writers build the next snapshot
+    aside and only hold the lock to publish it. Compacting and rebuilding the tree is left to
+    sync(), which does it off the event loop."""
+
+    def __init__(self, rebuild_threshold: int = 256):
+        self.rebuild_threshold = rebuild_threshold
+        self.watermark: datetime | None = None # database time of the last sync
+        self.last_full_load: float = 0.0
+        self.reload_requested = False # set when deletions may have been missed
+
+        self._lock = threading.Lock() # serializes writers, readers never take it
+        self._snapshot = _empty_snapshot()
+
+    def __len__(self) -> int:
+        return len(self._snapshot.slots)
+
+    @property
+    def needs_rebuild(self) -> bool:
+        snapshot = self._snapshot
+        return snapshot.size - snapshot.tree_size > self.rebuild_threshold or snapshot.dead * 4 > snapshot.size
+
+    def load(self, rows: Iterable[Sequence]):
+        """Replaces the engine contents with the given PROVIDER_SEARCH_COLUMNS rows"""
+        snapshot = _rebuilt(_changed(_empty_snapshot(), list(rows), ()))
+        with self._lock:
+            self._snapshot = snapshot
+
+    def upsert(self, rows: Iterable[Sequence]):
+        rows = list(rows)
+        with self._lock:
+            self._snapshot = _changed(self._snapshot, rows, ())
+
+    def upsert_provider(self, provider: Provider):
+        self.upsert([tuple(getattr(provider, column.key) for column in PROVIDER_SEARCH_COLUMNS)])
+
+    def remove(self, provider_ids: Iterable[UUID]):
+        removed = [provider_id.bytes for provider_id in provider_ids]
+        with self._lock:
+            self._snapshot = _changed(self._snapshot, [], removed)
+
+    def rebuild(self) -> bool:
+        """Drops tombstoned slots and rebuilds the KD-tree. Gives up, returning False, if a write lands meanwhile"""
+        base = self._snapshot
+        snapshot = _rebuilt(base)
+        with self._lock:
+            if self._snapshot is not base:
+                return False
+            self._snapshot = snapshot
+        return True
+
+    def on_deletion(self, payload: str):
+        """Handler for PROVIDER_DELETIONS_CHANNEL, see MailboxListener.on"""
+        if payload == RESYNC:
+            self.reload_requested = True # deletions may have been missed while not listening
+        elif payload != DISCONNECTED:
+            self.remove([UUID(hex=payload)])
+
+    def search(self,
+               latitude: float,
+               longitude: float,
+               radius_miles: float,
+               state_abbreviation: str,
+               provider_type: ProviderType,
+               gender_identities: Iterable[ProviderGenderIdentity],
+               accepting_new_patients: Iterable[AcceptingNewPatients],
+               remote_statuses: Iterable[bool]) -> SearchCandidates:
+        """Returns every provider within radius_miles that fits the filters (the caller does the exact distance check)"""
+        point = _unit_vectors(np.array([latitude]), np.array([longitude]))[0]
+        chord = _chord_length(radius_miles) * (1 + 1e-9)
+        snapshot = self._snapshot
+        in_tree = np.asarray(snapshot.tree.query_ball_point(point, chord), dtype=np.intp) if snapshot.tree is not None else np.empty(0, dtype=np.intp)
+        recent = np.arange(snapshot.tree_size, snapshot.size, dtype=np.intp)
+        recent = recent[np.linalg.norm(snapshot.points[recent] - point, axis=1) <= chord]
+        slots = np.concatenate((in_tree, recent))
+
+        columns = snapshot.columns
+        slots = slots[snapshot.alive[slots]
+                      & (columns["state_abbreviation"][slots] == state_abbreviation.encode())
+                      & (columns["provider_type"][slots] == provider_type.value)
+                      & np.isin(columns["gender_identity"][slots], [value.value for value in gender_identities])
+                      & np.isin(columns["accepting_new_patients"][slots], [value.value for value in accepting_new_patients])
+                      & np.isin(columns["remote_available"][slots], list(remote_statuses))]
+        return SearchCandidates(ids=columns["ids"][slots], latitudes=columns["latitude"][slots], longitudes=columns["longitude"][slots])
+
+    def rows(self, provider_ids: Iterable[bytes]) -> List[LocateRow | None]:
+        """Returns locate rows for the given ids, with None for any removed since they were searched"""
+        rows: List[LocateRow | None] = []
+        snapshot = self._snapshot
+        columns = snapshot.columns
+        for provider_id in provider_ids:
+            key = _id_key(provider_id)
+            slot = snapshot.slots.get(key)
+            if slot is None:
+                rows.append(None)
+                continue
+            rows.append((UUID(bytes=key), snapshot.given_names[slot], snapshot.family_names[slot], ProviderGenderIdentity(int(columns["gender_identity"][slot])),
+                         snapshot.formatted_addresses[slot], float(columns["latitude"][slot]), float(columns["longitude"][slot])))
+        return rows
+
+    async def sync(self, session: AsyncSession, full: bool = False):
+        """Pulls providers changed since the last sync. Deletions made by other workers arrive through on_deletion.
+
+        Provider.updated is the time its transaction started, so a row can commit after a sync
+        with an updated from before it. Each sync rereads provider_search_sync_margin_seconds
+        before the watermark to catch those."""
+        now = await session.scalar(select(func.localtimestamp())) # naive, like Provider.updated
+        if full or self.watermark is None or self.reload_requested:
+            self.reload_requested = False
+            rows = (await session.execute(select(*PROVIDER_SEARCH_COLUMNS))).all()
+            await run_in_threadpool(self.load, rows) # building the tree is CPU bound
+            self.last_full_load = time.monotonic()
+        else:
+            rows = (await session.execute(select(*PROVIDER_SEARCH_COLUMNS).where(Provider.updated >= self.watermark - timedelta(seconds=settings.provider_search_sync_margin_seconds)))).all()
+            await run_in_threadpool(self.upsert, rows)
+            if self.needs_rebuild:
+                await run_in_threadpool(self.rebuild)
+        self.watermark = now
+
+def _changed(snapshot: _Snapshot, rows: List[Sequence], removed: Iterable[bytes]) -> _Snapshot:
+    """The snapshot with the rows upserted and the removed ids dropped, leaving the original as it was"""
+    size = snapshot.size + len(rows)
+    columns, points = snapshot.columns, snapshot.points
+    if size > len(points):
+        capacity = max(16, size * 2)
+        columns = {name: _resized(column, snapshot.size, capacity) for name, column in columns.items()}
+        points = _resized(points, snapshot.size, capacity)
+    alive = np.ones(size, dtype=np.bool_)
+    alive[:snapshot.size] = snapshot.alive
+    slots = dict(snapshot.slots)
+    dead = snapshot.dead
+
+    def drop(provider_id: bytes):
+        nonlocal dead
+        slot = slots.pop(provider_id, None)
+        if slot is not None:
+            alive[slot] = False
+            dead += 1
+
+    for names in (snapshot.given_names, snapshot.family_names, snapshot.formatted_addresses):
+        del names[snapshot.size:] # left by a write that failed partway, nothing published can see them
+    for provider_id in removed:
+        drop(provider_id)
+    if rows:
+        points[snapshot.size:size] = _unit_vectors(np.array([row[5] for row in rows], dtype=np.float64), np.array([row[6] for row in rows], dtype=np.float64))
+    for slot, row in enumerate(rows, start=snapshot.size):
+        provider_id, given_name, family_name, gender_identity, formatted_address, latitude, longitude, provider_type, accepting_new_patients, remote_available, state_abbreviation = row
+        drop(provider_id.bytes)
+        columns["ids"][slot] = provider_id.bytes
+        columns["provider_type"][slot] = provider_type.value
+        columns["accepting_new_patients"][slot] = accepting_new_patients.value
+        columns["gender_identity"][slot] = gender_identity.value
+        columns["remote_available"][slot] = remote_available
+        columns["state_abbreviation"][slot] = state_abbreviation.encode()
+        columns["latitude"][slot] = latitude
+        columns["longitude"][slot] = longitude
+        snapshot.given_names.append(given_name)
+        snapshot.family_names.append(family_name)
+        snapshot.formatted_addresses.append(formatted_address)
+        slots[provider_id.bytes] = slot
+    return _Snapshot(size=size, columns=columns, points=points, given_names=snapshot.given_names, family_names=snapshot.family_names,
+                     formatted_addresses=snapshot.formatted_addresses, alive=alive, dead=dead, slots=slots, tree=snapshot.tree, tree_size=snapshot.tree_size)
+
+def _rebuilt(snapshot: _Snapshot) -> _Snapshot:
+    """A compacted copy of the snapshot, with a KD-tree over every slot"""
+    keep = np.flatnonzero(snapshot.alive)
+    columns = {name: column[:snapshot.size][keep] for name, column in snapshot.columns.items()}
+    points = snapshot.points[:snapshot.size][keep]
+    from scipy.spatial import cKDTree # only paid for when the "memory" backend is in use
+    return _Snapshot(size=len(keep), columns=columns, points=points,
+                     given_names=[snapshot.given_names[slot] for slot in keep],
+                     family_names=[snapshot.family_names[slot] for slot in keep],
+                     formatted_addresses=[snapshot.formatted_addresses[slot] for slot in keep],
+                     alive=np.ones(len(keep), dtype=np.bool_), dead=0,
+                     slots={_id_key(provider_id): slot for slot, provider_id in enumerate(columns["ids"])},
+                     tree=cKDTree(points) if len(keep) else None, tree_size=len(keep))
+
+provider_search_engine = ProviderSearchEngine()
+
+async def sync_provider_search_engine():
+    full = time.monotonic() - provider_search_engine.last_full_load >= settings.provider_search_full_reload_seconds
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        await provider_search_engine.sync(session, full=full)
+
+async def keep_provider_search_engine_synced():
+    """Runs for the lifetime of the app when provider_search_backend is "memory" """
+    while True:
+        await asyncio.sleep(settings.provider_search_sync_seconds)
+        try:
+            await sync_provider_search_engine()
+        except Exception:
+            logger.exception("Provider search engine sync failed, serving the previous snapshot")
@@ -0,0 +1,152 @@
+"""Approximate geocoding from ZIP code centroids, without a network call.
+
+The centroids live in a small binary file that every worker memory-maps at startup, so they
+share one copy through the page cache:
+
+    header       "<4sI"            magic, number of ZIP codes
+    zip codes    uint32[count]     sorted ascending
+    latitudes    float32[count]
+    longitudes   float32[count]
+    states       char[2][count]    USPS state abbreviation
+
+data/zip_centroids.bin is committed, built from the zips.json.bz2 bundled in the MIT licensed
+zipcodes package (https://github.com/seanpianka/zipcodes, version 1.2.0). To rebuild it from
+that file, or from any CSV with zip, latitude, longitude and state columns:
+
+    cd backend/app && python -m api.zip_centroids build zips.json.bz2
+"""
+import argparse
+import bz2
+import csv
+import json
+import logging
+import os
+import struct
+from dataclasses import dataclass
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+from config.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HAZ\x02"
+_BYTES_PER_ZIP = 4 + 4 + 4 + 2
+_HEADER = struct.Struct("<4sI")
+
+APP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class InvalidZipCentroidsFileException(Exception):
+    """Raised when a centroid file doesn't have the expected header or size"""
+    pass
+
+def parse_zip_code(zip_code: str) -> int | None:
+    """The 5 digit ZIP as an int, accepting ZIP+4. None if it isn't one."""
+    digits = zip_code.strip().split("-")[0]
+    return int(digits) if len(digits) == 5 and digits.isdigit() else None
+
+class ZipCentroid(NamedTuple):
+    latitude: float
+    longitude: float
+    state_abbreviation: str
+
+@dataclass
+class ZipCentroidStats:
+    hits: int = 0
+    misses: int = 0
+
+class ZipCentroids:
+    """Sorted ZIP codes with their centroids, looked up by binary search. Empty until a file is loaded."""
+
+    def __init__(self):
+        self._zip_codes = np.empty(0, dtype="<u4")
+        self._latitudes = np.empty(0, dtype="<f4")
+        self._longitudes = np.empty(0, dtype="<f4")
+        self._states = np.empty(0, dtype="S2")
+        self.stats = ZipCentroidStats()
+
+    def load(self, path: str):
+        """Memory-maps a centroid file, replacing whatever was loaded before"""
+        with open(path, "rb") as file:
+            magic, count = _HEADER.unpack(file.read(_HEADER.size))
+        if magic != MAGIC or os.path.getsize(path) != _HEADER.size + count * _BYTES_PER_ZIP:
+            raise InvalidZipCentroidsFileException(path)
+        def column(dtype: str, offset: int) -> np.ndarray:
+            if count == 0:
+                return np.empty(0, dtype=dtype) # np.memmap can't map zero bytes
+            return np.memmap(path, dtype=dtype, mode="r", offset=_HEADER.size + offset * count, shape=(count,))
+        self._zip_codes, self._latitudes, self._longitudes, self._states = column("<u4", 0), column("<f4", 4), column("<f4", 8), column("S2", 12)
+
+    def __len__(self) -> int:
+        return len(self._zip_codes)
+
+    def lookup(self, zip_code: str) -> ZipCentroid | None:
+        code = parse_zip_code(zip_code)
+        zip_codes, latitudes, longitudes, states = self._zip_codes, self._latitudes, self._longitudes, self._states
+        index = int(np.searchsorted(zip_codes, code)) if code is not None else len(zip_codes)
+        if index < len(zip_codes) and zip_codes[index] == code:
+            self.stats.hits += 1
+            # float32 is good to about a meter
+            return ZipCentroid(round(float(latitudes[index]), 5), round(float(longitudes[index]), 5), states[index].decode())
+        self.stats.misses += 1
+        return None
+
+def write_zip_centroids(path: str, centroids: Dict[int, Tuple[float, float, str]]):
+    zip_codes = np.array(sorted(centroids), dtype="<u4")
+    with open(path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, len(zip_codes)))
+        file.write(zip_codes.tobytes())
+        file.write(np.array([centroids[code][0] for code in zip_codes.tolist()], dtype="<f4").tobytes())
+        file.write(np.array([centroids[code][1] for code in zip_codes.tolist()], dtype="<f4").tobytes())
+        file.write(np.array([centroids[code][2].upper() for code in zip_codes.tolist()], dtype="S2").tobytes())
+
+def read_centroid_source(path: str) -> Dict[int, Tuple[float, float, str]]:
+    """Centroids from the zipcodes package's zips.json(.bz2), or a CSV by whichever of the known column names it has"""
+    if path.endswith((".json", ".json.bz2")):
+        with (bz2.open if path.endswith(".bz2") else open)(path, "rt") as file:
+            return {code: (float(entry["lat"]), float(entry["long"]), entry["state"])
+                    for entry in json.load(file) if (code := parse_zip_code(entry["zip_code"])) is not None}
+
+    with open(path, newline="") as file:
+        delimiter = "\t" if "\t" in file.readline() else ","
+        file.seek(0)
+        reader = csv.DictReader(file, delimiter=delimiter)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        def column(*names: str) -> str:
+            for name in names:
+                if name in reader.fieldnames:
+                    return name
+            raise InvalidZipCentroidsFileException(f"{path} has none of the columns {', '.join(names)}")
+        zip_column, latitude_column, longitude_column = column("zip", "zip_code", "zcta"), column("lat", "latitude"), column("lng", "lon", "long", "longitude")
+        state_column = column("state", "state_abbreviation")
+
+        centroids: Dict[int, Tuple[float, float, str]] = {}
+        for row in reader:
+            code = parse_zip_code(row[zip_column])
+            if code is not None:
+                centroids[code] = (float(row[latitude_column]), float(row[longitude_column]), row[state_column].strip())
+    return centroids
+
+zip_centroids = ZipCentroids()
+
+def load_zip_centroids():
+    """Maps settings.zip_centroids_path into zip_centroids if the file exists. Called from the app lifespan."""
+    path = os.path.join(APP_DIRECTORY, settings.zip_centroids_path)
+    if not os.path.exists(path):
+        logger.warning("No ZIP centroids at %s, searches by ZIP code will need a street address to geocode", path)
+        return
+    zip_centroids.load(path)
+    logger.info("Loaded %d ZIP centroids from %s", len(zip_centroids), path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="convert zips.json.bz2 or a CSV")
+    build.add_argument("source")
+    build.add_argument("--output", default=os.path.join(APP_DIRECTORY, settings.zip_centroids_path))
+    args = parser.parse_args()
+
+    centroids = read_centroid_source(args.source)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_zip_centroids(args.output, centroids)
+    print(f"Wrote {len(centroids)} ZIP centroids to {args.output}")
@@ -0,0 +1,111 @@
+"""Contact request fan-out latency as a provider's backlog of pending requests grows.
+
+Seeds a throwaway provider device set with --devices contact mailboxes, then at each backlog
+depth (up to 10k pending requests) times --samples fan-outs through two paths:
+  * bulk: api.routes.message.insert_contact_requests, one executemany per request
+  * orm_append: the previous approach, mailbox.messages.append on each loaded mailbox, which
+    lazy loads every pending request in it first
+
+Needs the configured database. Everything seeded is removed again afterwards.
+
+    cd backend/app && python -m benchmarks.contact_fanout --devices 5 --backlog 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+from uuid import UUID, uuid4
+
+from api.routes.message import insert_contact_requests
+from benchmarks.encrypt_contact import generate_device_keys, upload_format
+from benchmarks.login_latency import percentiles
+from database.database import AsyncDBSession, DBSession
+from database.models.messaging import ContactMailbox, ContactRequest, Device, DeviceSet, UserType
+from security.messaging import encrypt_contact_batch
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+SEED_CHUNK = 1000
+
+def seed_devices(session: Session, devices: int) -> Tuple[UUID, List[Tuple[str, UUID]]]:
+    device_set = DeviceSet(user_type=UserType.PROVIDER)
+    session.add(device_set)
+    key_mailbox_pairs = []
+    for private_key in generate_device_keys(devices):
+        device = Device(identity_public_key=upload_format(private_key), signed_pre_key="", device_set=device_set)
+        mailbox = ContactMailbox(device=device)
+        session.add_all([device, mailbox])
+        session.flush()
+        key_mailbox_pairs.append((device.identity_public_key, mailbox.id))
+    session.commit()
+    return device_set.id, key_mailbox_pairs
+
+def seed_backlog(session: Session, mailbox_ids: List[UUID], requests: int):
+    """Pending requests spread evenly over the mailboxes. Contents don't matter, only row count and size."""
+    envelope = os.urandom(300)
+    rows = [{"mailbox_id": mailbox_ids[i % len(mailbox_ids)], "patient_message_encrypted": envelope} for i in range(requests)]
+    for start in range(0, len(rows), SEED_CHUNK):
+        session.execute(insert(ContactRequest), rows[start:start + SEED_CHUNK])
+    session.commit()
+
+async def time_bulk(key_mailbox_pairs: List[Tuple[str, UUID]], samples: int) -> List[float]:
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        session: AsyncSession
+        async with AsyncDBSession() as session:
+            await insert_contact_requests(session, key_mailbox_pairs, uuid4(), "benchmark")
+            await session.commit()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def time_orm_append(key_mailbox_pairs: List[Tuple[str, UUID]], samples: int) -> List[float]:
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        with DBSession() as session:
+            envelopes = encrypt_contact_batch(uuid4(), "benchmark", [key for key, _ in key_mailbox_pairs])
+            for (_, mailbox_id), envelope in zip(key_mailbox_pairs, envelopes):
+                session.get(ContactMailbox, mailbox_id).messages.append(ContactRequest(patient_message_encrypted=envelope))
+            session.commit()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+async def run(args) -> List[Dict]:
+    with DBSession() as session:
+        device_set_id, key_mailbox_pairs = seed_devices(session, args.devices)
+    mailbox_ids = [mailbox_id for _, mailbox_id in key_mailbox_pairs]
+
+    results = []
+    depth = 0
+    try:
+        for target in sorted({0, args.backlog // 4, args.backlog // 2, args.backlog}):
+            with DBSession() as session:
+                seed_backlog(session, mailbox_ids, max(target - depth, 0))
+            depth = max(depth, target)
+            # The timed fan-outs add rows of their own, keep the reported depth accurate
+            bulk = await time_bulk(key_mailbox_pairs, args.samples)
+            orm_append = time_orm_append(key_mailbox_pairs, args.samples)
+            results.append({"pending_requests": depth, "bulk": percentiles(bulk), "orm_append": percentiles(orm_append)})
+            depth += 2 * args.samples * args.devices
+    finally:
+        with DBSession() as session:
+            session.execute(delete(ContactRequest).where(ContactRequest.mailbox_id.in_(mailbox_ids)))
+            session.execute(delete(DeviceSet).where(DeviceSet.id == device_set_id)) # devices and mailboxes cascade
+            session.commit()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=5)
+    parser.add_argument("--backlog", type=int, default=10_000, help="pending requests at the deepest level")
+    parser.add_argument("--samples", type=int, default=50, help="fan-outs timed per path and depth")
+    args = parser.parse_args()
+
+    print(json.dumps({"devices": args.devices, "results": asyncio.run(run(args))}, indent=2))
+
+if __name__ == "__main__":
+    main()
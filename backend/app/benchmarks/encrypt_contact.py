@@ -0,0 +1,79 @@
+"""Per-request cost of encrypting a contact request for every device of a provider.
+
+Compares the legacy format (two pure-Python RSA blocks per device, key parsed for every
+payload) against the envelope that /message/request writes, for a few message lengths.
+Legacy messages longer than one RSA block can't be encrypted at all and are reported as null.
+
+    cd backend/app && python -m benchmarks.encrypt_contact --repeat 20
+"""
+import argparse
+import json
+import statistics
+import time
+from base64 import b64decode, b64encode
+from typing import Callable, Dict, List
+from uuid import UUID, uuid4
+
+import rsa
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa as rsa_keys
+from security.messaging import decrypt_contact, encrypt_contact_batch, load_public_key
+
+DEVICE_COUNTS = (1, 5, 20)
+MESSAGE_LENGTHS = (64, 200, 2000)
+
+def generate_device_keys(count: int, key_size: int = 2048) -> List[rsa_keys.RSAPrivateKey]:
+    return [rsa_keys.generate_private_key(public_exponent=65537, key_size=key_size) for _ in range(count)]
+
+def upload_format(private_key: rsa_keys.RSAPrivateKey) -> str:
+    """The public key as clients upload it: base64 of a PKCS#1 PEM"""
+    return b64encode(private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.PKCS1)).decode()
+
+def legacy_request(keys: List[str], patient_id: UUID, message: str):
+    for key in keys:
+        for payload in (str(patient_id), message):
+            rsa.encrypt(payload.encode(), rsa.PublicKey._load_pkcs1_pem(b64decode(key)))
+
+def envelope_request(keys: List[str], patient_id: UUID, message: str):
+    encrypt_contact_batch(patient_id, message, keys)
+
+def time_request(request: Callable[[List[str], UUID, str], None], keys: List[str], patient_id: UUID, message: str, repeat: int) -> Dict[str, float] | None:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            request(keys, patient_id, message)
+        except OverflowError:
+            return None # too long for a single RSA block
+        samples.append(time.perf_counter() - start)
+    return {"mean_ms": statistics.fmean(samples) * 1000, "min_ms": min(samples) * 1000}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    patient_id = uuid4()
+    private_keys = generate_device_keys(max(DEVICE_COUNTS))
+    keys = [upload_format(private_key) for private_key in private_keys]
+    for key in keys:
+        load_public_key(key) # warm, as it is after a provider's first request
+
+    # Sanity check that what gets stored decodes on the device
+    envelope = encrypt_contact_batch(patient_id, "round trip", keys[:1])[0]
+    assert decrypt_contact(None, envelope, private_keys[0]) == (patient_id, "round trip")
+
+    results = []
+    for devices in DEVICE_COUNTS:
+        for length in MESSAGE_LENGTHS:
+            message = ("I'm looking for a therapist who is available on weekday evenings. " * (length // 66 + 1))[:length]
+            results.append({
+                "devices": devices,
+                "message_length": length,
+                "legacy": time_request(legacy_request, keys[:devices], patient_id, message, args.repeat),
+                "envelope": time_request(envelope_request, keys[:devices], patient_id, message, args.repeat),
+            })
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Login latency under concurrent load.
+
+In-process (default): drives security.passwords.PasswordHasher directly with many concurrent
+verifications, and samples event loop lag alongside to show other requests stay responsive.
+
+    cd backend/app && python -m benchmarks.login_latency --concurrency 32 --requests 256
+
+Against a running server: logs in as an existing patient over HTTP.
+
+    python -m benchmarks.login_latency --url http://localhost:8080 --email a@b.c --password hunter2
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+from fastapi import HTTPException
+from security.passwords import PasswordHasher
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    def at(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {"p50_ms": at(0.50) * 1000, "p95_ms": at(0.95) * 1000, "p99_ms": at(0.99) * 1000, "max_ms": ordered[-1] * 1000, "mean_ms": statistics.fmean(ordered) * 1000}
+
+async def run_load(attempt: Callable[[], Awaitable[bool]], concurrency: int, requests: int) -> Dict:
+    latencies: List[float] = []
+    rejected = 0
+    remaining = requests
+
+    async def user():
+        nonlocal remaining, rejected
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            if await attempt():
+                latencies.append(time.perf_counter() - start)
+            else:
+                rejected += 1
+
+    loop_lag: List[float] = []
+    done = asyncio.Event()
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            loop_lag.append(time.perf_counter() - start - 0.01)
+
+    probe_task = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe_task
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "completed": len(latencies),
+        "rejected_503": rejected,
+        "throughput_per_s": len(latencies) / elapsed,
+        "latency": percentiles(latencies),
+        "event_loop_lag": percentiles(loop_lag),
+    }
+
+async def in_process(args) -> Dict:
+    hasher = PasswordHasher(workers=args.workers, max_queue=args.max_queue)
+    password_hash = await hasher.hash("benchmark-password")
+    await asyncio.gather(*(hasher.verify("benchmark-password", password_hash) for _ in range(args.workers))) # warm up every process
+
+    async def attempt() -> bool:
+        try:
+            valid, _ = await hasher.verify("benchmark-password", password_hash)
+            return valid
+        except HTTPException:
+            return False
+
+    try:
+        result = await run_load(attempt, args.concurrency, args.requests)
+    finally:
+        hasher.shutdown()
+    result.update({"mode": "in_process", "workers": args.workers, "max_queue": args.max_queue})
+    return result
+
+async def over_http(args) -> Dict:
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        async def attempt() -> bool:
+            response = await client.post(f"/{args.user_type}/token", data={"username": args.email, "password": args.password})
+            return response.status_code == 200
+
+        result = await run_load(attempt, args.concurrency, args.requests)
+    result.update({"mode": "http", "url": args.url})
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=2, help="in-process: hashing processes")
+    parser.add_argument("--max-queue", type=int, default=10_000, help="in-process: queue limit before 503s")
+    parser.add_argument("--url", help="benchmark a running server instead")
+    parser.add_argument("--user-type", choices=["patient", "provider"], default="patient")
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    result = asyncio.run(over_http(args) if args.url else in_process(args))
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Behaviour of api.maps.MapsClient against a fake upstream with injected latency and failures.
+
+The fake is benchmarks.stubs.StubMapsTransport, so nothing leaves the process. Each scenario reports wall time,
+upstream requests and the client's stats, and checks the property it exists for: identical
+concurrent lookups share one request, distinct ones run concurrently, a slow
+upstream can't hold a call past its deadline, retries absorb a flaky upstream, and a dead one
+opens the circuit so later calls fail fast. Exits non-zero if any check fails.
+
+    cd backend/app && python -m benchmarks.maps_client
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from dataclasses import asdict
+from typing import Dict, List
+
+from api.maps import CircuitBreaker, MapsClient, MapsUnavailableException
+from benchmarks.login_latency import percentiles
+from benchmarks.stubs import StubMapsTransport
+
+async def timed_calls(client: MapsClient, addresses: List[str]) -> Dict:
+    latencies: List[float] = []
+    failed = 0
+    async def call(address: str):
+        nonlocal failed
+        start = time.perf_counter()
+        try:
+            await client.geocode(address)
+        except MapsUnavailableException:
+            failed += 1
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await asyncio.gather(*(call(address) for address in addresses))
+    return {"calls": len(addresses), "failed": failed, "wall_seconds": time.perf_counter() - start, "latency": percentiles(latencies)}
+
+async def scenario(name: str, transport: StubMapsTransport, addresses: List[str], check, **client_options) -> Dict:
+    client = MapsClient(key="fake", transport=transport, **client_options)
+    try:
+        result = await timed_calls(client, addresses)
+    finally:
+        await client.aclose()
+    result.update({"scenario": name, "upstream_requests": transport.requests, "breaker": client.breaker.state, "stats": asdict(client.stats)})
+    result["passed"] = bool(check(result))
+    return result
+
+async def run(args) -> List[Dict]:
+    random.seed(0)
+    results = [
+        await scenario("identical lookups coalesce", StubMapsTransport(latency=0.2), ["1 Main St, Troy, NY"] * args.calls,
+                       lambda r: r["upstream_requests"] == 1 and r["failed"] == 0),
+        await scenario("distinct lookups run concurrently", StubMapsTransport(latency=0.05), [f"{i} Main St, Troy, NY" for i in range(args.calls)],
+                       # The fake transport has no connection limit, so all of them overlap rather than queueing on threads
+                       lambda r: r["failed"] == 0 and r["upstream_requests"] == args.calls and r["wall_seconds"] < 5 * 0.05),
+        await scenario("slow upstream hits the deadline", StubMapsTransport(latency=30), [f"{i} Main St, Troy, NY" for i in range(10)],
+                       lambda r: r["failed"] == 10 and r["latency"]["max_ms"] < 1500, attempt_timeout_seconds=0.5, deadline_seconds=1.2, retry_backoff_seconds=0.05),
+        await scenario("retries absorb a flaky upstream", StubMapsTransport(latency=0.01, failure_rate=0.3), [f"{i} Main St, Troy, NY" for i in range(args.calls)],
+                       # with 2 retries a call only fails if all three attempts do, about 3% of calls
+                       lambda r: r["failed"] < 0.1 * args.calls, retry_backoff_seconds=0.01, breaker=CircuitBreaker(failures=args.calls)),
+    ]
+
+    # Failures one after another, so the circuit opens partway through and the rest fail without a request
+    transport = StubMapsTransport(latency=0.01, failure_rate=1.0)
+    client = MapsClient(key="fake", transport=transport, retry_backoff_seconds=0.01, breaker=CircuitBreaker(failures=5, reset_seconds=60))
+    before_open, after_open = [], []
+    for i in range(args.calls):
+        opened = client.breaker.state == "open"
+        (after_open if opened else before_open).append((await timed_calls(client, [f"{i} Main St, Troy, NY"]))["latency"]["max_ms"])
+    await client.aclose()
+    results.append({"scenario": "dead upstream opens the circuit", "calls": args.calls, "upstream_requests": transport.requests, "breaker": client.breaker.state,
+                    "stats": asdict(client.stats), "latency_before_open_ms": max(before_open), "latency_after_open_ms": max(after_open, default=None),
+                    "passed": client.breaker.state == "open" and transport.requests == 5 * 3 and bool(after_open) and max(after_open) < 5})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    failures = [result["scenario"] for result in results if not result["passed"]]
+    if failures:
+        print(f"Failed: {', '.join(failures)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
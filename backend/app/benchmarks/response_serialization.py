@@ -0,0 +1,109 @@
+"""Response serialization of the page endpoints: models through FastAPI versus rows straight to orjson.
+
+For each row count, builds the body the way the routes used to (a pydantic model per row, then
+FastAPI's serialize_response revalidating it against the route's response_model and JSONResponse
+rendering it) and the way they do now (row dicts rendered by ORJSONResponse), checks both decode
+to the same JSON and reports the time of each. No database is needed. Pages are capped at a few
+hundred rows in the routes, the larger counts show how the per-row cost scales.
+
+    cd backend/app && python -m benchmarks.response_serialization --rows 1000 10000 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+from uuid import uuid4
+
+from api.api import app
+from api.maps import Geocode
+from api.routes.locate import (
+    FormattedLocation,
+    LocateRelevantProviderInfo,
+    LocateResults,
+    Name,
+    locater_row_to_dict,
+)
+from api.routes.message import (
+    ContactMessage,
+    ContactPage,
+    MailboxMessage,
+    MailboxPage,
+    contact_row_to_dict,
+    mailbox_row_to_dict,
+)
+from database.models.provider import ProviderGenderIdentity
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+def locate_rows(count: int) -> List:
+    return [(uuid4(), "Given", f"Family {i}", random.choice(list(ProviderGenderIdentity)), f"{i} Main St, Troy, NY 12180, USA",
+             random.uniform(25, 49), random.uniform(-124, -67), random.uniform(0, 100)) for i in range(count)]
+
+def contact_rows(count: int, ciphertext_bytes: int) -> List:
+    now = datetime.utcnow()
+    return [(uuid4(), now - timedelta(seconds=i), None, os.urandom(ciphertext_bytes)) for i in range(count)]
+
+def mailbox_rows(count: int, ciphertext_bytes: int) -> List:
+    return [(uuid4(), os.urandom(ciphertext_bytes), uuid4(), uuid4(), "identity-key", None, None) for _ in range(count)]
+
+def response_field(path: str):
+    return next(route.response_field for route in app.routes if isinstance(route, APIRoute) and route.path == path)
+
+def model_body(path: str, content) -> bytes:
+    """What FastAPI does with a returned model: validate it against response_model again, then render with json.dumps"""
+    return JSONResponse(asyncio.run(serialize_response(field=response_field(path), response_content=content))).body
+
+def endpoints(rows: int, ciphertext_bytes: int) -> Dict[str, Dict[str, Callable[[], bytes]]]:
+    located, contacts, messages = locate_rows(rows), contact_rows(rows, ciphertext_bytes), mailbox_rows(rows, ciphertext_bytes)
+    return {
+        "/locate/nearby": {
+            "models": lambda: model_body("/locate/nearby", LocateResults(providers=[
+                LocateRelevantProviderInfo(provider_id=row[0], provider_name=Name(given=row[1], family=row[2]), provider_gender_identity=row[3].name,
+                                           provider_location=FormattedLocation(formatted_address=row[4], geocode=Geocode(latitude=row[5], longitude=row[6])), distance=row[7])
+                for row in located], next_cursor=None)),
+            "orjson": lambda: ORJSONResponse({"providers": [locater_row_to_dict(row[:7], row[7]) for row in located], "next_cursor": None}).body,
+        },
+        "/message/contact/pending": {
+            "models": lambda: model_body("/message/contact/pending", ContactPage(requests=[
+                ContactMessage(id=row[0], created=row[1], patient_id_encrypted=row[2], patient_message_encrypted=row[3]) for row in contacts], next_cursor=None)),
+            "orjson": lambda: ORJSONResponse({"requests": [contact_row_to_dict(row) for row in contacts], "next_cursor": None}).body,
+        },
+        "/message/provider/inbox": {
+            "models": lambda: model_body("/message/provider/inbox", MailboxPage(messages=[
+                MailboxMessage(message_id=row[0], message_encrypted=row[1], sender_id=row[2], sender_device_id=row[3], sender_identity_key=row[4],
+                               sender_ephemeral_key=row[5], chain_key=row[6]) for row in messages], next_cursor=None)),
+            "orjson": lambda: ORJSONResponse({"messages": [mailbox_row_to_dict(row) for row in messages], "next_cursor": None}).body,
+        },
+    }
+
+def best_of(repeat: int, render: Callable[[], bytes]) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--ciphertext-bytes", type=int, default=600, help="about the size of a contact request envelope")
+    args = parser.parse_args()
+    random.seed(0)
+
+    results = []
+    for rows in args.rows:
+        for path, renderers in endpoints(rows, args.ciphertext_bytes).items():
+            if json.loads(renderers["models"]()) != json.loads(renderers["orjson"]()):
+                raise SystemExit(f"{path}: the two paths produced different JSON")
+            models, fast = best_of(args.repeat, renderers["models"]), best_of(args.repeat, renderers["orjson"])
+            results.append({"endpoint": path, "rows": rows, "models_ms": models * 1000, "orjson_ms": fast * 1000, "speedup": models / fast})
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Synthetic data for the benchmarks, bulk loaded with COPY.
+
+Generates --providers providers around the metro areas in benchmarks.stubs (most within a few
+miles of downtown, the rest spread over the surrounding region), each with a device set of
+--devices devices, and --patients patients with one device each. Then --pending contact
+requests are spread over the providers' contact mailboxes. A few popular providers get most
+of them, like real backlogs. Ids and values come from a random generator seeded with --seed, so
+the same arguments load the same rows, apart from timestamps.
+
+Seeded users have @seed.helpalign.invalid emails and all share BENCHMARK_PASSWORD. Each run first
+removes whatever an earlier one seeded, in the same transaction as the load. Run it against a
+local database migrated to head:
+
+    cd backend/app && alembic upgrade head && python -m benchmarks.seed --providers 20000 --pending 100000
+    python -m benchmarks.seed --clean
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Dict, Iterable, List, Sequence, Tuple
+from uuid import UUID
+
+from api.geo import grid_cell
+from benchmarks.stubs import METROS, StubKeyring
+from config.config import settings
+from database.database import get_engine
+from database.models.geocode import GeocodeCacheEntry
+from database.models.messaging import UserType
+from database.models.patient import Patient
+from database.models.provider import (
+    AcceptingNewPatients,
+    Provider,
+    ProviderGenderIdentity,
+    ProviderType,
+)
+from database.models.token import PatientDBToken, ProviderDBToken
+from security.messaging import contact_fingerprint
+from security.passwords import pwd_context
+from sqlalchemy import Connection, delete, select, text
+
+SEED_DOMAIN = "seed.helpalign.invalid"
+BENCHMARK_PASSWORD = "benchmark-password"
+BENCHMARK_STREET = "Benchmark Ave" # street of the addresses benchmarks.suite geocodes, so their cache entries can be found again
+ENVELOPE_BYTES = 4 + 2 + 256 + 12 + 16 + 200 + 16 # header, wrapped key, nonce, patient id, a short message and the tag
+COPY_CHUNK = 10_000
+
+METRO_SPREAD_DEGREES = 0.08 # about 5 miles
+REGION_SPREAD_DEGREES = 0.8
+REGIONAL_SHARE = 0.15
+
+GIVEN_NAMES = ["Alex", "Jordan", "Sam", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn", "Rowan", "Elliot"]
+FAMILY_NAMES = ["Garcia", "Smith", "Nguyen", "Johnson", "Patel", "Williams", "Kim", "Brown", "Cohen", "Okafor", "Rossi", "Larsen"]
+
+# Columns in COPY order, which the rows below follow
+COLUMNS = {
+    "providers": ("id", "provider_type", "remote_available", "accepting_new_patients", "gender_identity", "given_name", "family_name",
+                  "formatted_address", "latitude", "longitude", "state_abbreviation", "grid_cell", "email", "password_hash", "updated"),
+    "patients": ("id", "given_name", "family_name", "is_assisted_account", "email", "password_hash"),
+    "device_sets": ("id", "user_type", "provider_id", "patient_id"),
+    "devices": ("id", "identity_public_key", "signed_pre_key", "device_set_id"),
+    "mailboxes": ("id", "device_id"),
+    "contact_mailboxes": ("id", "device_id"),
+    "contact_requests": ("id", "created", "mailbox_id", "patient_message_encrypted", "sender_fingerprint"),
+}
+
+def seeded_uuid(rng: random.Random) -> UUID:
+    return UUID(int=rng.getrandbits(128), version=4)
+
+def generate(args, keyring: StubKeyring) -> Dict[str, List[Tuple]]:
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    password_hash = pwd_context.hash(BENCHMARK_PASSWORD) # one bcrypt for everyone, logins still pay the full cost
+    rows: Dict[str, List[Tuple]] = {table: [] for table in COLUMNS}
+
+    def add_devices(owner_type: UserType, owner_id: UUID, count: int, contact_mailboxes: bool) -> List[UUID]:
+        device_set_id = seeded_uuid(rng)
+        rows["device_sets"].append((device_set_id, owner_type, owner_id if owner_type == UserType.PROVIDER else None, owner_id if owner_type == UserType.PATIENT else None))
+        contact_mailbox_ids = []
+        for _ in range(count):
+            device_id = seeded_uuid(rng)
+            rows["devices"].append((device_id, keyring.public_key(len(rows["devices"])), "", device_set_id))
+            rows["mailboxes"].append((seeded_uuid(rng), device_id))
+            if contact_mailboxes:
+                contact_mailbox_ids.append(seeded_uuid(rng))
+                rows["contact_mailboxes"].append((contact_mailbox_ids[-1], device_id))
+        return contact_mailbox_ids
+
+    provider_mailboxes: List[List[UUID]] = []
+    for i in range(args.providers):
+        metro = rng.choices(METROS, weights=[metro.weight for metro in METROS])[0]
+        spread = REGION_SPREAD_DEGREES if rng.random() < REGIONAL_SHARE else METRO_SPREAD_DEGREES
+        latitude, longitude = rng.gauss(metro.latitude, spread), rng.gauss(metro.longitude, spread)
+        provider_id = seeded_uuid(rng)
+        rows["providers"].append((provider_id, rng.choice(list(ProviderType)), rng.random() < 0.3, rng.choice(list(AcceptingNewPatients)), rng.choice(list(ProviderGenderIdentity)),
+                                  rng.choice(GIVEN_NAMES), rng.choice(FAMILY_NAMES), f"{rng.randint(1, 9999)} Main St, {metro.city}, {metro.state_abbreviation} 00000, USA",
+                                  latitude, longitude, metro.state_abbreviation, grid_cell(latitude, longitude), f"provider-{i}@{SEED_DOMAIN}", password_hash, now))
+        provider_mailboxes.append(add_devices(UserType.PROVIDER, provider_id, args.devices, contact_mailboxes=True))
+
+    patient_ids = []
+    for i in range(args.patients):
+        patient_ids.append(seeded_uuid(rng))
+        rows["patients"].append((patient_ids[-1], rng.choice(GIVEN_NAMES), rng.choice(FAMILY_NAMES), False, f"patient-{i}@{SEED_DOMAIN}", password_hash))
+        add_devices(UserType.PATIENT, patient_ids[-1], 1, contact_mailboxes=False)
+
+    # A request is one row per device of the provider, all created together. Ages stay inside the retention window.
+    popularity = [rng.paretovariate(1.2) for _ in provider_mailboxes]
+    max_age_seconds = settings.contact_request_retention_days * 86400 * 0.9
+    while provider_mailboxes and patient_ids and len(rows["contact_requests"]) < args.pending:
+        mailbox_ids = rng.choices(provider_mailboxes, weights=popularity)[0]
+        patient_id, created = rng.choice(patient_ids), now - timedelta(seconds=rng.uniform(0, max_age_seconds))
+        for mailbox_id in mailbox_ids:
+            rows["contact_requests"].append((seeded_uuid(rng), created, mailbox_id, rng.randbytes(ENVELOPE_BYTES), contact_fingerprint(mailbox_id, patient_id)))
+    return rows
+
+def csv_value(value):
+    if isinstance(value, bytes):
+        return "\\x" + value.hex() # bytea hex input
+    if isinstance(value, Enum):
+        return value.name # how SQLAlchemy's Enum type stores members
+    if value is None:
+        return "\\N" # the NULL marker set in copy_rows, so empty strings stay empty strings
+    return value
+
+def copy_rows(cursor, table: str, columns: Sequence[str], rows: Iterable[Tuple]) -> int:
+    """COPY FROM STDIN in CSV, COPY_CHUNK rows per statement to bound the buffer"""
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    def flush():
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+        buffer.seek(0)
+        buffer.truncate()
+    for row in rows:
+        writer.writerow([csv_value(value) for value in row])
+        count += 1
+        if count % COPY_CHUNK == 0:
+            flush()
+    if buffer.tell():
+        flush()
+    return count
+
+def clean(connection: Connection) -> Dict[str, int]:
+    """Removes everything seeded, along with tokens issued to seeded users and the benchmark's geocode cache entries.
+    Device sets, devices, mailboxes and their contents cascade from the users."""
+    seeded_providers = select(Provider.id).where(Provider.email.like(f"%@{SEED_DOMAIN}"))
+    seeded_patients = select(Patient.id).where(Patient.email.like(f"%@{SEED_DOMAIN}"))
+    return {
+        "provider_access_tokens": connection.execute(delete(ProviderDBToken).where(ProviderDBToken.user_id.in_(seeded_providers))).rowcount,
+        "patient_access_tokens": connection.execute(delete(PatientDBToken).where(PatientDBToken.user_id.in_(seeded_patients))).rowcount,
+        "providers": connection.execute(delete(Provider).where(Provider.email.like(f"%@{SEED_DOMAIN}"))).rowcount,
+        "patients": connection.execute(delete(Patient).where(Patient.email.like(f"%@{SEED_DOMAIN}"))).rowcount,
+        "geocode_cache": connection.execute(delete(GeocodeCacheEntry).where(GeocodeCacheEntry.street_address.like(f"% {BENCHMARK_STREET.upper()}"))).rowcount,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", type=int, default=10_000)
+    parser.add_argument("--devices", type=int, default=2, help="per provider")
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--pending", type=int, default=50_000, help="contact request rows, one per provider device a request went to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keys", type=int, default=4, help="distinct device keys, see benchmarks.stubs.StubKeyring")
+    parser.add_argument("--clean", action="store_true", help="only remove what was seeded")
+    args = parser.parse_args()
+
+    result: Dict = {}
+    start = time.perf_counter()
+    rows = {} if args.clean else generate(args, StubKeyring(args.keys))
+    result["generate_seconds"] = time.perf_counter() - start
+
+    with get_engine().begin() as connection:
+        start = time.perf_counter()
+        result["removed"] = clean(connection)
+        result["clean_seconds"] = time.perf_counter() - start
+        if rows:
+            start = time.perf_counter()
+            cursor = connection.connection.cursor() # the psycopg2 cursor, in the same transaction
+            result["copied"] = {table: copy_rows(cursor, table, COLUMNS[table], rows[table]) for table in COLUMNS}
+            result["copy_seconds"] = time.perf_counter() - start
+            result["rows_per_second"] = sum(result["copied"].values()) / result["copy_seconds"]
+
+            start = time.perf_counter()
+            for table in COLUMNS:
+                connection.execute(text(f"ANALYZE {table}")) # fresh statistics, or the first benchmark runs on plans for empty tables
+            result["analyze_seconds"] = time.perf_counter() - start
+    print(json.dumps({"seed": args.seed, **result}, indent=2))
+
+if __name__ == "__main__":
+    main()
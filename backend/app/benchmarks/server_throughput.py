@@ -0,0 +1,119 @@
+"""HTTP throughput of main.py in each server_mode.
+
+Starts `python main.py` once per mode on a spare port, waits for it to answer, drives it with
+--clients load generator processes (one Python process can't saturate several workers), then
+sends SIGTERM and times the graceful shutdown. Settings come from the environment as usual, so
+point db_url at a migrated database for anything beyond routes that don't touch it.
+
+    cd backend/app && python -m benchmarks.server_throughput --modes dev production --workers 4
+    python -m benchmarks.server_throughput --method POST --path /locate/nearby --json body.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+from benchmarks.login_latency import percentiles
+
+APP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+async def drive(url: str, method: str, body: Dict | None, concurrency: int, seconds: float) -> Tuple[List[float], int]:
+    """Requests back to back from `concurrency` connections for `seconds`. Returns the latencies of 2xx responses and the count of others."""
+    latencies: List[float] = []
+    failed = 0
+    deadline = time.perf_counter() + seconds
+    async with httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def user():
+            nonlocal failed
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, url, json=body)
+                    ok = response.is_success
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    failed += 1
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, failed
+
+def client_process(arguments) -> Tuple[List[float], int]:
+    return asyncio.run(drive(*arguments))
+
+def wait_until_up(url: str, server: subprocess.Popen, log, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f"Server exited with {server.returncode} before answering:\n{log.read()[-2000:]}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server didn't answer within {timeout}s")
+
+def benchmark_mode(mode: str, args) -> Dict:
+    environment = {**os.environ, "server_mode": mode, "server_port": str(args.port), "server_host": "127.0.0.1",
+                   "server_workers": str(args.workers), "server_access_log": "false"}
+    log = tempfile.TemporaryFile("w+")
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=APP_DIRECTORY, env=environment, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{args.port}{args.path}"
+    try:
+        wait_until_up(url, server, log)
+        time.sleep(args.warmup) # let every worker finish its lifespan startup
+        per_client = max(1, args.concurrency // args.clients)
+        with multiprocessing.get_context("spawn").Pool(args.clients) as pool:
+            results = pool.map(client_process, [(url, args.method, args.body, per_client, args.seconds)] * args.clients)
+    finally:
+        start = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=120)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        shutdown_seconds = time.perf_counter() - start
+        log.close()
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {
+        "mode": mode,
+        "workers": 1 if mode == "dev" else args.workers or os.cpu_count(),
+        "concurrency": per_client * args.clients,
+        "completed": len(latencies),
+        "failed": sum(failed for _, failed in results),
+        "throughput_per_s": len(latencies) / args.seconds,
+        "latency": percentiles(latencies),
+        "shutdown_seconds": shutdown_seconds,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=["dev", "production"], default=["dev", "production"])
+    parser.add_argument("--workers", type=int, default=0, help="production server_workers, 0 for one per CPU")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", default="/docs", help="route to load, /docs needs no database")
+    parser.add_argument("--json", help="file with the JSON request body")
+    parser.add_argument("--concurrency", type=int, default=64, help="open connections across all clients")
+    parser.add_argument("--clients", type=int, default=4, help="load generator processes")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    args = parser.parse_args()
+    args.body = json.load(open(args.json)) if args.json else None
+
+    print(json.dumps([benchmark_mode(mode, args) for mode in args.modes], indent=2))
+
+if __name__ == "__main__":
+    main()
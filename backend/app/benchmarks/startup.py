@@ -0,0 +1,71 @@
+"""Cold start cost of api.api:app, so it can be tracked over time.
+
+Each run is a fresh interpreter: the import of api.api is timed with -X importtime, and with
+--lifespan the app's startup and shutdown are timed too (that part needs the database). Exits
+non-zero when the median import time exceeds --max-import-ms, if given.
+
+    cd backend/app && python -m benchmarks.startup --runs 5 --max-import-ms 2500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+APP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIFESPAN_PROBE = """
+import asyncio, json, time
+from api.api import app
+async def main():
+    start = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+    print(json.dumps({"startup_ms": (started - start) * 1000, "shutdown_ms": (time.perf_counter() - started) * 1000}))
+asyncio.run(main())
+"""
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """(module, self microseconds, cumulative microseconds) for every import line"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        modules.append((module.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+def run_once(lifespan: bool) -> Dict:
+    code = LIFESPAN_PROBE if lifespan else "import api.api"
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=APP_DIRECTORY, capture_output=True, text=True, check=True)
+    modules = parse_importtime(completed.stderr)
+    result: Dict = {"import_ms": next(cumulative for module, _, cumulative in modules if module == "api.api") / 1000, "modules": modules}
+    if lifespan:
+        result.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--lifespan", action="store_true", help="also time lifespan startup and shutdown")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules (by self time) to list")
+    parser.add_argument("--max-import-ms", type=float)
+    args = parser.parse_args()
+
+    runs = [run_once(args.lifespan) for _ in range(args.runs)]
+    report: Dict = {"runs": args.runs, "import_ms": {"median": statistics.median(run["import_ms"] for run in runs), "min": min(run["import_ms"] for run in runs)}}
+    if args.lifespan:
+        for phase in ("startup_ms", "shutdown_ms"):
+            report[phase] = {"median": statistics.median(run[phase] for run in runs), "min": min(run[phase] for run in runs)}
+    slowest = sorted(runs[-1]["modules"], key=lambda module: module[1], reverse=True)[:args.top]
+    report["slowest_modules"] = [{"module": module, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000} for module, self_us, cumulative_us in slowest]
+    print(json.dumps(report, indent=2))
+
+    if args.max_import_ms is not None and report["import_ms"]["median"] > args.max_import_ms:
+        print(f"Median import time {report['import_ms']['median']:.0f}ms exceeds {args.max_import_ms:.0f}ms", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Local stand-ins for the benchmarks: a fake Google Maps and a small pool of device keys.
+
+StubMapsTransport answers the geocoding and address validation calls of api.maps.MapsClient
+in process, after an injected latency and with an optional failure rate. An address in one of
+METROS geocodes to a spot near that city, anything else to a stable point in the lower 48.
+The same fake can be served over HTTP for a benchmarked server to call:
+
+    cd backend/app && python -m benchmarks.stubs maps --port 8098 --latency 0.08
+    maps_geocode_url=http://127.0.0.1:8098/geocode/json maps_address_validation_url=http://127.0.0.1:8098/v1:validateAddress python main.py
+
+StubKeyring stands in for device key generation. Real 2048 bit keys are slow enough to make,
+and contact encryption cost doesn't depend on which key is used, that seeded devices share a
+few of them.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+from benchmarks.encrypt_contact import generate_device_keys, upload_format
+
+@dataclass(frozen=True)
+class Metro:
+    city: str
+    state_abbreviation: str
+    latitude: float
+    longitude: float
+    weight: float # rough share of the population, and so of seeded providers
+
+METROS = [
+    Metro("New York", "NY", 40.7128, -74.0060, 20), Metro("Buffalo", "NY", 42.8864, -78.8784, 2), Metro("Albany", "NY", 42.6526, -73.7562, 2), Metro("Rochester", "NY", 43.1566, -77.6088, 2),
+    Metro("Los Angeles", "CA", 34.0522, -118.2437, 13), Metro("San Francisco", "CA", 37.7749, -122.4194, 7), Metro("San Diego", "CA", 32.7157, -117.1611, 3), Metro("Sacramento", "CA", 38.5816, -121.4944, 2),
+    Metro("Houston", "TX", 29.7604, -95.3698, 7), Metro("Dallas", "TX", 32.7767, -96.7970, 7), Metro("Austin", "TX", 30.2672, -97.7431, 2), Metro("San Antonio", "TX", 29.4241, -98.4936, 2),
+    Metro("Miami", "FL", 25.7617, -80.1918, 6), Metro("Tampa", "FL", 27.9506, -82.4572, 3), Metro("Orlando", "FL", 28.5383, -81.3792, 2), Metro("Jacksonville", "FL", 30.3322, -81.6557, 1),
+    Metro("Chicago", "IL", 41.8781, -87.6298, 9),
+    Metro("Philadelphia", "PA", 39.9526, -75.1652, 6), Metro("Pittsburgh", "PA", 40.4406, -79.9959, 2),
+    Metro("Boston", "MA", 42.3601, -71.0589, 5),
+    Metro("Seattle", "WA", 47.6062, -122.3321, 4), Metro("Spokane", "WA", 47.6588, -117.4260, 1),
+    Metro("Atlanta", "GA", 33.7490, -84.3880, 6),
+    Metro("Denver", "CO", 39.7392, -104.9903, 3),
+    Metro("Phoenix", "AZ", 33.4484, -112.0740, 5),
+    Metro("Detroit", "MI", 42.3314, -83.0458, 4),
+    Metro("Columbus", "OH", 39.9612, -82.9988, 2), Metro("Cleveland", "OH", 41.4993, -81.6944, 2), Metro("Cincinnati", "OH", 39.1031, -84.5120, 2),
+    Metro("Charlotte", "NC", 35.2271, -80.8431, 3), Metro("Raleigh", "NC", 35.7796, -78.6382, 2),
+    Metro("Minneapolis", "MN", 44.9778, -93.2650, 4),
+]
+
+def stub_location(address: str) -> Tuple[float, float]:
+    """Within a few miles of the metro named in the address, the same point every time for the same address"""
+    digest = hashlib.sha256(address.lower().encode()).digest()
+    jitter_latitude, jitter_longitude = (int.from_bytes(digest[:4], "big") / 2**32 - 0.5) * 0.2, (int.from_bytes(digest[4:8], "big") / 2**32 - 0.5) * 0.2
+    for metro in METROS:
+        if metro.city.lower() in address.lower():
+            return round(metro.latitude + jitter_latitude, 6), round(metro.longitude + jitter_longitude, 6)
+    return round(37 + jitter_latitude * 60, 6), round(-97 + jitter_longitude * 230, 6)
+
+class StubMaps:
+    """Google Maps response bodies for a request, after `latency` seconds, or failure_status at failure_rate"""
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.0, failure_status: int = 503):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.requests = 0
+
+    async def respond(self, method: str, query: Dict[str, List[str]], body: bytes) -> Tuple[int, Dict[str, Any]]:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            return self.failure_status, {"error_message": "injected"}
+        if method == "GET":
+            latitude, longitude = stub_location(query.get("address", [""])[0])
+            return 200, {"status": "OK", "results": [{"geometry": {"location": {"lat": latitude, "lng": longitude}}}]}
+
+        address = json.loads(body or b"{}").get("address", {})
+        lines = address.get("addressLines", [])
+        latitude, longitude = stub_location(", ".join(lines))
+        state = lines[-1].split(",")[1].strip() if lines and lines[-1].count(",") >= 1 else "NY"
+        return 200, {"result": {"verdict": {"addressComplete": True, "validationGranularity": "PREMISE"},
+                                "address": {"formattedAddress": ", ".join(lines) + ", USA"},
+                                "uspsData": {"standardizedAddress": {"state": state}},
+                                "geocode": {"location": {"latitude": latitude, "longitude": longitude}}}}
+
+class StubMapsTransport(httpx.AsyncBaseTransport):
+    """StubMaps as an httpx transport, for MapsClient(transport=...) or maps_client.transport"""
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.0, failure_status: int = 503):
+        self.stub = StubMaps(latency, failure_rate, failure_status)
+
+    @property
+    def requests(self) -> int:
+        return self.stub.requests
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        status_code, body = await self.stub.respond(request.method, parse_qs(request.url.query.decode()), await request.aread())
+        return httpx.Response(status_code, json=body)
+
+def stub_maps_app(stub: StubMaps):
+    """StubMaps as an ASGI app, answering on any path"""
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body, more_body = b"", True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        status_code, response = await stub.respond(scope["method"], parse_qs(scope["query_string"].decode()), body)
+        await send({"type": "http.response.start", "status": status_code, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(response).encode()})
+    return app
+
+class StubKeyring:
+    """`size` real RSA keys, handed out round robin in the upload format devices use"""
+
+    def __init__(self, size: int = 4, key_size: int = 2048):
+        self.private_keys = generate_device_keys(size, key_size)
+        self.public_keys = [upload_format(private_key) for private_key in self.private_keys]
+
+    def public_key(self, index: int) -> str:
+        return self.public_keys[index % len(self.public_keys)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    maps = subparsers.add_parser("maps", help="serve the fake Google Maps over HTTP")
+    maps.add_argument("--host", default="127.0.0.1")
+    maps.add_argument("--port", type=int, default=8098)
+    maps.add_argument("--latency", type=float, default=0.05, help="seconds before each answer")
+    maps.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    uvicorn.run(stub_maps_app(StubMaps(args.latency, args.failure_rate)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,261 @@
+"""End-to-end scenarios on the data benchmarks.seed loads, reported as JSON so runs can be compared.
+
+  locate   /locate/nearby from street addresses near the seeded metros, geocoded by the Maps stub
+  login    /patient/token and /provider/token with the seeded password, so mostly bcrypt
+  contact  /message/request from a seeded patient, encrypting it for every device of a provider
+  drain    a provider device paging through /message/contact/pending and acknowledging each page until
+           none are left, one device per timed attempt, the devices with the most pending requests first
+
+In process (the default) the app runs in a TestClient, with Google Maps replaced by
+benchmarks.stubs and rate limits off. Requests go one at a time, so latency is the app and
+Postgres alone. With --url, --concurrency connections load a running server instead. Start that
+server with rate_limit_backend=off, the same pass_key as here, and the Maps URLs pointed at
+`python -m benchmarks.stubs maps`. Access tokens are written straight to the token tables
+rather than logged in for, so only the login scenario pays for bcrypt.
+
+contact and drain change the pending requests, so reseed before runs that are to be compared.
+With --baseline, each scenario's p50 and p95 are compared with an earlier run's output, and the
+run exits non-zero if any of them is more than --tolerance slower.
+
+    cd backend/app && python -m benchmarks.seed && python -m benchmarks.suite --output before.json
+    python -m benchmarks.seed && python -m benchmarks.suite --baseline before.json
+    python -m benchmarks.suite --url http://127.0.0.1:8080 --concurrency 32 --scenarios locate contact
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Tuple
+from uuid import UUID
+
+import httpx
+from api.api import app
+from api.maps import maps_client
+from api.routes.message import MAX_CONTACT_PAGE
+from benchmarks.login_latency import percentiles
+from benchmarks.seed import BENCHMARK_PASSWORD, BENCHMARK_STREET, SEED_DOMAIN
+from benchmarks.stubs import METROS, StubMapsTransport
+from config.config import settings
+from database.database import get_engine
+from database.models.geocode import GeocodeCacheEntry
+from database.models.messaging import ContactMailbox, ContactRequest, Device, DeviceSet
+from database.models.patient import Patient
+from database.models.provider import (
+    AcceptingNewPatients,
+    Provider,
+    ProviderGenderIdentity,
+    ProviderType,
+)
+from database.models.token import PatientDBToken, ProviderDBToken
+from fastapi.testclient import TestClient
+from security.access import create_access_token
+from security.tokens import token_digest
+from sqlalchemy import Connection, delete, func, insert, select
+
+TOKEN_LIFETIME = timedelta(hours=2)
+REGRESSION_STATS = ("p50_ms", "p95_ms")
+
+Call = Callable[..., Awaitable[httpx.Response]] # (method, path, **request options)
+Attempt = Callable[[Call], Awaitable[int | None]] # items handled (providers found, requests drained), None on failure
+
+@dataclass
+class Fixtures:
+    patient_emails: List[str]
+    provider_emails: List[str]
+    provider_ids: List[UUID]
+    patient_tokens: List[str]
+    drain_devices: List[Tuple[str, UUID]] # provider token and device id, most pending requests first
+    seeded: Dict[str, int]
+
+@dataclass
+class Scenario:
+    attempt: Attempt
+    requests: int
+    warmup: int = 0 # untimed attempts first, to open connections and fill caches
+
+def issue_tokens(connection: Connection, token_model, user_ids: List[UUID]) -> Dict[UUID, str]:
+    """Access tokens stored the way a login stores them, without the bcrypt"""
+    tokens = {user_id: create_access_token(data={"sub": str(user_id)}, expires_delta=TOKEN_LIFETIME) for user_id in user_ids}
+    if tokens:
+        expires_at = datetime.utcnow() + TOKEN_LIFETIME
+        connection.execute(insert(token_model), [{"token_digest": token_digest(token), "user_id": user_id, "expires_at": expires_at} for user_id, token in tokens.items()])
+    return tokens
+
+def load_fixtures(args) -> Fixtures:
+    seeded_provider = Provider.email.like(f"%@{SEED_DOMAIN}")
+    with get_engine().begin() as connection:
+        # Every run geocodes its addresses from a cold cache
+        connection.execute(delete(GeocodeCacheEntry).where(GeocodeCacheEntry.street_address.like(f"% {BENCHMARK_STREET.upper()}")))
+        patients = connection.execute(select(Patient.id, Patient.email).where(Patient.email.like(f"%@{SEED_DOMAIN}")).order_by(Patient.email).limit(args.users)).all()
+        providers = connection.execute(select(Provider.id, Provider.email).where(seeded_provider).order_by(Provider.email).limit(args.users)).all()
+        if not patients or not providers:
+            raise SystemExit("Nothing seeded, run `python -m benchmarks.seed` first")
+        devices = connection.execute(select(DeviceSet.provider_id, Device.id).join(Device, Device.device_set_id == DeviceSet.id).join(ContactMailbox, ContactMailbox.device_id == Device.id).join(ContactRequest, ContactRequest.mailbox_id == ContactMailbox.id).join(Provider, Provider.id == DeviceSet.provider_id).where(seeded_provider).group_by(DeviceSet.provider_id, Device.id).order_by(func.count().desc(), Device.id).limit(args.drain_devices)).all()
+        seeded = {
+            "providers": connection.scalar(select(func.count()).select_from(Provider).where(seeded_provider)),
+            "patients": connection.scalar(select(func.count()).select_from(Patient).where(Patient.email.like(f"%@{SEED_DOMAIN}"))),
+            "pending_contact_requests": connection.scalar(select(func.count()).select_from(ContactRequest)),
+        }
+        patient_tokens = issue_tokens(connection, PatientDBToken, [patient_id for patient_id, _ in patients])
+        provider_tokens = issue_tokens(connection, ProviderDBToken, list({provider_id for provider_id, _ in devices}))
+    return Fixtures(patient_emails=[email for _, email in patients], provider_emails=[email for _, email in providers], provider_ids=[provider_id for provider_id, _ in providers],
+                    patient_tokens=list(patient_tokens.values()), drain_devices=[(provider_tokens[provider_id], device_id) for provider_id, device_id in devices], seeded=seeded)
+
+def bearer(token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+def locate(args, fixtures: Fixtures, rng: random.Random) -> Scenario:
+    async def attempt(call: Call) -> int | None:
+        metro = rng.choices(METROS, weights=[metro.weight for metro in METROS])[0]
+        response = await call("POST", "/locate/nearby", json={
+            "street_address": f"{rng.randint(1, args.addresses)} {BENCHMARK_STREET}", "city": metro.city, "state_abbreviation": metro.state_abbreviation,
+            "radius": args.radius, "limit": 20,
+            "filters": {"provider_gender_identity_allow": [identity.value for identity in ProviderGenderIdentity],
+                        "accepting_new_patients_allow": [accepting.value for accepting in AcceptingNewPatients],
+                        "provider_type": rng.choice(list(ProviderType)).value, "include_remote": True, "remote_only": False}})
+        return len(response.json()["providers"]) if response.status_code == 200 else None
+    return Scenario(attempt, args.requests, args.warmup)
+
+def login(args, fixtures: Fixtures, rng: random.Random) -> Scenario:
+    async def attempt(call: Call) -> int | None:
+        user_type, emails = rng.choice((("patient", fixtures.patient_emails), ("provider", fixtures.provider_emails)))
+        response = await call("POST", f"/{user_type}/token", data={"username": rng.choice(emails), "password": BENCHMARK_PASSWORD})
+        return 1 if response.status_code == 200 else None
+    return Scenario(attempt, args.login_requests, min(args.warmup, 2))
+
+def contact(args, fixtures: Fixtures, rng: random.Random) -> Scenario:
+    async def attempt(call: Call) -> int | None:
+        response = await call("POST", "/message/request", json={"provider_id": str(rng.choice(fixtures.provider_ids)), "message": "Hi, I'm looking for a therapist and would like to talk. " * 3},
+                              headers=bearer(rng.choice(fixtures.patient_tokens)))
+        return 1 if response.status_code == 200 else None
+    return Scenario(attempt, args.requests, args.warmup)
+
+def drain(args, fixtures: Fixtures, rng: random.Random) -> Scenario:
+    devices = list(fixtures.drain_devices)
+    async def attempt(call: Call) -> int | None:
+        token, device_id = devices.pop(0)
+        drained = 0
+        while True:
+            page = await call("POST", "/message/contact/pending", params={"device_id": str(device_id), "limit": MAX_CONTACT_PAGE}, headers=bearer(token))
+            if page.status_code != 200:
+                return None
+            ids = [request["id"] for request in page.json()["requests"]]
+            if not ids:
+                return drained
+            ack = await call("POST", "/message/contact/ack", json={"device_id": str(device_id), "ids": ids}, headers=bearer(token))
+            if ack.status_code != 200:
+                return None
+            drained += len(ack.json()["acknowledged"])
+    return Scenario(attempt, len(devices)) # no warmup, every device can only be drained once
+
+SCENARIOS: Dict[str, Callable[..., Scenario]] = {"locate": locate, "login": login, "contact": contact, "drain": drain}
+
+async def run_scenario(name: str, scenario: Scenario, call: Call, concurrency: int) -> Dict:
+    for _ in range(scenario.warmup):
+        await scenario.attempt(call)
+
+    latencies: List[float] = []
+    items, failed = 0, 0
+    remaining = scenario.requests
+    async def user():
+        nonlocal remaining, items, failed
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                handled = await scenario.attempt(call)
+            except httpx.HTTPError:
+                handled = None
+            if handled is None:
+                failed += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+                items += handled
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"scenario": name, "requests": scenario.requests, "completed": len(latencies), "failed": failed, "items": items, "wall_seconds": elapsed,
+            "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0, "items_per_s": items / elapsed if elapsed else 0.0, "latency": percentiles(latencies)}
+
+async def run_scenarios(args, fixtures: Fixtures, call: Call, concurrency: int) -> List[Dict]:
+    rng = random.Random(args.seed)
+    return [await run_scenario(name, SCENARIOS[name](args, fixtures, rng), call, concurrency) for name in args.scenarios]
+
+def in_process(args, fixtures: Fixtures) -> List[Dict]:
+    settings.rate_limit_backend = "off"
+    maps_client.transport = StubMapsTransport(latency=args.maps_latency) # the client is created on first use, after this
+    with TestClient(app) as client:
+        async def call(method: str, path: str, **kwargs) -> httpx.Response:
+            return client.request(method, path, **kwargs) # blocks, which is fine one request at a time
+        return asyncio.run(run_scenarios(args, fixtures, call, 1))
+
+async def over_http(args, fixtures: Fixtures) -> List[Dict]:
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        async def call(method: str, path: str, **kwargs) -> httpx.Response:
+            return await client.request(method, path, **kwargs)
+        return await run_scenarios(args, fixtures, call, args.concurrency)
+
+def regressions(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    previous = {result["scenario"]: result for result in baseline["scenarios"]}
+    found = []
+    for result in results:
+        before = previous.get(result["scenario"], {}).get("latency")
+        if not before or not result["latency"]:
+            continue
+        for stat in REGRESSION_STATS:
+            if result["latency"][stat] > before[stat] * (1 + tolerance):
+                found.append(f"{result['scenario']} {stat}: {before[stat]:.1f} -> {result['latency'][stat]:.1f}")
+    return found
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="timed attempts of locate and contact")
+    parser.add_argument("--login-requests", type=int, default=40, help="timed logins, each one a bcrypt verification")
+    parser.add_argument("--drain-devices", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--users", type=int, default=50, help="seeded patients and providers the scenarios pick from")
+    parser.add_argument("--addresses", type=int, default=500, help="distinct street addresses locate searches from")
+    parser.add_argument("--radius", type=int, default=25)
+    parser.add_argument("--maps-latency", type=float, default=0.05, help="in-process: seconds the Maps stub takes to answer")
+    parser.add_argument("--url", help="load a running server instead")
+    parser.add_argument("--concurrency", type=int, default=16, help="with --url: open connections")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown allowed before a stat counts as a regression")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args)
+    started = datetime.utcnow()
+    results = asyncio.run(over_http(args, fixtures)) if args.url else in_process(args, fixtures)
+    report = {"run": {"mode": "http" if args.url else "in_process", "url": args.url, "concurrency": args.concurrency if args.url else 1,
+                      "started": started.isoformat(), "commit": git_commit(), "seeded": fixtures.seeded},
+              "scenarios": results}
+    if args.baseline:
+        with open(args.baseline) as file:
+            report["regressions"] = regressions(results, json.load(file), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    if report.get("regressions"):
+        print(f"Regressions: {'; '.join(report['regressions'])}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
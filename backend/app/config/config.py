@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -9,5 +10,113 @@ class Settings(BaseSettings):
     pass_key: str = ""
     gmaps_key: str = ""
 
+    # Connection pool, sized per worker process. See database.pool
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 30 * 60 # seconds, -1 to never recycle
+    db_pool_pre_ping: bool = True
+    db_pgbouncer: bool = False # let PgBouncer pool (NullPool here) and disable prepared statements
+
+    # How main.py serves the app. "dev" is one auto-reloading process, "production" runs server_workers
+    # processes on uvloop and httptools. Every worker has its own pools and caches, see the README.
+    server_mode: Literal["dev", "production"] = "dev"
+    server_host: str = "0.0.0.0"
+    server_port: int = 8080
+    server_workers: int = 0 # 0 for one per CPU
+    server_backlog: int = 2048
+    server_keep_alive_seconds: int = 75 # above Caddy's upstream keepalive, so Caddy never reuses a connection we closed
+    server_graceful_shutdown_seconds: int = 30 # on SIGTERM, how long in-flight requests get to finish
+    server_limit_concurrency: int | None = None # per worker, further connections get a 503
+    server_access_log: bool = True
+
+    # Startup check of the Alembic revision: "warn" logs when migrations are pending, "fail" refuses to start
+    schema_check: Literal["off", "warn", "fail"] = "warn"
+
+    # Shared secret for /internal/* endpoints, which are disabled while empty
+    internal_key: str = ""
+
+    # Password hashing, see security.passwords. Changing bcrypt_rounds rehashes each user on their next login.
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_max_queue: int = 32 # per server worker, further requests get a 503
+
+    # Access token store, see security.tokens
+    token_digest_key: str = "" # falls back to pass_key
+    token_sweep_seconds: float = 10 * 60
+    token_sweep_batch_size: int = 1000
+
+    # Parsed device public keys kept per worker, see security.messaging
+    public_key_cache_size: int = 4096
+
+    # Contact request retention, see database.retention
+    contact_fingerprint_key: str = "" # falls back to pass_key
+    contact_request_retention_days: float = 14
+    contact_retention_seconds: float = 15 * 60 # 0 leaves culling to the CLI
+    contact_retention_batch_size: int = 1000
+
+    # Token bucket rate limits, see security.rate_limit. Each limit is "<burst>/<seconds to refill it>".
+    # "postgres" shares buckets between workers, "memory" keeps them per worker.
+    rate_limit_backend: Literal["memory", "postgres", "off"] = "memory"
+    rate_limit_memory_entries: int = 100_000
+    trusted_proxies: str = "" # comma separated addresses or networks whose X-Real-IP header is believed, e.g. Caddy's
+    rate_limit_login: str = "10/60" # per client IP
+    rate_limit_signup: str = "5/3600" # per client IP
+    rate_limit_account_deletion: str = "5/3600" # per client IP
+    rate_limit_contact_request: str = "5/3600" # per patient
+    rate_limit_message_send: str = "120/60" # per user
+
+    # Authenticated user cache, see security.user_cache. The TTL also bounds how long a revoked
+    # token can keep working if its notification is lost.
+    auth_cache_max_entries: int = 10_000
+    auth_cache_ttl_seconds: float = 30
+
+    # Google Maps calls, see api.maps. Point the URLs at a local fake to test against injected latency.
+    maps_geocode_url: str = "https://maps.googleapis.com/maps/api/geocode/json"
+    maps_address_validation_url: str = "https://addressvalidation.googleapis.com/v1:validateAddress"
+    maps_max_connections: int = 20 # per worker
+    maps_attempt_timeout_seconds: float = 3
+    maps_deadline_seconds: float = 8 # every attempt of one call, backoff included
+    maps_max_retries: int = 2
+    maps_retry_backoff_seconds: float = 0.25 # doubled per retry, with full jitter
+    maps_breaker_failures: int = 5 # consecutive failed calls that open the circuit
+    maps_breaker_reset_seconds: float = 30 # how long an open circuit fails fast before letting one call through
+
+    # Offline ZIP code centroids, relative to backend/app. See api.zip_centroids
+    zip_centroids_path: str = "data/zip_centroids.bin"
+
+    # Geocode cache, see api.geocode_cache
+    geocode_cache_memory_entries: int = 4096
+    geocode_cache_memory_ttl_seconds: int = 60 * 60
+    geocode_cache_db_ttl_days: int = 90
+    geocode_cache_db_max_rows: int = 100_000
+
+    # "sql" queries Postgres for every search, "memory" answers from api.search_engine
+    provider_search_backend: Literal["sql", "memory"] = "sql"
+    provider_search_sync_seconds: float = 5
+    provider_search_full_reload_seconds: float = 5 * 60
+    provider_search_sync_margin_seconds: float = 60 # reread before the watermark, for transactions that committed late
+
+    # Push delivery of mailbox inserts, see api.mailbox_notifications. The same connection carries
+    # token revocations to the auth cache, and provider deletions to the "memory" search backend.
+    # Without it cache hits recheck the token and deletions wait for a full reload.
+    mailbox_notifications: bool = True
+    db_listen_url: str = "" # direct connection for LISTEN when db_url goes through PgBouncer
+
+    @property
+    def sync_db_url(self) -> str:
+        """db_url with a blocking driver, for Alembic and other sync callers"""
+        return self.db_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+    @property
+    def async_db_url(self) -> str:
+        """db_url with the asyncpg driver, for the request path"""
+        return self.sync_db_url.replace("postgresql+psycopg2://", "postgresql://", 1).replace("postgresql://", "postgresql+asyncpg://", 1)
+
+    @property
+    def listen_db_url(self) -> str:
+        """Plain libpq URL for the LISTEN connection, which asyncpg opens itself"""
+        return (self.db_listen_url or self.db_url).replace("postgresql+asyncpg://", "postgresql://", 1).replace("postgresql+psycopg2://", "postgresql://", 1)
+
 
 settings = Settings()
\ No newline at end of file
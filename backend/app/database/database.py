@@ -1,5 +1,10 @@
+import logging
+import os
+from typing import Any, Dict
+
 from config.config import settings
 from database.models.base import Base
+from database.models.geocode import GeocodeCacheEntry
 from database.models.messaging import (
     ContactMailbox,
     ContactRequest,
@@ -10,21 +15,88 @@ from database.models.messaging import (
 )
 from database.models.patient import Patient
 from database.models.provider import Provider
+from database.models.rate_limit import RateLimitBucket
 from database.models.token import PatientDBToken, ProviderDBToken
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-engine = create_engine(settings.db_url)
-Base.metadata.create_all(engine)
-# Device.metadata.create_all(engine)
-# DeviceSet.metadata.create_all(engine)
-# Mailbox.metadata.create_all(engine)
-# ContactMailbox.metadata.create_all(engine)
-# Message.metadata.create_all(engine)
-# ContactRequest.metadata.create_all(engine)
-# Patient.metadata.create_all(engine)
-# Provider.metadata.create_all(engine)
-# PatientDBToken.metadata.create_all(engine)
-# ProviderDBToken.metadata.create_all(engine)
-
-DBSession: sessionmaker = sessionmaker(engine)
\ No newline at end of file
+from database.pool import instrument_engine, pool_options
+from sqlalchemy import Engine, create_engine, text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import Pool
+
+logger = logging.getLogger(__name__)
+
+# Engines are created on first use rather than at import, so importing the app (or a model, or
+# running Alembic) never touches the database. The schema itself is managed by Alembic only.
+_engine: Engine | None = None
+_async_engine: AsyncEngine | None = None
+
+def get_engine() -> Engine:
+    """Blocking engine, for scripts and other sync callers. Request handlers use get_async_engine."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(settings.sync_db_url, **pool_options(asynchronous=False))
+        instrument_engine(_engine, "sync")
+    return _engine
+
+def get_async_engine() -> AsyncEngine:
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(settings.async_db_url, **pool_options(asynchronous=True))
+        instrument_engine(_async_engine.sync_engine, "async")
+    return _async_engine
+
+def active_pools() -> Dict[str, Pool]:
+    """Pools of the engines created so far in this process, keyed like database.pool.pool_stats"""
+    pools = {}
+    if _engine is not None:
+        pools["sync"] = _engine.pool
+    if _async_engine is not None:
+        pools["async"] = _async_engine.pool
+    return pools
+
+async def dispose_engines():
+    global _engine, _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+class _LazySessionmaker(sessionmaker):
+    """Binds itself to the engine the first time a session is made"""
+    def __call__(self, **local_kw: Any) -> Session:
+        if self.kw.get("bind") is None: # sessionmaker always has the key, set to None until configured
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    def __call__(self, **local_kw: Any) -> AsyncSession:
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_async_engine())
+        return super().__call__(**local_kw)
+
+DBSession: sessionmaker = _LazySessionmaker()
+# Objects stay usable after commit, since lazy loads aren't possible outside the session anyway
+AsyncDBSession: async_sessionmaker = _LazyAsyncSessionmaker(expire_on_commit=False)
+
+async def check_schema_revision() -> bool:
+    """Compares the database's Alembic revision with the newest migration. Tables are never created here,
+    run `alembic upgrade head` for that. Returns whether the schema is current."""
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    app_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = Config(os.path.join(app_directory, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(app_directory, "alembic"))
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    try:
+        async with get_async_engine().connect() as connection:
+            current = set((await connection.execute(text("SELECT version_num FROM alembic_version"))).scalars())
+    except ProgrammingError:
+        current = set() # no alembic_version table, never migrated
+    if current != heads:
+        logger.warning("Database schema is at %s but the newest migration is %s, run `alembic upgrade head`", sorted(current) or "nothing", sorted(heads))
+        return False
+    return True
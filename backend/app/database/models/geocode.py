@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from database.models.base import Base
+from sqlalchemy import DateTime, Float, Integer, String, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class GeocodeCacheEntry(Base):
+    """A previously geocoded search address, keyed on its normalized components. See api.geocode_cache"""
+
+    __tablename__ = "geocode_cache"
+
+    street_address: Mapped[str] = mapped_column(String, primary_key=True)
+    city: Mapped[str] = mapped_column(String, primary_key=True)
+    state_abbreviation: Mapped[str] = mapped_column(String, primary_key=True)
+
+    latitude: Mapped[float] = mapped_column(Float, nullable=False)
+    longitude: Mapped[float] = mapped_column(Float, nullable=False)
+
+    created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=func.now(), index=True)
+    last_hit: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=func.now(), index=True)
+    hits: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
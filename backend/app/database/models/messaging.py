@@ -6,7 +6,7 @@ from uuid import UUID, uuid4
 from database.models.base import UUIDC, Base
 from sqlalchemy import DateTime
 from sqlalchemy import Enum as SQLEnum
-from sqlalchemy import ForeignKey, String, func
+from sqlalchemy import ForeignKey, Index, String, func, text
 from sqlalchemy.dialects.postgresql import BYTEA
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -22,6 +22,9 @@ class UserType(Enum):
 class DeviceSet(Base):
     """The set of devices used by a patient or provider"""
     __tablename__ = "device_sets"
+    # Exactly one of provider_id and patient_id is set, so each index only covers its own kind of user
+    __table_args__ = (Index("ix_device_sets_provider_id", "provider_id", unique=True, postgresql_where=text("provider_id IS NOT NULL")),
+                      Index("ix_device_sets_patient_id", "patient_id", unique=True, postgresql_where=text("patient_id IS NOT NULL")))
 
     id: Mapped[UUID] = mapped_column(UUIDC, primary_key=True, default=uuid4)
 
@@ -46,7 +49,7 @@ class Device(Base):
     signed_pre_key: Mapped[str] = mapped_column(String, nullable=False)
 
     device_set: Mapped[DeviceSet] = relationship(back_populates="devices", uselist=False)
-    device_set_id = mapped_column(ForeignKey("device_sets.id", ondelete='CASCADE'))
+    device_set_id = mapped_column(ForeignKey("device_sets.id", ondelete='CASCADE'), index=True)
 
 class Mailbox(Base):
     """Stores pending messages for a specific device"""
@@ -55,7 +58,7 @@ class Mailbox(Base):
     id: Mapped[UUID] = mapped_column(UUIDC, primary_key=True, default=uuid4)
 
     device: Mapped[Device] = relationship(back_populates="mailbox", uselist=False)
-    device_id: Mapped[UUID] = mapped_column(ForeignKey("devices.id", ondelete='CASCADE'))
+    device_id: Mapped[UUID] = mapped_column(ForeignKey("devices.id", ondelete='CASCADE'), unique=True, index=True)
 
     messages: Mapped[List["Message"]] = relationship(back_populates="mailbox")
 
@@ -66,15 +69,18 @@ class ContactMailbox(Base):
     id: Mapped[UUID] = mapped_column(UUIDC, primary_key=True, default=uuid4)
 
     device: Mapped[Device] = relationship(back_populates="contact_mailbox")
-    device_id: Mapped[UUID] = mapped_column(ForeignKey("devices.id", ondelete='CASCADE'))
+    device_id: Mapped[UUID] = mapped_column(ForeignKey("devices.id", ondelete='CASCADE'), unique=True, index=True)
 
     messages: Mapped[List["ContactRequest"]] = relationship(back_populates="mailbox")
 
 class Message(Base):
     """Stores an encrypted message between a provider and patient"""
     __tablename__ = "messages"
+    # Mailboxes are paged in (created, message_id) order, like contact requests
+    __table_args__ = (Index("ix_messages_mailbox_id_created_message_id", "mailbox_id", "created", "message_id"),)
 
     message_id: Mapped[UUID] = mapped_column(UUIDC, primary_key=True, default=uuid4)
+    created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=func.now(), server_default=func.now())
     message_encrypted: Mapped[bytes] = mapped_column(BYTEA, nullable=False)
 
     sender_id: Mapped[UUID] = mapped_column(UUIDC, nullable=False)
@@ -86,19 +92,24 @@ class Message(Base):
     mailbox: Mapped[Mailbox] = relationship(back_populates="messages")
     mailbox_id: Mapped[UUID] = mapped_column(ForeignKey("mailboxes.id", ondelete='CASCADE'))
 
-# TODO: automatically cull duplicate requests when the therapist pulls them to prevent spam
+# Expired and duplicate requests are culled by database.retention
 # TODO: patient blocklist for therapists? in order to maintain one-way encryption would have to cull when they retrieve the list
-# TODO: auto-cull contact requests older than... two weeks?
 class ContactRequest(Base):
     """Stores a contact request, fully encrypted with the public contact key of the target therapist."""
 
     __tablename__ = "contact_requests"
+    # Pending contact requests are paged per mailbox in (created, id) order
+    __table_args__ = (Index("ix_contact_requests_mailbox_id_created_id", "mailbox_id", "created", "id"),
+                      Index("ix_contact_requests_mailbox_id_sender_fingerprint", "mailbox_id", "sender_fingerprint"))
 
     id: Mapped[UUID] = mapped_column(UUIDC, primary_key=True, default=uuid4)
-    created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=func.now())
+    created: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=func.now(), index=True) # expiry sweeps walk this
 
     mailbox: Mapped[ContactMailbox] = relationship(back_populates="messages") 
     mailbox_id: Mapped[UUID] = mapped_column(ForeignKey("contact_mailboxes.id", ondelete='CASCADE'))
 
-    patient_id_encrypted: Mapped[bytes] = mapped_column(BYTEA, nullable=False)
-    patient_message_encrypted: Mapped[bytes] = mapped_column(BYTEA, nullable=False)
\ No newline at end of file
+    # Legacy two-block format only, the envelope in patient_message_encrypted carries the patient id (see security.messaging)
+    patient_id_encrypted: Mapped[bytes | None] = mapped_column(BYTEA, nullable=True)
+    patient_message_encrypted: Mapped[bytes] = mapped_column(BYTEA, nullable=False)
+    # Keyed, per-mailbox digest of the sender (see security.messaging.contact_fingerprint), only used to find repeat requests
+    sender_fingerprint: Mapped[bytes | None] = mapped_column(BYTEA, nullable=True)
\ No newline at end of file
@@ -22,7 +22,7 @@ class Patient(Base):
     guardian_given_name: Mapped[str] = mapped_column(String(50), nullable = True)
     guardian_family_name: Mapped[str] = mapped_column(String(50), nullable = True)
     
-    email: Mapped[str] = mapped_column(String(254), nullable=False)
+    email: Mapped[str] = mapped_column(String(254), nullable=False, unique=True, index=True) # looked up on every login and sign-up
 
     password_hash: Mapped[str] = mapped_column(String, nullable=False)
 
@@ -1,12 +1,13 @@
+from datetime import datetime
 from enum import Enum
 from typing import List
 from uuid import UUID, uuid4
 
 from database.models.base import UUIDC, Base
 from database.models.messaging import DeviceSet
-from sqlalchemy import Boolean
+from sqlalchemy import BigInteger, Boolean, DateTime
 from sqlalchemy import Enum as SQLEnum
-from sqlalchemy import Float, String
+from sqlalchemy import Float, Index, String, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 
@@ -28,6 +29,8 @@ class Provider(Base):
     """The base data structure representing an individual Provider user."""
 
     __tablename__ = "providers"
+    # Equality filters of the SQL locate query first, then its grid cell prefilter
+    __table_args__ = (Index("ix_providers_search", "provider_type", "state_abbreviation", "grid_cell"),)
 
     #BACKEND REFERENCE
     id: Mapped[UUID] = mapped_column(UUIDC, primary_key=True, default=uuid4)
@@ -49,7 +52,11 @@ class Provider(Base):
     latitude: Mapped[float] = mapped_column(Float, nullable=False)
     longitude: Mapped[float] = mapped_column(Float, nullable=False)
     state_abbreviation: Mapped[str] = mapped_column(String, nullable=False)
+    grid_cell: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True) # see api.geo.grid_cell
 
     #LOGIN DETAILS
-    email: Mapped[str] = mapped_column(String(254), nullable=False)
-    password_hash: Mapped[str] = mapped_column(String, nullable=False)
\ No newline at end of file
+    email: Mapped[str] = mapped_column(String(254), nullable=False, unique=True, index=True) # looked up on every login and sign-up
+    password_hash: Mapped[str] = mapped_column(String, nullable=False)
+
+    #BOOKKEEPING
+    updated: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=func.now(), onupdate=func.now(), index=True) # lets api.search_engine pull only changed rows
\ No newline at end of file
@@ -0,0 +1,16 @@
+from datetime import datetime
+
+from database.models.base import Base
+from sqlalchemy import Boolean, DateTime, Float, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class RateLimitBucket(Base):
+    """A token bucket of the shared rate limiter backend, see security.rate_limit"""
+
+    __tablename__ = "rate_limit_buckets"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True) # "<limit name>:<client ip or user>"
+    tokens: Mapped[float] = mapped_column(Float, nullable=False)
+    allowed: Mapped[bool] = mapped_column(Boolean, nullable=False) # whether the last take succeeded
+    updated: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
@@ -1,20 +1,24 @@
-from uuid import UUID, uuid4
+from datetime import datetime
+from uuid import UUID
 
 from database.models.base import UUIDC, Base
-from sqlalchemy import String
+from sqlalchemy import DateTime
+from sqlalchemy.dialects.postgresql import BYTEA
 from sqlalchemy.orm import Mapped, mapped_column
 
 
+# A row is an unrevoked access token. token_digest is an HMAC-SHA256 of the token (see security.tokens),
+# so a token can be looked up with one indexed equality check.
 class PatientDBToken(Base):
     __tablename__ = "patient_access_tokens"
 
-    instance_id: Mapped[UUID] = mapped_column(UUIDC, primary_key=True, default=uuid4)
-    user_id: Mapped[UUID] = mapped_column(UUIDC, nullable=False)
-    token_hash: Mapped[str] = mapped_column(String, primary_key=True)
+    token_digest: Mapped[bytes] = mapped_column(BYTEA, primary_key=True)
+    user_id: Mapped[UUID] = mapped_column(UUIDC, nullable=False, index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True) # UTC
 
 class ProviderDBToken(Base):
     __tablename__ = "provider_access_tokens"
 
-    instance_id: Mapped[UUID] = mapped_column(UUIDC, primary_key=True, default=uuid4)
-    user_id: Mapped[UUID] = mapped_column(UUIDC, nullable=False)
-    token_hash: Mapped[str] = mapped_column(String, primary_key=True)
\ No newline at end of file
+    token_digest: Mapped[bytes] = mapped_column(BYTEA, primary_key=True)
+    user_id: Mapped[UUID] = mapped_column(UUIDC, nullable=False, index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True) # UTC
\ No newline at end of file
@@ -0,0 +1,119 @@
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict
+from uuid import uuid4
+
+from config.config import settings
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, Pool, QueuePool
+
+
+@dataclass
+class PoolStats:
+    """Counters for one engine's pool in this process. Multiply by the worker count when sizing against max_connections."""
+    checkouts: int = 0
+    checkins: int = 0
+    connections_opened: int = 0
+    invalidations: int = 0
+    checkout_timeouts: int = 0
+    checkout_wait_seconds_total: float = 0.0
+    checkout_wait_seconds_max: float = 0.0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def in_use(self) -> int:
+        return self.checkouts - self.checkins
+
+    def record_wait(self, seconds: float, timed_out: bool):
+        with self._lock:
+            self.checkout_wait_seconds_total += seconds
+            self.checkout_wait_seconds_max = max(self.checkout_wait_seconds_max, seconds)
+            if timed_out:
+                self.checkout_timeouts += 1
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+class _TimedCheckoutMixin:
+    """Times how long each checkout waits on the pool's queue (the part pool_timeout bounds)"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs) # type: ignore
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get() # type: ignore
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - start, timed_out)
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool, keep counting into the same stats
+        pool = super().recreate() # type: ignore
+        pool.stats = self.stats
+        return pool
+
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+class InstrumentedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+# One entry per instrumented engine, reported by the internal stats endpoint
+pool_stats: Dict[str, PoolStats] = {}
+
+def pool_options(asynchronous: bool) -> Dict[str, Any]:
+    """create_engine/create_async_engine keyword arguments for the configured pool"""
+    if settings.db_pgbouncer:
+        # PgBouncer does the pooling. In transaction mode a server connection can change between
+        # statements, so asyncpg can't keep prepared statements around either.
+        options: Dict[str, Any] = {"poolclass": NullPool}
+        if asynchronous:
+            options["connect_args"] = {"statement_cache_size": 0,
+                                       "prepared_statement_cache_size": 0,
+                                       "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__"}
+        return options
+
+    return {
+        "poolclass": InstrumentedAsyncAdaptedQueuePool if asynchronous else InstrumentedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+def instrument_engine(engine: Engine, name: str) -> PoolStats:
+    """Attaches pool event counters to a (sync, or AsyncEngine.sync_engine) engine"""
+    stats = pool_stats[name] = PoolStats()
+    if isinstance(engine.pool, _TimedCheckoutMixin):
+        engine.pool.stats = stats
+
+    event.listen(engine, "connect", lambda *args: stats.increment("connections_opened"))
+    event.listen(engine, "checkout", lambda *args: stats.increment("checkouts"))
+    event.listen(engine, "checkin", lambda *args: stats.increment("checkins"))
+    event.listen(engine, "invalidate", lambda *args: stats.increment("invalidations"))
+    event.listen(engine, "soft_invalidate", lambda *args: stats.increment("invalidations"))
+    return stats
+
+def describe_pool(pool: Pool, stats: PoolStats) -> Dict[str, Any]:
+    description: Dict[str, Any] = asdict(stats)
+    description["pool_class"] = type(pool).__name__
+    description["in_use"] = stats.in_use
+    description["checkout_wait_seconds_avg"] = stats.checkout_wait_seconds_total / stats.checkouts if stats.checkouts else 0.0
+    if isinstance(pool, QueuePool):
+        description["size"] = pool.size()
+        description["checked_out"] = pool.checkedout()
+        description["overflow"] = max(pool.overflow(), 0) # negative while below pool_size
+        description["idle"] = pool.checkedin()
+    return description
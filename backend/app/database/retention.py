@@ -0,0 +1,88 @@
+"""Culls expired and repeated contact requests.
+
+Runs inside the app lifespan every contact_retention_seconds, or once from the command line:
+
+    cd backend/app && python -m database.retention
+"""
+import asyncio
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+
+from config.config import settings
+from database.database import AsyncDBSession
+from database.models.messaging import ContactRequest
+from sqlalchemy import and_, delete, exists, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class RetentionStats:
+    runs: int = 0
+    failures: int = 0
+    expired_deleted_total: int = 0
+    duplicates_deleted_total: int = 0
+    last_run_expired_deleted: int = 0
+    last_run_duplicates_deleted: int = 0
+    last_run_seconds: float = 0.0
+
+retention_stats = RetentionStats()
+
+async def _delete_batches(candidates, batch_size: int) -> int:
+    """Deletes candidate ids one committed batch at a time, so no lock is held for long. Rows another
+    transaction has locked (e.g. a device acknowledging them) are skipped rather than waited on."""
+    deleted = 0
+    while True:
+        session: AsyncSession
+        async with AsyncDBSession() as session:
+            batch = candidates.limit(batch_size).with_for_update(skip_locked=True)
+            count = (await session.execute(delete(ContactRequest).where(ContactRequest.id.in_(batch)))).rowcount
+            await session.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+async def delete_expired_contact_requests(retention: timedelta, batch_size: int = settings.contact_retention_batch_size) -> int:
+    cutoff = datetime.utcnow() - retention
+    return await _delete_batches(select(ContactRequest.id).where(ContactRequest.created < cutoff), batch_size)
+
+async def delete_duplicate_contact_requests(batch_size: int = settings.contact_retention_batch_size) -> int:
+    """Keeps only the newest request per (mailbox, sender fingerprint)"""
+    newer = aliased(ContactRequest)
+    has_newer = exists().where(and_(newer.mailbox_id == ContactRequest.mailbox_id,
+                                    newer.sender_fingerprint == ContactRequest.sender_fingerprint,
+                                    tuple_(newer.created, newer.id) > tuple_(ContactRequest.created, ContactRequest.id)))
+    return await _delete_batches(select(ContactRequest.id).where(ContactRequest.sender_fingerprint.is_not(None), has_newer), batch_size)
+
+async def cull_contact_requests(retention: timedelta | None = None, batch_size: int = settings.contact_retention_batch_size) -> RetentionStats:
+    """One retention pass. Returns the updated process-wide stats."""
+    start = time.perf_counter()
+    expired = await delete_expired_contact_requests(retention or timedelta(days=settings.contact_request_retention_days), batch_size)
+    duplicates = await delete_duplicate_contact_requests(batch_size)
+
+    retention_stats.runs += 1
+    retention_stats.expired_deleted_total += expired
+    retention_stats.duplicates_deleted_total += duplicates
+    retention_stats.last_run_expired_deleted = expired
+    retention_stats.last_run_duplicates_deleted = duplicates
+    retention_stats.last_run_seconds = time.perf_counter() - start
+    logger.info("Contact request retention deleted %d expired and %d duplicate requests in %.2fs", expired, duplicates, retention_stats.last_run_seconds)
+    return retention_stats
+
+async def keep_culling_contact_requests():
+    """Runs for the lifetime of the app when contact_retention_seconds is set"""
+    while True:
+        await asyncio.sleep(settings.contact_retention_seconds)
+        try:
+            await cull_contact_requests()
+        except Exception:
+            retention_stats.failures += 1
+            logger.exception("Contact request retention failed")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(asdict(asyncio.run(cull_contact_requests())), indent=2))
@@ -1,11 +1,33 @@
+import os
+
 import uvicorn
+from config.config import settings
+
+
+def server_options() -> dict:
+    """uvicorn.run arguments for settings.server_mode"""
+    if settings.server_mode == "dev":
+        return {"reload": True}
+    # Workers are spawned, not forked, so each one imports the app itself and creates its own
+    # engines, pools and caches on first use. SIGTERM to this process is passed on to every worker,
+    # which stops accepting, finishes in-flight requests and runs the lifespan shutdown.
+    return {
+        "workers": settings.server_workers or os.cpu_count() or 1,
+        "loop": "uvloop",
+        "http": "httptools",
+        "backlog": settings.server_backlog,
+        "timeout_keep_alive": settings.server_keep_alive_seconds,
+        "timeout_graceful_shutdown": settings.server_graceful_shutdown_seconds,
+        "limit_concurrency": settings.server_limit_concurrency,
+        "access_log": settings.server_access_log,
+    }
 
 if __name__ == "__main__":
     uvicorn.run(
         "api.api:app",
-        host="0.0.0.0",
-        port=8080,
-        reload=True,
+        host=settings.server_host,
+        port=settings.server_port,
         root_path="/api",
         proxy_headers=True,
+        **server_options(),
     )
@@ -0,0 +1,64 @@
+"""Prometheus metrics shared by every layer of the app.
+
+HTTP metrics are recorded by api.metrics.MetricsMiddleware, which also opens a RequestMetrics for
+each request. Every SQL statement run while it's open (on any engine, sync or async) adds to its
+query count and DB time, so /metrics shows how much of each route's latency is Postgres. Other
+expensive steps are wrapped in time_operation, and upstream calls recorded in external_call_seconds.
+
+With several server workers, set PROMETHEUS_MULTIPROC_DIR to a shared empty directory so a scrape
+sees every worker's samples rather than whichever worker answers it.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+request_seconds = Histogram("helpalign_http_request_duration_seconds", "Time to respond, by route template", ["method", "route"])
+requests_total = Counter("helpalign_http_requests_total", "Responses, by route template and status code", ["method", "route", "status"])
+
+db_queries_per_request = Histogram("helpalign_db_queries_per_request", "SQL statements executed while handling one request", ["route"],
+                                   buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100))
+db_seconds_per_request = Histogram("helpalign_db_seconds_per_request", "Time spent executing SQL while handling one request", ["route"])
+db_query_seconds = Histogram("helpalign_db_query_seconds", "Execution time of each SQL statement, in requests or background jobs")
+
+operation_seconds = Histogram("helpalign_operation_seconds", "Time spent in expensive in-process steps", ["operation"])
+external_call_seconds = Histogram("helpalign_external_call_seconds", "Upstream calls, retries and backoff included", ["service", "operation", "outcome"])
+
+@dataclass
+class RequestMetrics:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+# Set by the middleware for the duration of a request. SQLAlchemy runs the async engine's cursor
+# events in a greenlet that shares the request task's context, so the hooks below see it too.
+current_request: ContextVar[RequestMetrics | None] = ContextVar("current_request", default=None)
+
+@contextmanager
+def time_operation(operation: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        operation_seconds.labels(operation).observe(time.perf_counter() - start)
+
+# The start time rides on the statement's execution context, so a statement that fails leaves nothing behind
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    db_query_seconds.observe(elapsed)
+    request = current_request.get()
+    if request is not None:
+        request.queries += 1
+        request.db_seconds += elapsed
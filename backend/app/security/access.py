@@ -1,27 +1,44 @@
 import datetime
-from typing import Annotated
+import hmac
+from typing import Annotated, Type
+from uuid import UUID, uuid4
 
 from config.config import settings
-from database.database import DBSession
+from database.database import AsyncDBSession
 from database.models.patient import Patient
 from database.models.provider import Provider
-from fastapi import Depends, HTTPException, status
+from database.models.token import PatientDBToken, ProviderDBToken
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from security.tokens import token_digest
+from security.user_cache import (
+    REVOCATIONS_CHANNEL,
+    PatientSnapshot,
+    ProviderSnapshot,
+    UserKind,
+    token_revocation,
+    user_cache,
+    user_revocation,
+)
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 provider_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="provider/token")
 patient_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="patient/token")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 class Token(BaseModel):
     access_token: str
     token_type: str
 
-def get_current_provider(token: Annotated[str, Depends(provider_oauth2_scheme)]):
+async def token_is_live(token_model: Type[PatientDBToken] | Type[ProviderDBToken], digest: bytes) -> bool:
+    """Whether the token is unrevoked and unexpired, with one primary key lookup"""
+    session: AsyncSession
+    async with AsyncDBSession() as session:
+        return (await session.scalar(select(token_model.user_id).where(token_model.token_digest == digest, token_model.expires_at > datetime.datetime.utcnow()))) is not None
+
+async def get_current_provider(token: Annotated[str, Depends(provider_oauth2_scheme)]) -> ProviderSnapshot:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -30,26 +47,44 @@ def get_current_provider(token: Annotated[str, Depends(provider_oauth2_scheme)])
     try:
         payload = jwt.decode(token, settings.pass_key, algorithms=["HS256"])
         id: str = payload.get("sub")
-        if id is None:
+        exp: int = payload.get("exp")
+        if id is None or exp is None:
+            raise credentials_exception
+        digest = token_digest(token)
+        snapshot = user_cache.get("provider", digest)
+        if snapshot is not None:
+            if user_cache.revocations_pushed:
+                return snapshot
+            # Revocations on other workers aren't reaching this one, so check the token itself
+            if await token_is_live(ProviderDBToken, digest):
+                return snapshot
+            user_cache.invalidate_token("provider", digest)
             raise credentials_exception
-        user: Provider = None
-        session: Session
-        with DBSession() as session:
-            user = session.get(Provider, id)
+        generation = user_cache.generation
+        user: Provider | None = None
+        session: AsyncSession
+        async with AsyncDBSession() as session:
+            # User lookup and revocation check in one indexed query
+            user = (await session.scalars(select(Provider)
+                                          .join(ProviderDBToken, ProviderDBToken.user_id == Provider.id)
+                                          .where(ProviderDBToken.token_digest == digest, Provider.id == id, ProviderDBToken.expires_at > datetime.datetime.utcnow())
+                                          )).one_or_none()
         if user is None:
             raise credentials_exception
-        return user
+        snapshot = ProviderSnapshot(id=user.id, email=user.email, given_name=user.given_name, family_name=user.family_name)
+        user_cache.put("provider", digest, exp, snapshot, generation)
+        return snapshot
     except JWTError:
         raise credentials_exception
 
 
-def get_current_active_provider(
-    current_user: Annotated[Provider, Depends(get_current_provider)]
+async def get_current_active_provider(
+    current_user: Annotated[ProviderSnapshot, Depends(get_current_provider)]
 ):
     # TODO: add support for disabling providers
     return current_user
 
-def get_current_patient(token: Annotated[str, Depends(patient_oauth2_scheme)]):
+async def get_current_patient(token: Annotated[str, Depends(patient_oauth2_scheme)]) -> PatientSnapshot:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -58,37 +93,69 @@ def get_current_patient(token: Annotated[str, Depends(patient_oauth2_scheme)]):
     try:
         payload = jwt.decode(token, settings.pass_key, algorithms=["HS256"])
         id: str = payload.get("sub")
-        if id is None:
+        exp: int = payload.get("exp")
+        if id is None or exp is None:
             raise credentials_exception
-        user: Patient = None
-        session: Session
-        with DBSession() as session:
-            user = session.get(Patient, id)
+        digest = token_digest(token)
+        snapshot = user_cache.get("patient", digest)
+        if snapshot is not None:
+            if user_cache.revocations_pushed:
+                return snapshot
+            # Revocations on other workers aren't reaching this one, so check the token itself
+            if await token_is_live(PatientDBToken, digest):
+                return snapshot
+            user_cache.invalidate_token("patient", digest)
+            raise credentials_exception
+        generation = user_cache.generation
+        user: Patient | None = None
+        session: AsyncSession
+        async with AsyncDBSession() as session:
+            # User lookup and revocation check in one indexed query
+            user = (await session.scalars(select(Patient)
+                                          .join(PatientDBToken, PatientDBToken.user_id == Patient.id)
+                                          .where(PatientDBToken.token_digest == digest, Patient.id == id, PatientDBToken.expires_at > datetime.datetime.utcnow())
+                                          )).one_or_none()
         if user is None:
             raise credentials_exception
-        return user
+        snapshot = PatientSnapshot(id=user.id, email=user.email, given_name=user.given_name, family_name=user.family_name)
+        user_cache.put("patient", digest, exp, snapshot, generation)
+        return snapshot
     except JWTError:
         raise credentials_exception
 
 
-def get_current_active_patient(
-    current_user: Annotated[Patient, Depends(get_current_patient)]
+async def get_current_active_patient(
+    current_user: Annotated[PatientSnapshot, Depends(get_current_patient)]
 ):
     # TODO: add support for disabling patients
     return current_user
 
+async def require_internal_key(x_internal_key: Annotated[str | None, Header()] = None, authorization: Annotated[str | None, Header()] = None):
+    """Guards operational endpoints. Disabled entirely until settings.internal_key is set. The key may also come as
+    a bearer token, which is what Prometheus can send when scraping /metrics."""
+    if x_internal_key is None and authorization is not None and authorization.lower().startswith("bearer "):
+        x_internal_key = authorization[len("bearer "):]
+    if not settings.internal_key or x_internal_key is None or not hmac.compare_digest(x_internal_key, settings.internal_key):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
 def create_access_token(data: dict, expires_delta: datetime.timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.datetime.utcnow() + expires_delta
     else:
         expire = datetime.datetime.utcnow() + datetime.timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid4().hex}) # unique, or two logins in the same second would get the same token
     encoded_jwt = jwt.encode(to_encode, settings.pass_key, algorithm="HS256")
     return encoded_jwt
 
-def get_hash(value):
-    return pwd_context.hash(value)
+def revoke_token_in_cache(kind: UserKind, token: str):
+    """Drops a token's cached user, so the next request with it goes back to the database"""
+    user_cache.invalidate_token(kind, token_digest(token))
+
+async def notify_token_revoked(session: AsyncSession, kind: UserKind, token: str):
+    """Has every worker drop the token's cached user once the session commits"""
+    await session.execute(select(func.pg_notify(REVOCATIONS_CHANNEL, token_revocation(kind, token_digest(token)))))
 
-def verify_password(password, password_hash):
-    return pwd_context.verify(password, password_hash)
\ No newline at end of file
+async def notify_user_changed(session: AsyncSession, kind: UserKind, user_id: UUID):
+    """Has every worker drop the user's cached snapshots once the session commits"""
+    await session.execute(select(func.pg_notify(REVOCATIONS_CHANNEL, user_revocation(kind, user_id))))
@@ -1,7 +1,76 @@
+import hashlib
+import hmac
+import os
+import struct
 from base64 import b64decode
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+from uuid import UUID
 
-import rsa
+from config.config import settings
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from monitoring.metrics import time_operation
 
+# Contact envelope, stored in ContactRequest.patient_message_encrypted:
+#
+#   magic (4) | wrapped key length (2) | RSA-OAEP(SHA-256) wrapped AES-256 key | nonce (12) | AES-GCM ciphertext and tag
+#
+# The plaintext is the patient's 16 byte id followed by the UTF-8 message, and everything before
+# the nonce is authenticated as associated data. Rows written before the envelope existed hold
+# the id and message as separate PKCS#1 v1.5 RSA blocks, with patient_id_encrypted set.
+ENVELOPE_MAGIC = b"HAE\x01"
+_HEADER = struct.Struct("!4sH")
+_NONCE_SIZE = 12
+_OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
 
-def encrypt_contact(contents: str, public_key: str):
-    return rsa.encrypt(contents.encode(), rsa.PublicKey._load_pkcs1_pem(b64decode(public_key)))
\ No newline at end of file
+@lru_cache(maxsize=settings.public_key_cache_size)
+def load_public_key(public_key: str) -> RSAPublicKey:
+    """Parses a device's base64-wrapped PKCS#1 PEM key. Cached, since the same provider keys are used over and over."""
+    key = serialization.load_pem_public_key(b64decode(public_key))
+    if not isinstance(key, RSAPublicKey):
+        raise ValueError("Device public key is not an RSA key")
+    return key
+
+def contact_fingerprint(mailbox_id: UUID, patient_id: UUID) -> bytes:
+    """Same for every request a patient sends to one mailbox, but can't be reversed or matched across mailboxes without the key"""
+    key = (settings.contact_fingerprint_key or settings.pass_key).encode()
+    return hmac.new(key, mailbox_id.bytes + patient_id.bytes, hashlib.sha256).digest()
+
+def encrypt_contact(patient_id: UUID, message: str, public_key: str) -> bytes:
+    return encrypt_contact_batch(patient_id, message, [public_key])[0]
+
+@time_operation("encrypt_contact")
+def encrypt_contact_batch(patient_id: UUID, message: str, public_keys: Sequence[str]) -> List[bytes]:
+    """Seals one contact request for each device key. The message is encrypted once and only the
+    content key is wrapped per device, so the cost barely depends on the message length."""
+    content_key = AESGCM.generate_key(bit_length=256)
+    plaintext = patient_id.bytes + message.encode()
+    aesgcm = AESGCM(content_key)
+
+    envelopes = []
+    for public_key in public_keys:
+        wrapped_key = load_public_key(public_key).encrypt(content_key, _OAEP)
+        header = _HEADER.pack(ENVELOPE_MAGIC, len(wrapped_key)) + wrapped_key
+        nonce = os.urandom(_NONCE_SIZE)
+        envelopes.append(header + nonce + aesgcm.encrypt(nonce, plaintext, header))
+    return envelopes
+
+def is_envelope(patient_message_encrypted: bytes) -> bool:
+    return patient_message_encrypted[:len(ENVELOPE_MAGIC)] == ENVELOPE_MAGIC
+
+def decrypt_contact(patient_id_encrypted: bytes | None, patient_message_encrypted: bytes, private_key: RSAPrivateKey) -> Tuple[UUID, str]:
+    """Reference decoder for device clients, accepting both the envelope and the legacy two-block format"""
+    if patient_id_encrypted is not None and not is_envelope(patient_message_encrypted):
+        patient_id = private_key.decrypt(patient_id_encrypted, padding.PKCS1v15())
+        return UUID(patient_id.decode()), private_key.decrypt(patient_message_encrypted, padding.PKCS1v15()).decode()
+
+    _, wrapped_key_length = _HEADER.unpack_from(patient_message_encrypted)
+    nonce_start = _HEADER.size + wrapped_key_length
+    header = patient_message_encrypted[:nonce_start]
+    nonce = patient_message_encrypted[nonce_start:nonce_start + _NONCE_SIZE]
+    content_key = private_key.decrypt(header[_HEADER.size:], _OAEP)
+    plaintext = AESGCM(content_key).decrypt(nonce, patient_message_encrypted[nonce_start + _NONCE_SIZE:], header)
+    return UUID(bytes=plaintext[:16]), plaintext[16:].decode()
@@ -0,0 +1,67 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+from config.config import settings
+from fastapi import HTTPException, status
+from monitoring.metrics import time_operation
+from passlib.context import CryptContext
+
+# Pinning min and max to the configured work factor makes any hash made with a different
+# factor "need update", so it gets transparently rehashed on the user's next login.
+pwd_context = CryptContext(schemes=["bcrypt"],
+                           deprecated="auto",
+                           bcrypt__default_rounds=settings.bcrypt_rounds,
+                           bcrypt__min_rounds=settings.bcrypt_rounds,
+                           bcrypt__max_rounds=settings.bcrypt_rounds)
+
+# Run inside the pool's worker processes, so they must stay importable top-level functions
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, str | None]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+class PasswordHasher:
+    """Runs bcrypt in a dedicated, size-limited process pool, so a burst of logins or sign-ups
+    can't tie up the threadpool (or the GIL) that every other request needs.
+
+    At most max_queue jobs may be queued or running per worker. Past that, callers get a 503
+    instead of waiting in an ever-growing queue. The pool is started on first use, so each
+    server worker gets its own after fork."""
+
+    def __init__(self, workers: int = settings.password_hash_workers, max_queue: int = settings.password_hash_max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending = 0
+
+    async def hash(self, password: str) -> str:
+        with time_operation("bcrypt_hash"): # queueing for a pool process included
+            return await self._submit(_hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> Tuple[bool, str | None]:
+        """Returns whether the password matches, and a new hash if the stored one was made with an outdated work factor"""
+        with time_operation("bcrypt_verify"):
+            return await self._submit(_verify_and_update, password, password_hash)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _submit(self, function, *args):
+        if self._pending >= self.max_queue:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="SERVER BUSY, TRY AGAIN", headers={"Retry-After": "1"})
+        if self._executor is None:
+            # spawn rather than fork: forking a process that's running an event loop and threads isn't safe
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        finally:
+            self._pending -= 1
+
+password_hasher = PasswordHasher()
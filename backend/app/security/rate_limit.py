@@ -0,0 +1,164 @@
+import ipaddress
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache
+from typing import Annotated, Callable, Dict, Protocol, Tuple
+
+from config.config import settings
+from database.database import AsyncDBSession
+from database.models.rate_limit import RateLimitBucket
+from fastapi import Depends, HTTPException, Request, status
+from security.access import get_current_active_patient, get_current_active_provider
+from security.user_cache import PatientSnapshot, ProviderSnapshot
+from sqlalchemy import case, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class RateLimit:
+    capacity: float # burst size
+    refill_per_second: float
+
+    @classmethod
+    def parse(cls, limit: str) -> "RateLimit":
+        """"10/60" allows bursts of 10, refilling at 10 per 60 seconds"""
+        requests, seconds = limit.split("/")
+        return cls(capacity=float(requests), refill_per_second=float(requests) / float(seconds))
+
+class BucketStore(Protocol):
+    async def take(self, key: str, limit: RateLimit) -> float:
+        """Takes one token from the key's bucket. Returns 0 if allowed, otherwise the seconds until a token is available."""
+        ...
+
+class MemoryBucketStore:
+    """Per-worker buckets. With N workers a client effectively gets N times the limit."""
+
+    def __init__(self, max_entries: int = settings.rate_limit_memory_entries):
+        self.max_entries = max_entries
+        self._buckets: OrderedDict[str, Tuple[float, float]] = OrderedDict() # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit.capacity, now))
+            tokens = min(limit.capacity, tokens + (now - updated) * limit.refill_per_second)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            self._buckets.move_to_end(key)
+            # The least recently used bucket is the one most likely to be full anyway
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / limit.refill_per_second
+
+class PostgresBucketStore:
+    """Buckets in the rate_limit_buckets table, shared by every worker. Each take is one upsert round trip."""
+
+    SWEEP_EVERY_N_TAKES = 1000
+
+    def __init__(self, session_factory: Callable[[], AsyncSession] = AsyncDBSession, idle_seconds: float = 24 * 60 * 60):
+        self.session_factory = session_factory
+        self.idle_seconds = idle_seconds
+        self._takes_since_sweep = 0
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        session: AsyncSession
+        async with self.session_factory() as session:
+            tokens, allowed = (await session.execute(self._take_statement(key, limit))).one()
+            await session.commit()
+
+            self._takes_since_sweep += 1
+            if self._takes_since_sweep >= self.SWEEP_EVERY_N_TAKES:
+                self._takes_since_sweep = 0
+                await self.sweep(session)
+        return 0.0 if allowed else (1 - tokens) / limit.refill_per_second
+
+    @staticmethod
+    def _take_statement(key: str, limit: RateLimit):
+        # Inside ON CONFLICT DO UPDATE the table's own columns are the existing row
+        refilled = func.least(limit.capacity, RateLimitBucket.tokens + func.extract("epoch", func.clock_timestamp() - RateLimitBucket.updated) * limit.refill_per_second)
+        return (insert(RateLimitBucket)
+                .values(key=key, tokens=limit.capacity - 1, allowed=True, updated=func.clock_timestamp())
+                .on_conflict_do_update(index_elements=[RateLimitBucket.key],
+                                       set_={"tokens": case((refilled >= 1, refilled - 1), else_=refilled),
+                                             "allowed": refilled >= 1,
+                                             "updated": func.clock_timestamp()})
+                .returning(RateLimitBucket.tokens, RateLimitBucket.allowed))
+
+    async def sweep(self, session: AsyncSession) -> int:
+        """Deletes buckets idle long enough to have refilled completely"""
+        deleted = (await session.execute(delete(RateLimitBucket).where(RateLimitBucket.updated < func.clock_timestamp() - timedelta(seconds=self.idle_seconds)))).rowcount
+        await session.commit()
+        return deleted
+
+class RateLimiter:
+    """Token buckets for the limits configured in Settings, by name. If the shared store can't be reached requests are let through, a
+    rate limiter outage shouldn't take logins down with it."""
+
+    def __init__(self, store: BucketStore):
+        self.store = store
+        self._limits: Dict[str, RateLimit] = {}
+
+    def limit(self, name: str) -> RateLimit:
+        if name not in self._limits:
+            self._limits[name] = RateLimit.parse(getattr(settings, f"rate_limit_{name}"))
+        return self._limits[name]
+
+    async def check(self, name: str, key: str):
+        try:
+            retry_after = await self.store.take(f"{name}:{key}", self.limit(name))
+        except Exception:
+            logger.exception("Rate limit store failed, allowing the request")
+            return
+        if retry_after > 0:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="TOO MANY REQUESTS", headers={"Retry-After": str(math.ceil(retry_after))})
+
+@lru_cache(maxsize=1)
+def _trusted_networks(trusted_proxies: str) -> Tuple[ipaddress.IPv4Network | ipaddress.IPv6Network, ...]:
+    return tuple(ipaddress.ip_network(proxy.strip(), strict=False) for proxy in trusted_proxies.split(",") if proxy.strip())
+
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _trusted_networks(settings.trusted_proxies))
+
+def client_ip(request: Request) -> str:
+    """The address Caddy puts in X-Real-IP when the request came through one of trusted_proxies, otherwise the
+    peer address. Anyone else could set the header to get a fresh bucket per request."""
+    peer = request.client.host if request.client else None
+    forwarded = request.headers.get("x-real-ip")
+    if forwarded and peer and is_trusted_proxy(peer):
+        return forwarded
+    return peer or "unknown"
+
+rate_limiter = RateLimiter(PostgresBucketStore() if settings.rate_limit_backend == "postgres" else MemoryBucketStore())
+
+def limit_by_ip(name: str):
+    """Route dependency applying the rate_limit_<name> setting per client IP"""
+    async def dependency(request: Request):
+        if settings.rate_limit_backend != "off":
+            await rate_limiter.check(name, client_ip(request))
+    return Depends(dependency)
+
+def limit_by_patient(name: str):
+    """Route dependency applying the rate_limit_<name> setting per authenticated patient"""
+    async def dependency(patient: Annotated[PatientSnapshot, Depends(get_current_active_patient)]):
+        if settings.rate_limit_backend != "off":
+            await rate_limiter.check(name, f"patient:{patient.id}")
+    return Depends(dependency)
+
+def limit_by_provider(name: str):
+    """Route dependency applying the rate_limit_<name> setting per authenticated provider"""
+    async def dependency(provider: Annotated[ProviderSnapshot, Depends(get_current_active_provider)]):
+        if settings.rate_limit_backend != "off":
+            await rate_limiter.check(name, f"provider:{provider.id}")
+    return Depends(dependency)
@@ -0,0 +1,42 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+from datetime import datetime
+from typing import Type
+
+from config.config import settings
+from database.database import AsyncDBSession
+from database.models.token import PatientDBToken, ProviderDBToken
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+def token_digest(token: str) -> bytes:
+    """Keyed digest of an access token. Unlike a salted password hash it's deterministic, so it can be indexed."""
+    key = (settings.token_digest_key or settings.pass_key).encode()
+    return hmac.new(key, token.encode(), hashlib.sha256).digest()
+
+async def sweep_expired_tokens(token_model: Type[PatientDBToken] | Type[ProviderDBToken], batch_size: int = settings.token_sweep_batch_size) -> int:
+    """Deletes expired token rows in batches, committing after each so locks stay short. Returns the number deleted."""
+    deleted = 0
+    while True:
+        session: AsyncSession
+        async with AsyncDBSession() as session:
+            expired = select(token_model.token_digest).where(token_model.expires_at < datetime.utcnow()).limit(batch_size)
+            count = (await session.execute(delete(token_model).where(token_model.token_digest.in_(expired)))).rowcount
+            await session.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+async def keep_sweeping_expired_tokens():
+    """Runs for the lifetime of the app"""
+    while True:
+        await asyncio.sleep(settings.token_sweep_seconds)
+        try:
+            for token_model in (PatientDBToken, ProviderDBToken):
+                await sweep_expired_tokens(token_model)
+        except Exception:
+            logger.exception("Expired token sweep failed")
\ No newline at end of file
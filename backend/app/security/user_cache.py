@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Literal, Set, Tuple
+from uuid import UUID
+
+from api.mailbox_notifications import DISCONNECTED, RESYNC
+from config.config import settings
+
+UserKind = Literal["provider", "patient"]
+TokenKey = Tuple[UserKind, bytes] # (kind, token digest), see security.tokens.token_digest
+
+# Notified on logout and on user changes, so every worker's cache drops the entries. Payloads are
+# made by token_revocation and user_revocation.
+REVOCATIONS_CHANNEL = "auth_revocations"
+
+def token_revocation(kind: UserKind, digest: bytes) -> str:
+    return f"{kind} token {digest.hex()}"
+
+def user_revocation(kind: UserKind, user_id: UUID | str) -> str:
+    return f"{kind} user {user_id}"
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """The fields request handlers need from the authenticated user, detached from any session"""
+    id: UUID
+    email: str
+    given_name: str
+    family_name: str
+
+class ProviderSnapshot(UserSnapshot):
+    pass
+
+class PatientSnapshot(UserSnapshot):
+    pass
+
+@dataclass
+class UserCacheStats:
+    hits: int = 0 # each one saves the lookup, unless revocations aren't being pushed and the token is checked
+    misses: int = 0
+    invalidations: int = 0
+
+class AuthenticatedUserCache:
+    """Bounded TTL cache of user snapshots, keyed on the token's digest.
+
+    Entries live for at most ttl_seconds and never past the token's own expiry. Logouts and user
+    changes are NOTIFYed on REVOCATIONS_CHANNEL and every worker drops the entries through
+    on_revocation, so while revocations_pushed a hit needs no database at all. A revocation can
+    still be missed between the connection dropping and the listener noticing; ttl_seconds bounds
+    how long such a token keeps working. While not pushed, callers check the token row on hits."""
+
+    def __init__(self, max_entries: int = settings.auth_cache_max_entries, ttl_seconds: float = settings.auth_cache_ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stats = UserCacheStats()
+
+        self._entries: OrderedDict[TokenKey, Tuple[UserSnapshot, float]] = OrderedDict()
+        self._tokens_by_user: Dict[Tuple[UserKind, str], Set[bytes]] = {}
+        self._lock = threading.Lock()
+        self.revocations_pushed = False
+        self.generation = 0 # bumped by every invalidation, see put
+
+    def get(self, kind: UserKind, digest: bytes) -> UserSnapshot | None:
+        key = (kind, digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._discard(key)
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def put(self, kind: UserKind, digest: bytes, exp: int, snapshot: UserSnapshot, generation: int | None = None):
+        """Pass the generation read before looking the user up: if anything was invalidated since, the
+        lookup may have raced a revocation and the snapshot isn't cached"""
+        ttl = min(self.ttl_seconds, exp - time.time())
+        if ttl <= 0:
+            return
+        key = (kind, digest)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (snapshot, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            self._tokens_by_user.setdefault((kind, str(snapshot.id)), set()).add(digest)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_token(self, kind: UserKind, digest: bytes):
+        with self._lock:
+            self.generation += 1
+            if (kind, digest) in self._entries:
+                self._discard((kind, digest))
+                self.stats.invalidations += 1
+
+    def invalidate_user(self, kind: UserKind, user_id: UUID | str):
+        """Drops every cached token of the user, e.g. after an email change or deletion"""
+        sub = str(user_id)
+        with self._lock:
+            self.generation += 1
+            for digest in list(self._tokens_by_user.get((kind, sub), ())):
+                self._discard((kind, digest))
+                self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def on_revocation(self, payload: str):
+        """Handler for REVOCATIONS_CHANNEL, see api.mailbox_notifications.MailboxListener.on"""
+        if payload == RESYNC:
+            self.clear() # anything could have been revoked while not listening
+            self.revocations_pushed = True
+        elif payload == DISCONNECTED:
+            self.revocations_pushed = False
+        else:
+            kind, target, value = payload.split(" ")
+            if target == "token":
+                self.invalidate_token(kind, bytes.fromhex(value))
+            else:
+                self.invalidate_user(kind, value)
+
+    def _discard(self, key: TokenKey):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        kind, digest = key
+        user_key = (kind, str(entry[0].id))
+        digests = self._tokens_by_user.get(user_key)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._tokens_by_user[user_key]
+
+user_cache = AuthenticatedUserCache()
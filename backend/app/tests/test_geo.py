@@ -0,0 +1,43 @@
+import numpy as np
+from api.geo import bounding_box, grid_cell, grid_cells_in_box, haversine_miles
+
+
+def points_around(latitude: float, longitude: float, radius_miles: float, count: int = 2000):
+    """Random points within radius_miles of the origin, by rejection from a generous square"""
+    rng = np.random.default_rng(0)
+    latitudes = latitude + rng.uniform(-1, 1, count * 4) * radius_miles / 40
+    longitudes = (longitude + rng.uniform(-1, 1, count * 4) * radius_miles / 10 + 180) % 360 - 180
+    inside = haversine_miles(latitude, longitude, latitudes, longitudes) <= radius_miles
+    return latitudes[inside][:count], longitudes[inside][:count]
+
+def in_box(box, latitude: float, longitude: float) -> bool:
+    min_latitude, max_latitude, min_longitude, max_longitude = box
+    in_longitude = min_longitude <= longitude <= max_longitude if min_longitude <= max_longitude else longitude >= min_longitude or longitude <= max_longitude
+    return min_latitude <= latitude <= max_latitude and in_longitude
+
+def test_haversine_known_distance():
+    # Troy, NY to New York City is about 140 miles
+    assert abs(haversine_miles(42.7284, -73.6918, np.array([40.7128]), np.array([-74.0060]))[0] - 140) < 2
+
+def test_box_and_cells_cover_every_point_in_radius():
+    for latitude, longitude, radius in ((42.7, -73.7, 25), (64.8, -147.7, 100), (-33.9, 151.2, 50), (0.0, 0.0, 10)):
+        box = bounding_box(latitude, longitude, radius)
+        cells = set(grid_cells_in_box(box))
+        for point_latitude, point_longitude in zip(*points_around(latitude, longitude, radius)):
+            assert in_box(box, point_latitude, point_longitude)
+            assert grid_cell(point_latitude, point_longitude) in cells
+
+def test_box_wraps_at_the_antimeridian():
+    # West of Adak, Alaska, where a 100 mile radius reaches past 180 degrees
+    box = bounding_box(51.9, -179.5, 100)
+    assert box[2] > box[3]
+    cells = set(grid_cells_in_box(box))
+    for point_latitude, point_longitude in zip(*points_around(51.9, -179.5, 100)):
+        assert in_box(box, point_latitude, point_longitude)
+        assert grid_cell(point_latitude, point_longitude) in cells
+    assert grid_cell(51.9, 179.9) in cells
+
+def test_box_near_the_pole_spans_every_longitude():
+    box = bounding_box(89.9, 10.0, 50)
+    assert (box[2], box[3]) == (-180.0, 180.0)
+    assert box[1] == 90.0
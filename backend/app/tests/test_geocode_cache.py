@@ -0,0 +1,81 @@
+import asyncio
+
+from api import geocode_cache
+from api.geocode_cache import GeocodeCache
+
+
+class StubClient:
+    """Geocodes every street address to a fixed point, except "Nowhere" which has no results"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def geocode(self, address: str):
+        self.calls.append(address)
+        if address.startswith("Nowhere"):
+            return []
+        return [{"geometry": {"location": {"lat": 42.7, "lng": -73.7}}}]
+
+class StubResult:
+    def one_or_none(self):
+        return None # the geocode_cache table never has the address, so only the memory tier can hit
+
+class StubSession:
+    def __init__(self, statements: list):
+        self.statements = statements
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return StubResult()
+
+    async def commit(self):
+        pass
+
+def cache_for(statements: list | None = None, **options) -> GeocodeCache:
+    statements = [] if statements is None else statements
+    return GeocodeCache(client=StubClient(), session_factory=lambda: StubSession(statements), **{"memory_entries": 2, "memory_ttl_seconds": 60, **options})
+
+def geocode(cache: GeocodeCache, street_address: str):
+    return asyncio.run(cache.geocode(street_address, "Troy", "NY"))
+
+def test_memory_evicts_the_least_recently_used():
+    cache = cache_for()
+    geocode(cache, "1 Main St")
+    geocode(cache, "2 Main St")
+    geocode(cache, "1 main st.") # a hit, normalized to the first, which is now the most recent
+    geocode(cache, "3 Main St") # evicts the second
+    assert cache.stats.memory_hits == 1
+    assert len(cache.client.calls) == 3
+
+    geocode(cache, "1 Main St")
+    assert cache.stats.memory_hits == 2
+    geocode(cache, "2 Main St")
+    assert len(cache.client.calls) == 4
+
+def test_memory_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(geocode_cache.time, "monotonic", lambda: now[0])
+    cache = cache_for(memory_ttl_seconds=60)
+    geocode(cache, "1 Main St")
+    now[0] += 59
+    assert geocode(cache, "1 Main St") == (42.7, -73.7)
+    assert cache.stats.memory_hits == 1
+    now[0] += 2
+    geocode(cache, "1 Main St")
+    assert cache.stats.memory_hits == 1 and cache.stats.misses == 2
+    assert len(cache.client.calls) == 2
+
+def test_addresses_without_a_geocode_are_not_cached():
+    statements = []
+    cache = cache_for(statements)
+    assert geocode(cache, "Nowhere") is None
+    assert geocode(cache, "Nowhere") is None
+    assert len(cache.client.calls) == 2
+    assert cache.stats.misses == 2
+    assert len(statements) == 2 # only the two lookups, nothing was inserted
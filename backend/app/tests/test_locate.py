@@ -0,0 +1,40 @@
+from uuid import UUID, uuid4
+
+import numpy as np
+import pytest
+from api.routes.locate import InvalidCursorException, decode_cursor, encode_cursor, rank_by_distance
+
+
+def test_cursor_round_trip():
+    provider_id = uuid4()
+    assert decode_cursor(encode_cursor(12.375, provider_id)) == (12.375, provider_id)
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "AAAA"])
+def test_bad_cursor(cursor: str):
+    with pytest.raises(InvalidCursorException):
+        decode_cursor(cursor)
+
+def columns(points):
+    ids = np.array([UUID(int=i + 1).bytes for i in range(len(points))], dtype="S16")
+    return ids, np.array([point[0] for point in points]), np.array([point[1] for point in points])
+
+def test_rank_by_distance_orders_and_filters_by_radius():
+    origin = (42.0, -73.0)
+    ids, latitudes, longitudes = columns([(42.3, -73.0), (42.1, -73.0), (45.0, -73.0), (42.2, -73.0)]) # the third is about 207 miles away
+    page, distances, has_more = rank_by_distance(origin, 50, ids, latitudes, longitudes, limit=10)
+    assert page == [1, 3, 0]
+    assert list(distances[page]) == sorted(distances[page])
+    assert not has_more
+
+def test_rank_by_distance_pages_through_ties_without_skipping():
+    # Every point at the same distance, so only the id orders them
+    ids, latitudes, longitudes = columns([(42.1, -73.0)] * 7)
+    seen = []
+    after = None
+    while True:
+        page, distances, has_more = rank_by_distance((42.0, -73.0), 50, ids, latitudes, longitudes, limit=3, after=after)
+        seen += page
+        if not has_more:
+            break
+        after = (float(distances[page[-1]]), UUID(bytes=bytes(ids[page[-1]]).ljust(16, b"\x00")))
+    assert seen == list(range(7))
@@ -0,0 +1,141 @@
+import asyncio
+from datetime import timedelta
+from uuid import uuid4
+
+import asyncpg
+import pytest
+from api.mailbox_notifications import DISCONNECTED, RESYNC, MailboxListener, mailbox_channel
+from api.routes import message
+from config.config import settings
+from fastapi import FastAPI, HTTPException, WebSocketDisconnect, status
+from fastapi.testclient import TestClient
+from security.access import create_access_token
+from security.user_cache import ProviderSnapshot
+
+
+class FakeConnection:
+    def __init__(self):
+        self.channels = {}
+        self.terminated = None
+
+    def add_termination_listener(self, callback):
+        self.terminated = callback
+
+    async def add_listener(self, channel, callback):
+        self.channels[channel] = callback
+
+    async def remove_listener(self, channel, callback):
+        del self.channels[channel]
+
+    async def close(self):
+        pass
+
+def test_subscribing_is_not_held_up_by_a_slow_connect(monkeypatch):
+    connecting = asyncio.Event()
+    proceed = asyncio.Event()
+    connection = FakeConnection()
+    async def connect(dsn):
+        connecting.set()
+        await proceed.wait()
+        return connection
+    monkeypatch.setattr(asyncpg, "connect", connect)
+
+    async def scenario():
+        listener = MailboxListener(dsn="postgresql://unused")
+        runner = asyncio.create_task(listener.run())
+        await connecting.wait()
+        mailbox_id = uuid4()
+        # Subscribes while the connection is still being made
+        async with asyncio.timeout(1), listener.subscribe([mailbox_id]) as subscription:
+            assert await subscription.wait() == {RESYNC}
+            proceed.set()
+            while not listener.connected:
+                await asyncio.sleep(0)
+            assert mailbox_channel(mailbox_id) in connection.channels # listened to once connected
+            connection.channels[mailbox_channel(mailbox_id)](connection, 0, mailbox_channel(mailbox_id), "message")
+            assert await subscription.wait() == {"message"}
+        assert connection.channels == {}
+        runner.cancel()
+
+    asyncio.run(scenario())
+
+def test_handlers_get_their_channel_and_the_connection_state(monkeypatch):
+    connections = []
+    async def connect(dsn):
+        connections.append(FakeConnection())
+        return connections[-1]
+    monkeypatch.setattr(asyncpg, "connect", connect)
+
+    async def scenario():
+        listener = MailboxListener(dsn="postgresql://unused", reconnect_seconds=0)
+        payloads = []
+        listener.on("provider_deletions", payloads.append)
+        runner = asyncio.create_task(listener.run())
+        while not listener.connected:
+            await asyncio.sleep(0)
+        connection = connections[0]
+        connection.channels["provider_deletions"](connection, 0, "provider_deletions", "abc")
+        assert payloads == [RESYNC, "abc"]
+
+        connection.terminated(connection)
+        while len(connections) < 2 or not listener.connected:
+            await asyncio.sleep(0)
+        assert payloads == [RESYNC, "abc", DISCONNECTED, RESYNC]
+        assert "provider_deletions" in connections[1].channels
+        runner.cancel()
+
+    asyncio.run(scenario())
+
+class FakeResult:
+    def first(self):
+        return (uuid4(), uuid4())
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def execute(self, statement):
+        return FakeResult()
+
+@pytest.fixture
+def subscribe_client(monkeypatch):
+    """A client for the subscribe socket, with the device lookup faked and tokens rechecked every 50ms"""
+    monkeypatch.setattr(settings, "pass_key", "test-key")
+    monkeypatch.setattr(message, "AsyncDBSession", FakeSession)
+    monkeypatch.setattr(message, "SUBSCRIBE_RECHECK_SECONDS", 0.05)
+    app = FastAPI()
+    app.include_router(message.router)
+    return TestClient(app)
+
+def provider_token(lifetime: timedelta) -> str:
+    return create_access_token({"sub": str(uuid4())}, lifetime)
+
+def test_subscription_closes_when_the_token_expires(subscribe_client, monkeypatch):
+    async def authenticate(token):
+        return ProviderSnapshot(id=uuid4(), email="p@example.com", given_name="Given", family_name="Family")
+    monkeypatch.setattr(message, "get_current_provider", authenticate)
+    token = provider_token(timedelta(seconds=1))
+    with subscribe_client.websocket_connect(f"/message/subscribe/provider?device_id={uuid4()}") as websocket:
+        websocket.send_text(token)
+        assert websocket.receive_json() == {"mailbox": RESYNC}
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+    assert closed.value.code == status.WS_1008_POLICY_VIOLATION and closed.value.reason == "TOKEN EXPIRED"
+
+def test_subscription_closes_when_the_token_is_revoked(subscribe_client, monkeypatch):
+    checks = []
+    async def authenticate(token):
+        checks.append(token)
+        if len(checks) > 2:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED) # logged out after the first recheck
+        return ProviderSnapshot(id=uuid4(), email="p@example.com", given_name="Given", family_name="Family")
+    monkeypatch.setattr(message, "get_current_provider", authenticate)
+    with subscribe_client.websocket_connect(f"/message/subscribe/provider?device_id={uuid4()}") as websocket:
+        websocket.send_text(provider_token(timedelta(minutes=30)))
+        assert websocket.receive_json() == {"mailbox": RESYNC}
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+    assert closed.value.code == status.WS_1008_POLICY_VIOLATION and closed.value.reason == "TOKEN REVOKED"
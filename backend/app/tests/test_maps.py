@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from api import maps
+from api.maps import CircuitBreaker, MapsClient, MapsUnavailableException
+
+GEOCODE_BODY = {"status": "OK", "results": [{"geometry": {"location": {"lat": 42.7, "lng": -73.7}}}]}
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=3, reset_seconds=60)
+    assert not breaker.record_failure()
+    breaker.record_success() # resets the count
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_breaker_lets_one_trial_through_when_half_open():
+    breaker = CircuitBreaker(failures=1, reset_seconds=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow() # only one trial at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def test_breaker_release_ends_the_trial_without_a_verdict():
+    breaker = CircuitBreaker(failures=1, reset_seconds=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+def client_for(responses, **options) -> MapsClient:
+    """A client whose upstream answers with the given statuses in turn"""
+    statuses = iter(responses)
+    def handler(request: httpx.Request) -> httpx.Response:
+        status_code = next(statuses)
+        return httpx.Response(status_code, json=GEOCODE_BODY if status_code == 200 else {"error_message": "injected"})
+    options = {"retry_backoff_seconds": 0.001, "breaker": CircuitBreaker(failures=100), **options}
+    return MapsClient(key="test", transport=httpx.MockTransport(handler), **options)
+
+def geocode(client: MapsClient, address: str = "1 Main St, Troy, NY"):
+    async def call():
+        try:
+            return await client.geocode(address)
+        finally:
+            await client.aclose()
+    return asyncio.run(call())
+
+def test_retries_absorb_transient_failures():
+    client = client_for([503, 429, 200], max_retries=2)
+    assert geocode(client) == GEOCODE_BODY["results"]
+    assert client.stats.retries == 2
+
+def test_gives_up_after_max_retries():
+    client = client_for([503, 503, 503], max_retries=2)
+    with pytest.raises(MapsUnavailableException):
+        geocode(client)
+    assert client.stats.upstream_attempts == 3
+    assert client.stats.failures == 1
+
+def test_bad_key_is_not_retried():
+    client = client_for([403, 200], max_retries=2)
+    with pytest.raises(MapsUnavailableException):
+        geocode(client)
+    assert client.stats.upstream_attempts == 1
+
+def test_open_circuit_fails_without_a_request():
+    client = client_for([503], max_retries=0, breaker=CircuitBreaker(failures=1, reset_seconds=60))
+    with pytest.raises(MapsUnavailableException):
+        geocode(client)
+    with pytest.raises(MapsUnavailableException, match="circuit open"):
+        geocode(client)
+    assert client.stats.upstream_attempts == 1
+    assert client.stats.breaker_rejections == 1
+
+def test_no_retry_once_the_backoff_would_pass_the_deadline(monkeypatch):
+    monkeypatch.setattr(maps.random, "uniform", lambda low, high: high) # no jitter
+    client = client_for([503, 200], max_retries=2, retry_backoff_seconds=10, deadline_seconds=0.5)
+    started = time.monotonic()
+    with pytest.raises(MapsUnavailableException):
+        geocode(client)
+    assert client.stats.upstream_attempts == 1
+    assert time.monotonic() - started < 0.5
+
+def test_body_that_is_not_an_object_is_unavailable():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=["not", "an", "object"])
+    client = MapsClient(key="test", transport=httpx.MockTransport(handler), max_retries=1, retry_backoff_seconds=0.001, breaker=CircuitBreaker(failures=100))
+    with pytest.raises(MapsUnavailableException):
+        geocode(client)
+    assert client.stats.upstream_attempts == 2 # retried, like a body that isn't JSON
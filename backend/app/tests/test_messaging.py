@@ -0,0 +1,39 @@
+from base64 import b64encode
+from uuid import uuid4
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from security.messaging import decrypt_contact, encrypt_contact_batch, is_envelope
+
+
+@pytest.fixture(scope="module")
+def private_keys():
+    return [rsa.generate_private_key(public_exponent=65537, key_size=2048) for _ in range(2)]
+
+def upload_format(private_key) -> str:
+    return b64encode(private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.PKCS1)).decode()
+
+def test_envelope_round_trip_for_every_device(private_keys):
+    patient_id = uuid4()
+    message = "Hello! I'd like to book a first session. " * 20 # longer than one RSA block
+    envelopes = encrypt_contact_batch(patient_id, message, [upload_format(key) for key in private_keys])
+    assert len(envelopes) == 2 and envelopes[0] != envelopes[1]
+    for private_key, envelope in zip(private_keys, envelopes):
+        assert is_envelope(envelope)
+        assert decrypt_contact(None, envelope, private_key) == (patient_id, message)
+
+def test_envelope_header_is_authenticated(private_keys):
+    envelope = bytearray(encrypt_contact_batch(uuid4(), "hi", [upload_format(private_keys[0])])[0])
+    envelope[-1] ^= 1
+    with pytest.raises(InvalidTag):
+        decrypt_contact(None, bytes(envelope), private_keys[0])
+
+def test_legacy_two_block_format(private_keys):
+    patient_id = uuid4()
+    public_key = private_keys[0].public_key()
+    patient_id_encrypted = public_key.encrypt(str(patient_id).encode(), padding.PKCS1v15())
+    message_encrypted = public_key.encrypt("an old request".encode(), padding.PKCS1v15())
+    assert not is_envelope(message_encrypted) or message_encrypted[:4] != b"HAE\x01"
+    assert decrypt_contact(patient_id_encrypted, message_encrypted, private_keys[0]) == (patient_id, "an old request")
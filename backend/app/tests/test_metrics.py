@@ -0,0 +1,57 @@
+from api.metrics import UNMATCHED_ROUTE, MetricsMiddleware
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from monitoring.metrics import current_request
+from prometheus_client import REGISTRY, generate_latest
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import create_engine, text
+
+ROUTE = "/metrics-test/{thing_id}"
+
+def sample(name: str, **labels) -> float:
+    """The value scraped for the sample, 0 if it hasn't been recorded yet"""
+    for family in text_string_to_metric_families(generate_latest(REGISTRY).decode()):
+        for found in family.samples:
+            if found.name == name and found.labels == labels:
+                return found.value
+    return 0.0
+
+def client() -> TestClient:
+    engine = create_engine("sqlite://")
+    app = FastAPI()
+
+    @app.get(ROUTE)
+    async def thing(thing_id: int):
+        with engine.connect() as connection: # the cursor hooks count these against the request
+            for _ in range(thing_id):
+                connection.execute(text("SELECT 1"))
+        return {"thing_id": thing_id}
+
+    app.add_middleware(MetricsMiddleware)
+    return TestClient(app)
+
+def test_requests_are_labelled_with_the_route_template():
+    before = sample("helpalign_http_requests_total", method="GET", route=ROUTE, status="200")
+    test_client = client()
+    assert test_client.get("/metrics-test/1").status_code == 200
+    assert test_client.get("/metrics-test/2").status_code == 200
+    assert sample("helpalign_http_requests_total", method="GET", route=ROUTE, status="200") == before + 2
+    assert sample("helpalign_http_requests_total", method="GET", route="/metrics-test/1", status="200") == 0
+
+def test_unknown_paths_share_the_unmatched_label():
+    before = sample("helpalign_http_requests_total", method="GET", route=UNMATCHED_ROUTE, status="404")
+    test_client = client()
+    assert test_client.get("/no/such/path").status_code == 404
+    assert test_client.get("/another/missing/path").status_code == 404
+    assert sample("helpalign_http_requests_total", method="GET", route=UNMATCHED_ROUTE, status="404") == before + 2
+
+def test_queries_are_counted_per_request():
+    count = sample("helpalign_db_queries_per_request_count", route=ROUTE)
+    queries = sample("helpalign_db_queries_per_request_sum", route=ROUTE)
+    test_client = client()
+    test_client.get("/metrics-test/3")
+    test_client.get("/metrics-test/0")
+    assert sample("helpalign_db_queries_per_request_count", route=ROUTE) == count + 2
+    assert sample("helpalign_db_queries_per_request_sum", route=ROUTE) == queries + 3
+    assert sample("helpalign_db_queries_per_request_bucket", route=ROUTE, le="0.0") >= 1 # the request that ran none
+    assert current_request.get() is None # queries outside a request aren't counted against one
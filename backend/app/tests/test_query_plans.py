@@ -0,0 +1,135 @@
+"""Query plan regression check for the hot lookups.
+
+Seeds a few thousand rows into every table involved (inside a transaction that is rolled back
+afterwards), ANALYZEs them, then EXPLAINs each hot query and fails if any of them plans a
+sequential scan. Skipped unless db_url points at a database migrated to head:
+
+    cd backend/app && alembic upgrade head && db_url=postgresql://... python -m pytest tests/test_query_plans.py
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+from uuid import uuid4
+
+import pytest
+from api.geo import bounding_box, grid_cell, grid_cells_in_box
+from config.config import settings
+from database.database import get_engine
+from database.models.base import UUIDC
+from database.models.messaging import (
+    ContactMailbox,
+    ContactRequest,
+    Device,
+    DeviceSet,
+    Mailbox,
+    Message,
+    UserType,
+)
+from database.models.patient import Patient
+from database.models.provider import (
+    AcceptingNewPatients,
+    Provider,
+    ProviderGenderIdentity,
+    ProviderType,
+)
+from database.models.token import ProviderDBToken
+from security.messaging import contact_fingerprint
+from sqlalchemy import Connection, any_, cast, delete, func, insert, literal, select, text, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+
+pytestmark = pytest.mark.skipif(not settings.db_url, reason="needs db_url set to a Postgres migrated to head")
+
+ROWS = 5000 # providers and patients to seed
+
+SEEDED_TABLES = ("providers", "patients", "device_sets", "devices", "mailboxes", "contact_mailboxes", "contact_requests", "messages", "provider_access_tokens")
+
+def seed(connection: Connection, rows: int) -> Dict:
+    """Providers and patients with a device set, device and both mailboxes each, a handful of pending
+    requests and messages per mailbox and a token per provider. Returns ids for the queries to use."""
+    random.seed(0)
+    now = datetime.utcnow()
+    providers, patients, device_sets, devices, mailboxes, contact_mailboxes, requests, messages, tokens = [], [], [], [], [], [], [], [], []
+    for i in range(rows):
+        latitude, longitude = random.uniform(25, 49), random.uniform(-124, -67)
+        provider_id, patient_id = uuid4(), uuid4()
+        providers.append({"id": provider_id, "provider_type": random.choice(list(ProviderType)), "remote_available": random.random() < 0.3,
+                          "accepting_new_patients": random.choice(list(AcceptingNewPatients)), "gender_identity": random.choice(list(ProviderGenderIdentity)),
+                          "given_name": "Plan", "family_name": f"Provider {i}", "formatted_address": f"{i} Main St", "latitude": latitude, "longitude": longitude,
+                          "state_abbreviation": random.choice(["NY", "CA", "TX", "FL", "WA"]), "grid_cell": grid_cell(latitude, longitude),
+                          "email": f"plan-provider-{i}@example.com", "password_hash": "x", "updated": now})
+        patients.append({"id": patient_id, "given_name": "Plan", "family_name": f"Patient {i}", "is_assisted_account": False, "email": f"plan-patient-{i}@example.com", "password_hash": "x"})
+        for user_type, owner in ((UserType.PROVIDER, {"provider_id": provider_id}), (UserType.PATIENT, {"patient_id": patient_id})):
+            device_set_id, device_id, mailbox_id, contact_mailbox_id = uuid4(), uuid4(), uuid4(), uuid4()
+            device_sets.append({"id": device_set_id, "user_type": user_type, "provider_id": None, "patient_id": None, **owner})
+            devices.append({"id": device_id, "identity_public_key": "x", "signed_pre_key": "x", "device_set_id": device_set_id})
+            mailboxes.append({"id": mailbox_id, "device_id": device_id})
+            contact_mailboxes.append({"id": contact_mailbox_id, "device_id": device_id})
+            for j in range(3):
+                requests.append({"id": uuid4(), "created": now - timedelta(days=j * 7), "mailbox_id": contact_mailbox_id, "patient_message_encrypted": b"x",
+                                 "sender_fingerprint": contact_fingerprint(contact_mailbox_id, patient_id)})
+                messages.append({"message_id": uuid4(), "created": now - timedelta(days=j), "message_encrypted": b"x", "sender_id": patient_id, "sender_device_id": device_id,
+                                 "sender_identity_key": "x", "mailbox_id": mailbox_id})
+        tokens.append({"token_digest": uuid4().bytes * 2, "user_id": provider_id, "expires_at": now + timedelta(days=1)})
+
+    for model, values in ((Provider, providers), (Patient, patients), (DeviceSet, device_sets), (Device, devices), (Mailbox, mailboxes),
+                          (ContactMailbox, contact_mailboxes), (ContactRequest, requests), (Message, messages), (ProviderDBToken, tokens)):
+        connection.execute(insert(model.__table__), values)
+    for table_name in SEEDED_TABLES:
+        connection.execute(text(f"ANALYZE {table_name}"))
+    return {"provider": providers[rows // 2], "patient": patients[rows // 2], "device_set": device_sets[rows], "device": devices[rows],
+            "mailbox": mailboxes[rows], "contact_mailbox": contact_mailboxes[rows], "token": tokens[rows // 2], "now": now}
+
+def hot_queries(seeded: Dict) -> Iterator[Tuple[str, object]]:
+    """The statements the request path runs most, with the same shape as in the routes. They're
+    rendered with literal values, so bytes go through decode() rather than a bind parameter."""
+    provider, device, contact_mailbox, mailbox = seeded["provider"], seeded["device"], seeded["contact_mailbox"], seeded["mailbox"]
+    yield "provider login", select(Provider).where(Provider.email == provider["email"])
+    yield "patient login", select(Patient).where(Patient.email == seeded["patient"]["email"])
+    yield "provider token check", (select(Provider).join(ProviderDBToken, ProviderDBToken.user_id == Provider.id)
+                                   .where(ProviderDBToken.token_digest == func.decode(seeded["token"]["token_digest"].hex(), "hex"), Provider.id == provider["id"], ProviderDBToken.expires_at > seeded["now"]))
+    yield "token liveness", select(ProviderDBToken.user_id).where(ProviderDBToken.token_digest == func.decode(seeded["token"]["token_digest"].hex(), "hex"), ProviderDBToken.expires_at > seeded["now"])
+
+    box = bounding_box(provider["latitude"], provider["longitude"], 25)
+    yield "locate (sql backend)", select(Provider.id, Provider.latitude, Provider.longitude).where(
+        Provider.state_abbreviation == provider["state_abbreviation"],
+        Provider.grid_cell.in_(grid_cells_in_box(box)),
+        Provider.latitude.between(box[0], box[1]),
+        Provider.longitude.between(box[2], box[3]),
+        Provider.provider_type == provider["provider_type"])
+
+    yield "contact fan-out", (select(Device.identity_public_key, ContactMailbox.id).join(Device, Device.id == ContactMailbox.device_id)
+                              .join(DeviceSet, DeviceSet.id == Device.device_set_id).where(DeviceSet.provider_id == provider["id"]))
+    yield "device ownership", (select(ContactMailbox.id).join(Device, Device.id == ContactMailbox.device_id).join(DeviceSet, DeviceSet.id == Device.device_set_id)
+                               .where(Device.id == device["id"], DeviceSet.provider_id == provider["id"]))
+    yield "contact page", (select(ContactRequest.id, ContactRequest.created).where(ContactRequest.mailbox_id == contact_mailbox["id"],
+                                                                                  tuple_(ContactRequest.created, ContactRequest.id) > tuple_(literal(seeded["now"] - timedelta(days=30)), literal(uuid4(), UUIDC)))
+                           .order_by(ContactRequest.created, ContactRequest.id).limit(51))
+    yield "contact ack", delete(ContactRequest).where(ContactRequest.id == any_(cast(literal([uuid4()], ARRAY(UUIDC)), ARRAY(UUIDC))), ContactRequest.mailbox_id == contact_mailbox["id"])
+    yield "contact expiry batch", select(ContactRequest.id).where(ContactRequest.created < seeded["now"] - timedelta(days=365)).limit(1000)
+    yield "message inbox", (select(Message.message_id).where(Message.mailbox_id == mailbox["id"],
+                                                             tuple_(Message.created, Message.message_id) > tuple_(literal(seeded["now"] - timedelta(days=30)), literal(uuid4(), UUIDC)))
+                            .order_by(Message.created, Message.message_id).limit(51))
+
+def sequential_scans(plan: Dict) -> List[str]:
+    found = [plan.get("Relation Name", "?")] if plan["Node Type"] == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        found += sequential_scans(child)
+    return found
+
+def explain(connection: Connection, statement) -> Dict:
+    sql = statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    return connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()[0]["Plan"]
+
+@pytest.fixture(scope="module")
+def seeded_connection():
+    with get_engine().connect() as connection:
+        transaction = connection.begin()
+        try:
+            yield connection, seed(connection, ROWS)
+        finally:
+            transaction.rollback() # nothing seeded is kept
+
+def test_hot_queries_use_indexes(seeded_connection):
+    connection, seeded = seeded_connection
+    scans = {name: sequential_scans(explain(connection, statement)) for name, statement in hot_queries(seeded)}
+    assert {name: tables for name, tables in scans.items() if tables} == {}
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import pytest
+from config.config import settings
+from fastapi import HTTPException, Request
+from security.rate_limit import MemoryBucketStore, RateLimit, RateLimiter, client_ip
+
+
+def test_parse():
+    assert RateLimit.parse("10/60") == RateLimit(capacity=10.0, refill_per_second=10 / 60)
+
+def test_bucket_allows_the_burst_then_refuses():
+    store = MemoryBucketStore()
+    limit = RateLimit(capacity=3, refill_per_second=1 / 60)
+    waits = [asyncio.run(store.take("key", limit)) for _ in range(4)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert 59 < waits[3] <= 60
+
+def test_bucket_refills_over_time():
+    store = MemoryBucketStore()
+    limit = RateLimit(capacity=1, refill_per_second=50)
+    assert asyncio.run(store.take("key", limit)) == 0.0
+    assert asyncio.run(store.take("key", limit)) > 0
+    time.sleep(0.05)
+    assert asyncio.run(store.take("key", limit)) == 0.0
+
+def test_buckets_are_per_key_and_bounded():
+    store = MemoryBucketStore(max_entries=2)
+    limit = RateLimit(capacity=1, refill_per_second=1 / 60)
+    for key in ("a", "b", "c"):
+        assert asyncio.run(store.take(key, limit)) == 0.0
+    assert asyncio.run(store.take("c", limit)) > 0
+    assert asyncio.run(store.take("a", limit)) == 0.0 # evicted, so it starts full again
+
+def test_limiter_raises_429_with_retry_after(monkeypatch):
+    limiter = RateLimiter(MemoryBucketStore())
+    monkeypatch.setattr(limiter, "limit", lambda name: RateLimit(capacity=1, refill_per_second=1 / 30))
+    asyncio.run(limiter.check("login", "1.2.3.4"))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(limiter.check("login", "1.2.3.4"))
+    assert error.value.status_code == 429
+    assert error.value.headers["Retry-After"] == "30"
+
+def test_limiter_fails_open_when_the_store_does():
+    class BrokenStore:
+        async def take(self, key, limit):
+            raise ConnectionError
+    asyncio.run(RateLimiter(BrokenStore()).check("login", "1.2.3.4"))
+
+def request_from(peer: str, real_ip: str | None = None) -> Request:
+    headers = [(b"x-real-ip", real_ip.encode())] if real_ip else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 50000)})
+
+def test_client_ip_only_believes_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(settings, "trusted_proxies", "10.0.0.5, 172.16.0.0/12")
+    assert client_ip(request_from("10.0.0.5", "203.0.113.7")) == "203.0.113.7"
+    assert client_ip(request_from("172.18.0.3", "203.0.113.7")) == "203.0.113.7"
+    assert client_ip(request_from("198.51.100.2", "203.0.113.7")) == "198.51.100.2" # spoofed
+    assert client_ip(request_from("10.0.0.5")) == "10.0.0.5"
+
+def test_client_ip_trusts_no_one_by_default(monkeypatch):
+    monkeypatch.setattr(settings, "trusted_proxies", "")
+    assert client_ip(request_from("10.0.0.5", "203.0.113.7")) == "10.0.0.5"
+
+def test_account_deletion_has_its_own_bucket(monkeypatch):
+    limiter = RateLimiter(MemoryBucketStore())
+    monkeypatch.setattr(limiter, "limit", lambda name: RateLimit(capacity=1, refill_per_second=1 / 60))
+    asyncio.run(limiter.check("signup", "1.2.3.4"))
+    asyncio.run(limiter.check("account_deletion", "1.2.3.4"))
+    assert RateLimiter(MemoryBucketStore()).limit("account_deletion") == RateLimit.parse(settings.rate_limit_account_deletion)
@@ -0,0 +1,83 @@
+from uuid import UUID
+
+from api.mailbox_notifications import DISCONNECTED, RESYNC
+from api.search_engine import ProviderSearchEngine
+from database.models.provider import AcceptingNewPatients, ProviderGenderIdentity, ProviderType
+
+EVERYONE = {"gender_identities": list(ProviderGenderIdentity), "accepting_new_patients": list(AcceptingNewPatients), "remote_statuses": [True, False]}
+
+def row(number: int, latitude: float, longitude: float, provider_type: ProviderType = ProviderType.THERAPIST, remote: bool = False, state_abbreviation: str = "NY"):
+    return (UUID(int=number), "Given", f"Family {number}", ProviderGenderIdentity.FEMALE, f"{number} Main St", latitude, longitude,
+            provider_type, AcceptingNewPatients.GREEN, remote, state_abbreviation)
+
+def found(engine: ProviderSearchEngine, latitude: float = 42.7, longitude: float = -73.7, radius: float = 25, state_abbreviation: str = "NY", provider_type: ProviderType = ProviderType.THERAPIST, **filters):
+    candidates = engine.search(latitude, longitude, radius, state_abbreviation=state_abbreviation, provider_type=provider_type, **{**EVERYONE, **filters})
+    return sorted(UUID(bytes=bytes(provider_id).ljust(16, b"\x00")).int for provider_id in candidates.ids)
+
+def test_search_by_radius_and_filters():
+    engine = ProviderSearchEngine()
+    engine.load([row(1, 42.7, -73.7), row(2, 42.8, -73.7), row(3, 44.0, -73.7), row(4, 42.7, -73.7, ProviderType.PSYCHIATRIST), row(5, 42.7, -73.7, remote=True)])
+    assert found(engine) == [1, 2, 5]
+    assert found(engine, provider_type=ProviderType.PSYCHIATRIST) == [4]
+    assert found(engine, remote_statuses=[True]) == [5]
+    assert found(engine, radius=100) == [1, 2, 3, 5]
+
+def test_search_stays_in_the_state_like_the_sql_path():
+    engine = ProviderSearchEngine()
+    engine.load([row(1, 42.7, -73.7), row(2, 42.7, -73.4, state_abbreviation="MA")]) # just across the line
+    assert found(engine) == [1]
+    assert found(engine, state_abbreviation="MA") == [2]
+
+def test_upsert_moves_and_remove_drops():
+    engine = ProviderSearchEngine(rebuild_threshold=1000)
+    engine.load([row(1, 42.7, -73.7), row(2, 42.7, -73.7)])
+    engine.upsert([row(2, 40.7, -74.0), row(3, 42.71, -73.7)]) # moved away, and a new one next door
+    assert found(engine) == [1, 3]
+    assert found(engine, 40.7, -74.0) == [2]
+    engine.remove([UUID(int=1)])
+    assert found(engine) == [3]
+    assert len(engine) == 2
+    assert engine.rows([UUID(int=1).bytes, UUID(int=3).bytes])[0] is None
+
+def test_results_survive_a_rebuild():
+    engine = ProviderSearchEngine(rebuild_threshold=2)
+    engine.load([])
+    for number in range(1, 11):
+        engine.upsert([row(number, 42.7 + number / 1000, -73.7)])
+    engine.remove([UUID(int=number) for number in range(1, 6)])
+    assert engine.needs_rebuild
+    assert engine.rebuild()
+    assert not engine.needs_rebuild
+    assert found(engine) == [6, 7, 8, 9, 10]
+    assert engine.rows([UUID(int=7).bytes])[0][2] == "Family 7"
+
+def test_published_snapshots_never_change():
+    engine = ProviderSearchEngine()
+    engine.load([row(1, 42.7, -73.7)])
+    before = engine._snapshot
+    engine.upsert([row(number, 42.7, -73.7) for number in range(2, 40)]) # grows the columns too
+    engine.remove([UUID(int=1)])
+    assert before.size == 1 and before.alive.tolist() == [True] and list(before.slots) == [UUID(int=1).bytes]
+    assert found(engine) == list(range(2, 40))
+
+def test_rebuild_gives_up_when_a_write_lands_meanwhile(monkeypatch):
+    from api import search_engine
+    engine = ProviderSearchEngine()
+    engine.load([row(1, 42.7, -73.7)])
+    rebuilt = search_engine._rebuilt
+    def racing_rebuilt(snapshot):
+        engine.upsert([row(2, 42.7, -73.7)])
+        return rebuilt(snapshot)
+    monkeypatch.setattr(search_engine, "_rebuilt", racing_rebuilt)
+    assert not engine.rebuild()
+    assert found(engine) == [1, 2]
+
+def test_deletions_from_other_workers():
+    engine = ProviderSearchEngine()
+    engine.load([row(1, 42.7, -73.7), row(2, 42.7, -73.7)])
+    engine.on_deletion(UUID(int=1).hex)
+    assert found(engine) == [2]
+    engine.on_deletion(DISCONNECTED)
+    assert not engine.reload_requested
+    engine.on_deletion(RESYNC) # some may have been missed
+    assert engine.reload_requested
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import timedelta
+from uuid import uuid4
+
+import pytest
+from api.mailbox_notifications import DISCONNECTED, RESYNC
+from config.config import settings
+from fastapi import HTTPException
+from security import access
+from security.access import create_access_token, get_current_provider, revoke_token_in_cache
+from security.tokens import token_digest
+from security.user_cache import (
+    AuthenticatedUserCache,
+    ProviderSnapshot,
+    token_revocation,
+    user_cache,
+    user_revocation,
+)
+
+
+@pytest.fixture
+def live_tokens(monkeypatch):
+    """Stands in for the token tables: digests in the set are live"""
+    monkeypatch.setattr(settings, "pass_key", "test-key")
+    live = set()
+    async def token_is_live(token_model, digest):
+        return digest in live
+    monkeypatch.setattr(access, "token_is_live", token_is_live)
+    user_cache.clear()
+    yield live
+    user_cache.clear()
+    user_cache.revocations_pushed = False
+
+def login(snapshot: ProviderSnapshot, live: set) -> str:
+    """A fresh token, cached as if a request had already looked the user up"""
+    token = create_access_token({"sub": str(snapshot.id)}, timedelta(minutes=30))
+    live.add(token_digest(token))
+    user_cache.put("provider", token_digest(token), int(access.jwt.get_unverified_claims(token)["exp"]), snapshot)
+    return token
+
+def provider() -> ProviderSnapshot:
+    return ProviderSnapshot(id=uuid4(), email="p@example.com", given_name="Given", family_name="Family")
+
+def test_two_logins_in_the_same_second_get_their_own_entries(live_tokens):
+    snapshot = provider()
+    first, second = login(snapshot, live_tokens), login(snapshot, live_tokens)
+    assert first != second
+    revoke_token_in_cache("provider", first)
+    assert user_cache.get("provider", token_digest(first)) is None
+    assert user_cache.get("provider", token_digest(second)) == snapshot
+
+def test_token_revoked_elsewhere_is_refused_on_a_cache_hit(live_tokens):
+    snapshot = provider()
+    token = login(snapshot, live_tokens)
+    assert asyncio.run(get_current_provider(token)) == snapshot
+
+    live_tokens.discard(token_digest(token)) # logged out on another worker, this one's cache still has it
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(get_current_provider(token))
+    assert error.value.status_code == 401
+    assert user_cache.get("provider", token_digest(token)) is None
+
+def test_invalidate_user_drops_every_token():
+    cache = AuthenticatedUserCache(max_entries=10, ttl_seconds=60)
+    snapshot, other = provider(), provider()
+    cache.put("provider", b"a", 2**40, snapshot)
+    cache.put("provider", b"b", 2**40, snapshot)
+    cache.put("provider", b"c", 2**40, other)
+    cache.invalidate_user("provider", snapshot.id)
+    assert cache.get("provider", b"a") is None and cache.get("provider", b"b") is None
+    assert cache.get("provider", b"c") == other
+    assert cache.stats.invalidations == 2
+
+def test_entries_are_bounded_and_never_outlive_the_token():
+    cache = AuthenticatedUserCache(max_entries=2, ttl_seconds=60)
+    for digest in (b"a", b"b", b"c"):
+        cache.put("provider", digest, 2**40, provider())
+    assert cache.get("provider", b"a") is None
+    cache.put("provider", b"expired", 1, provider())
+    assert cache.get("provider", b"expired") is None
+
+def test_pushed_revocations_spare_the_token_check(live_tokens):
+    user_cache.on_revocation(RESYNC)
+    snapshot = provider()
+    token = login(snapshot, live_tokens)
+    live_tokens.clear() # the token check would refuse it, so only the cache can answer
+    assert asyncio.run(get_current_provider(token)) == snapshot
+
+    user_cache.on_revocation(token_revocation("provider", token_digest(token))) # logged out on another worker
+    assert user_cache.get("provider", token_digest(token)) is None
+    user_cache.on_revocation(DISCONNECTED)
+    assert not user_cache.revocations_pushed
+
+def test_revocation_payloads():
+    cache = AuthenticatedUserCache(max_entries=10, ttl_seconds=60)
+    snapshot = provider()
+    cache.put("provider", b"a", 2**40, snapshot)
+    cache.put("provider", b"b", 2**40, snapshot)
+    cache.on_revocation(RESYNC)
+    assert cache.get("provider", b"a") is None # anything may have been missed before listening
+    cache.put("provider", b"a", 2**40, snapshot)
+    cache.put("patient", b"a", 2**40, snapshot)
+    cache.on_revocation(user_revocation("provider", snapshot.id))
+    assert cache.get("provider", b"a") is None and cache.get("patient", b"a") == snapshot
+
+def test_lookup_racing_a_revocation_is_not_cached():
+    cache = AuthenticatedUserCache(max_entries=10, ttl_seconds=60)
+    generation = cache.generation
+    cache.on_revocation(token_revocation("provider", b"a")) # lands while the user is being looked up
+    cache.put("provider", b"a", 2**40, provider(), generation)
+    assert cache.get("provider", b"a") is None
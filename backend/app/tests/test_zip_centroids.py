@@ -0,0 +1,62 @@
+import asyncio
+import os
+
+import pytest
+from api.routes import locate
+from api.zip_centroids import APP_DIRECTORY, InvalidZipCentroidsFileException, ZipCentroids, parse_zip_code, write_zip_centroids
+from config.config import settings
+from database.models.provider import ProviderType
+from fastapi import HTTPException
+
+
+@pytest.mark.parametrize("zip_code, expected", [("12180", 12180), (" 02110 ", 2110), ("12180-3590", 12180), ("1218", None), ("abcde", None), ("", None)])
+def test_parse_zip_code(zip_code, expected):
+    assert parse_zip_code(zip_code) == expected
+
+def test_lookup(tmp_path):
+    path = str(tmp_path / "centroids.bin")
+    write_zip_centroids(path, {12180: (42.7284, -73.6918, "NY"), 2110: (42.3570, -71.0530, "MA"), 99950: (55.5, -131.6, "AK")})
+    centroids = ZipCentroids()
+    centroids.load(path)
+    assert len(centroids) == 3
+    assert centroids.lookup("12180")[:2] == pytest.approx((42.7284, -73.6918)) # stored as float32
+    assert centroids.lookup("02110-1234")[:2] == pytest.approx((42.357, -71.053))
+    assert centroids.lookup("99950").state_abbreviation == "AK"
+    for missing in ("00001", "12181", "99999", "nope"):
+        assert centroids.lookup(missing) is None
+    assert (centroids.stats.hits, centroids.stats.misses) == (3, 4)
+
+def test_empty_file_and_empty_engine(tmp_path):
+    assert ZipCentroids().lookup("12180") is None
+    path = str(tmp_path / "empty.bin")
+    write_zip_centroids(path, {})
+    centroids = ZipCentroids()
+    centroids.load(path)
+    assert centroids.lookup("12180") is None
+
+def test_rejects_a_truncated_file(tmp_path):
+    path = tmp_path / "centroids.bin"
+    write_zip_centroids(str(path), {12180: (42.7, -73.7, "NY")})
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(InvalidZipCentroidsFileException):
+        ZipCentroids().load(str(path))
+
+def test_committed_file_covers_the_states():
+    centroids = ZipCentroids()
+    centroids.load(os.path.join(APP_DIRECTORY, settings.zip_centroids_path))
+    assert len(centroids) > 40_000
+    assert centroids.lookup("12180").state_abbreviation == "NY"
+    assert centroids.lookup("90210").state_abbreviation == "CA"
+
+def test_search_origin_rejects_a_zip_from_another_state(monkeypatch, tmp_path):
+    path = str(tmp_path / "centroids.bin")
+    write_zip_centroids(path, {12180: (42.7, -73.7, "NY")})
+    monkeypatch.setattr(locate, "zip_centroids", ZipCentroids())
+    locate.zip_centroids.load(path)
+    def info(state_abbreviation: str) -> locate.LocateInfo:
+        filters = {"provider_gender_identity_allow": [], "accepting_new_patients_allow": [], "provider_type": ProviderType.THERAPIST, "include_remote": False, "remote_only": False}
+        return locate.LocateInfo(filters=filters, zip_code="12180", state_abbreviation=locate.USStatesEnum[state_abbreviation], radius=25)
+    assert asyncio.run(locate.search_origin(info("NY"))) == pytest.approx((42.7, -73.7))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(locate.search_origin(info("MA")))
+    assert error.value.status_code == 400 and error.value.detail == "BAD FIELD: ZIP_CODE"